@@ -2,109 +2,3674 @@
 # MindMate AI — Final, Polished Super App
 # Save this file and run: python mindmate_ai_super_app_final.py
 # Recommended packages:
-#   gradio requests gtts textblob pillow nltk
+#  gradio gtts textblob pillow nltk numpy pandas
+# Offline speech: install espeak-ng and set MINDMATE_TTS_ENGINE=espeak (or leave it on "auto")
+# Print a per-import / per-phase startup report with: python app.py --startup-timing
 
+import time
+_STARTED = time.perf_counter()
+
+import io
 import os
+import sys
+import zlib
 import re
 import csv
 import json
+import math
+import mmap
+import uuid
+import gzip
+import atexit
 import random
+import shutil
+import bisect
+import sqlite3
+import tempfile
+import multiprocessing
+import heapq
+import hmac
+import asyncio
+import base64
+import hashlib
+import functools
+import threading
+import inspect
+import itertools
+import importlib.util
 import traceback
+import contextlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from array import array
 from datetime import datetime, date, timedelta
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict
+
+STARTUP_TIMINGS = [("import stdlib", time.perf_counter() - _STARTED)]
+
+# What process pool workers run; imports nothing heavy (see process_pool)
+import mindmate_workers
+
+@contextlib.contextmanager
+def startup_phase(label):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS.append((label, time.perf_counter() - t))
+
+def startup_report():
+    lines = ["Startup timing (ms):"]
+    for label, seconds in STARTUP_TIMINGS:
+        lines.append(f"  {label:<32} {seconds * 1000:9.1f}")
+    lines.append(f"  {'total since interpreter start':<32} {(time.perf_counter() - _STARTED) * 1000:9.1f}")
+    return "\n".join(lines)
+
+# NLP & TTS: imported on first use, see get_textblob() / get_gtts()
+_backends = {}
+_backends_lock = threading.Lock()
+
+def _lazy_import(module, attr):
+    """Return module.attr, importing it the first time; None if the package is missing."""
+    # Cache hits skip the lock: a process started mid-import must never wait on it
+    if module in _backends:
+        return _backends[module]
+    with _backends_lock:
+        if module not in _backends:
+            with startup_phase(f"import {module} (first use)"):
+                try:
+                    _backends[module] = getattr(importlib.import_module(module), attr)
+                except Exception:
+                    _backends[module] = None
+        return _backends[module]
+
+def get_textblob():
+    return _lazy_import("textblob", "TextBlob")
+
+def get_gtts():
+    return _lazy_import("gtts", "gTTS")
+
+# UI
+with startup_phase("import gradio"):
+    import gradio as gr
+    import numpy as np
+
+# ---------------------------
+# Paths and data directories
+# ---------------------------
+BASE_DIR = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+# Where all user data lives (MINDMATE_DATA_DIR), data/ next to app.py by default
+DATA_DIR = os.path.abspath(os.environ.get("MINDMATE_DATA_DIR") or os.path.join(BASE_DIR, "data"))
+os.makedirs(DATA_DIR, exist_ok=True)
+
+JOURNAL_PATH = os.path.join(DATA_DIR, "journal.csv")
+VJ_PATH = os.path.join(DATA_DIR, "visual_journal.csv")
+STREAKS_PATH = os.path.join(DATA_DIR, "streaks.csv")
+
+JOURNAL_HEADER = ["timestamp", "text", "mood", "polarity"]
+VJ_HEADER = ["timestamp", "image_path", "caption"]
+STREAKS_HEADER = ["task", "date"]
+# Appends are flushed immediately; fsync is batched on this interval (seconds)
+FSYNC_INTERVAL = float(os.environ.get("MINDMATE_FSYNC_INTERVAL", "1.0"))
+
+# "sqlite" (default) or "csv" (MINDMATE_STORAGE)
+STORAGE_BACKEND = os.environ.get("MINDMATE_STORAGE", "sqlite").strip().lower()
+DB_PATH = os.path.join(DATA_DIR, "mindmate.db")
+GROWTH_PATH = os.path.join(DATA_DIR, "growth.json")
+SEARCH_PATH = os.path.join(DATA_DIR, "search.json")
+SEARCH_LIMIT = 20
+# rank_matches walks weight combinations only up to this many; past it (many
+# query words) it intersects the postings once and keeps the best k
+SEARCH_COMBOS_MAX = 64
+
+# Each user's data lives in its own shard under USERS_DIR. The "default"
+# user (CLI, shared mode) keeps using DATA_DIR itself.
+USERS_DIR = os.path.join(DATA_DIR, "users")
+# Anonymous per-session shards (MINDMATE_USER_SCOPE="session"), deleted once unused this long
+SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
+SESSION_MAX_AGE = float(os.environ.get("MINDMATE_SESSION_MAX_AGE_HOURS", "24")) * 3600
+SESSION_JANITOR_INTERVAL = float(os.environ.get("MINDMATE_SESSION_JANITOR_SECONDS", "600"))
+# Anonymous per-browser shards (MINDMATE_USER_SCOPE="user" without login), keyed by the
+# VISITOR_COOKIE; the cookie and any shard unused this long expire
+VISITORS_DIR = os.path.join(DATA_DIR, "visitors")
+VISITOR_MAX_AGE = float(os.environ.get("MINDMATE_VISITOR_MAX_AGE_DAYS", "90")) * 86400
+VISITOR_COOKIE = "mindmate_visitor"
+IMAGES_DIR = os.path.join(DATA_DIR, "images")
+THUMB_SIZE = 256
+IMAGE_WORKERS = int(os.environ.get("MINDMATE_IMAGE_WORKERS", "2"))
+GALLERY_LIMIT = 48
+DEFAULT_USER = "default"
+# "user": logged-in username, else a shard per browser (visitor cookie); "session": logged-in
+# username, else a throwaway shard per browser session; "shared": everyone is DEFAULT_USER
+USER_SCOPE = os.environ.get("MINDMATE_USER_SCOPE", "user").strip().lower()
+MAX_ACTIVE_USERS = int(os.environ.get("MINDMATE_MAX_ACTIVE_USERS", "256"))
+USER_IDLE_SECONDS = float(os.environ.get("MINDMATE_USER_IDLE_SECONDS", "1800"))
+# MINDMATE_AUTH="alice:secret,bob:secret" enables login (UI) and HTTP Basic auth (JSON API)
+AUTH_USERS = dict(pair.split(":", 1) for pair in os.environ.get("MINDMATE_AUTH", "").split(",") if ":" in pair)
+
+# Storage writes queued within this window are written together (seconds)
+WRITE_INTERVAL = float(os.environ.get("MINDMATE_WRITE_INTERVAL", "0.05"))
+
+SENTIMENT_CACHE_SIZE = int(os.environ.get("MINDMATE_SENTIMENT_CACHE", "4096"))
+SENTIMENT_WORKERS = int(os.environ.get("MINDMATE_SENTIMENT_WORKERS", str(min(4, os.cpu_count() or 2))))
+JOURNAL_PAGE_SIZE = int(os.environ.get("MINDMATE_JOURNAL_PAGE_SIZE", "20"))
+JOURNAL_PAGE_CACHE = 32  # rendered history pages kept per user
+# Growth Report trend: least-squares slope of daily mean polarity over this many days
+TREND_DAYS = 28
+TREND_THRESHOLD = 0.05  # polarity change per week that counts as rising / dipping
+
+TTS_CACHE_DIR = os.path.join(DATA_DIR, "tts_cache")
+os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+# Disk budget for cached speech, in MB (MINDMATE_TTS_CACHE_MB)
+TTS_CACHE_MAX_BYTES = int(float(os.environ.get("MINDMATE_TTS_CACHE_MB", "64")) * 1024 * 1024)
+TTS_LANG = "en"
+# Return reply text immediately and stream the audio in when it is ready
+DEFERRED_TTS = os.environ.get("MINDMATE_DEFERRED_TTS", "1") != "0"
+TTS_WORKERS = int(os.environ.get("MINDMATE_TTS_WORKERS", "4"))
+# "gtts" (network), "espeak" (local binary), "fake" (deterministic tone) or "auto": espeak when installed, else gtts
+TTS_ENGINE = os.environ.get("MINDMATE_TTS_ENGINE", "auto").strip().lower()
+# Worker processes the engine runs in; 0 synthesizes in the calling thread
+TTS_PROCESSES = int(os.environ.get("MINDMATE_TTS_PROCESSES", "2"))
+# Seconds to wait for one synthesis before answering without audio
+TTS_TIMEOUT = float(os.environ.get("MINDMATE_TTS_TIMEOUT", "30"))
+# "file" serves speech from TTS_CACHE_DIR; "memory" synthesizes into buffers and never writes data/
+TTS_DELIVERY = os.environ.get("MINDMATE_TTS_DELIVERY", "file")
+# The janitor deletes speech unused for this long, plus orphaned temp files
+TTS_MAX_AGE = float(os.environ.get("MINDMATE_TTS_MAX_AGE_HOURS", "168")) * 3600
+TTS_JANITOR_INTERVAL = float(os.environ.get("MINDMATE_TTS_JANITOR_SECONDS", "600"))
+TTS_TMP_GRACE = 3600  # temp files younger than this may still be in use
+
+# Event lanes: events sharing a Gradio concurrency_id share its worker limit, and a
+# busy lane never holds up another. TTS-bound replies, CPU-bound scoring and
+# storage I/O each get their own; emergency help runs in a lane of its own.
+LANES = {
+    "tts": int(os.environ.get("MINDMATE_LANE_TTS", "8")),
+    "cpu": int(os.environ.get("MINDMATE_LANE_CPU", str(os.cpu_count() or 2))),
+    "io": int(os.environ.get("MINDMATE_LANE_IO", "8")),
+}
+EMERGENCY_WORKERS = 2
+
+# ---------------------------
+# Metrics (served on /metrics in Prometheus text format)
+# ---------------------------
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_text(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+class Metrics:
+    """
+    Counters and latency histograms, plus gauges read from collector
+    callables when /metrics is scraped. An update is a bisect and a dict
+    lookup under one lock, cheap enough for every handler call.
+    """
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._help = {}
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            h[i] += 1
+            h[-1] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t, **labels)
+
+    def collector(self, fn):
+        """
+        Register fn() -> iterable of (name, labels dict, value) samples,
+        rendered as gauges, or as counters when name ends in _total.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(h)) for k, h in self._histograms.items())
+        gauges = []
+        for fn in self._collectors:
+            try:
+                gauges.extend((name, tuple(sorted(labels.items())), value) for name, labels, value in fn())
+            except Exception as e:
+                print("Metrics collector error:", e)
+        lines = []
+        seen = set()
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                kind, text = self._help.get(name, (kind, ""))
+                if text:
+                    lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), h in histograms:
+            header(name, "histogram")
+            total = 0
+            for bound, n in zip([*map(repr, self.buckets), "+Inf"], h[:-1]):
+                total += n
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', bound)])} {total}")
+            lines.append(f"{name}_sum{_label_text(labels)} {h[-1]!r}")
+            lines.append(f"{name}_count{_label_text(labels)} {total}")
+        for name, labels, value in sorted(gauges):
+            header(name, "counter" if name.endswith("_total") else "gauge")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics(LATENCY_BUCKETS)
+METRICS.describe("mindmate_handler_seconds", "histogram", "UI event handler latency (text path; deferred audio excluded).")
+METRICS.describe("mindmate_handler_errors_total", "counter", "UI event handler calls that raised or fell back after an error.")
+METRICS.describe("mindmate_tts_seconds", "histogram", "Speech synthesis latency.")
+METRICS.describe("mindmate_tts_failures_total", "counter", "Speech synthesis calls that failed.")
+METRICS.describe("mindmate_csv_seconds", "histogram", "Whole-file CSV load and save duration.")
+METRICS.describe("mindmate_csv_rows_total", "counter", "Rows read or written by whole-file CSV loads and saves.")
+METRICS.describe("mindmate_storage_open_seconds", "histogram", "Time to open a user's storage shard.")
+METRICS.describe("mindmate_rows_in_memory", "gauge", "Rows held in memory by loaded CSV shards.")
+
+# stats() keys that only ever grow, exported as counters (with a _total suffix)
+RUNTIME_COUNTERS = {"hits", "misses", "evictions", "sweeps", "reclaimed_files", "reclaimed_bytes", "synthesized",
+                    "restarts", "flushes", "ops_written", "errors", "unloaded", "stored", "deduplicated", "removed",
+                    "thumbnail_failures"}
+
+@METRICS.collector
+def runtime_gauges():
+    """Sizes of loaded shards and the numeric stats() of each subsystem."""
+    totals = Counter()
+    for user in USERS.loaded():
+        store = user._store
+        if store is not None:
+            totals.update(store.sizes())
+    for dataset, n in sorted(totals.items()):
+        yield "mindmate_rows_in_memory", {"dataset": dataset}, n
+    subsystems = {"tts_cache": TTS_CACHE, "tts_memory": TTS_MEMORY, "tts_pool": TTS_POOL, "writer": WRITER,
+                  "users": USERS, "sentiment": SENTIMENT, "images": IMAGES, "sessions": SESSION_JANITOR}
+    for prefix, obj in subsystems.items():
+        for key, value in obj.stats().items():
+            if isinstance(value, (int, float)):
+                yield f"mindmate_{prefix}_{key}" + ("_total" if key in RUNTIME_COUNTERS else ""), {}, value
+
+def mount_metrics(app):
+    """
+    Add GET /metrics to the FastAPI app Gradio serves from. With
+    MINDMATE_AUTH set it takes the same HTTP Basic credentials as /v1.
+    """
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+    def metrics(request: Request):
+        api_user_id(request)  # 401 without valid credentials when auth is on
+        return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+
+# ---------------------------
+# Settings & helpers
+# ---------------------------
+SETTINGS = {
+    "speak_emojis": False,
+}
+
+EMOJI_REGEX = re.compile(r'[^\w\s.,?!\'"\-]')
+
+def clean_text_for_tts(text, speak_emojis=False):
+    if speak_emojis:
+        return text or " "
+    return EMOJI_REGEX.sub("", (text or " "))
+
+class TTSCache:
+    """
+    Content-addressed store for synthesized speech. Keys hash everything
+    that changes the audio and end in the engine's file suffix; the least
+    recently used files are evicted once the directory grows past max_bytes.
+    """
+    SUFFIXES = (".mp3", ".wav")
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reclaimed_files = 0
+        self.reclaimed_bytes = 0
+        self.sweeps = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, oldest first
+        self._total = 0
+        self._scanned = False
+
+    def _scan(self):
+        # Called under the lock on first use. Recency is mirrored to file
+        # mtimes so the LRU order survives restarts.
+        if self._scanned:
+            return
+        self._scanned = True
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIXES):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    @staticmethod
+    def make_key(text, lang, slow, speak_emojis, engine):
+        raw = json.dumps([text, lang, bool(slow), bool(speak_emojis), engine.name], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest() + engine.suffix
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self.path_for(key)
+        with self._lock:
+            self._scan()
+            if key in self._entries:
+                if os.path.exists(path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    try:
+                        os.utime(path)
+                    except OSError:
+                        pass
+                    return path
+                self._total -= self._entries.pop(key)
+            self.misses += 1
+        return None
+
+    def put(self, key, tmp_path):
+        size = os.path.getsize(tmp_path)
+        path = self.path_for(key)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._scan()
+            if key in self._entries:
+                self._total -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total += size
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep=None):
+        while self._total > self.max_bytes and self._entries:
+            key, size = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            self._entries.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            self._remove(self.path_for(key), size)
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        self.reclaimed_files += 1
+        self.reclaimed_bytes += size
+
+    def sweep(self, max_age, legacy_dir=None):
+        """
+        Delete speech unused for max_age seconds, temp files orphaned by
+        interrupted syntheses, and (in legacy_dir) tts_*.mp3 files written by
+        older versions; then re-apply the size budget. Returns (files, bytes) reclaimed.
+        """
+        # The lock is taken per file, never across a directory scan, so get()
+        # (the emergency reply included) waits for one stat at most
+        now = time.time()
+        with self._lock:
+            self._scan()
+            before = (self.reclaimed_files, self.reclaimed_bytes)
+            oldest = list(self._entries)
+        # Oldest first, and hits refresh mtimes, so stop at the first recent file
+        for key in oldest:
+            with self._lock:
+                size = self._entries.get(key)
+                if size is None:
+                    continue
+                path = self.path_for(key)
+                try:
+                    if now - os.stat(path).st_mtime < max_age:
+                        break
+                except OSError:
+                    pass
+                del self._entries[key]
+                self._total -= size
+                self._remove(path, size)
+        with self._lock:
+            self._evict()
+        strays = [(self.directory, name, TTS_TMP_GRACE) for name in os.listdir(self.directory) if name.endswith(".tmp")]
+        if legacy_dir and os.path.isdir(legacy_dir):
+            strays += [(legacy_dir, name, max_age) for name in os.listdir(legacy_dir)
+                       if name.startswith("tts_") and name.endswith(".mp3")]
+        for directory, name, age in strays:
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime >= age:
+                with self._lock:
+                    self._remove(path, st.st_size)
+        with self._lock:
+            self.sweeps += 1
+            return self.reclaimed_files - before[0], self.reclaimed_bytes - before[1]
+
+    def stats(self):
+        with self._lock:
+            self._scan()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "files": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "sweeps": self.sweeps,
+                "reclaimed_files": self.reclaimed_files,
+                "reclaimed_bytes": self.reclaimed_bytes,
+            }
+
+TTS_CACHE = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+
+class TTSJanitor:
+    """Background thread running TTSCache.sweep every interval seconds, first right after it starts."""
+    def __init__(self, cache, interval, max_age, legacy_dir):
+        self.cache = cache
+        self.interval = interval
+        self.max_age = max_age
+        self.legacy_dir = legacy_dir
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tts-janitor", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.cache.sweep(self.max_age, self.legacy_dir)
+            except Exception as e:
+                print("TTS janitor error:", e)
+            time.sleep(self.interval)
+
+TTS_JANITOR = TTSJanitor(TTS_CACHE, TTS_JANITOR_INTERVAL, TTS_MAX_AGE, DATA_DIR)
+
+class TTSMemoryCache:
+    """Synthesized mp3 bytes for TTS_DELIVERY="memory", least recently used dropped past max_bytes."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> bytes, oldest first
+        self._total = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= len(old)
+            self._entries[key] = data
+            self._total += len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                _, dropped = self._entries.popitem(last=False)
+                self._total -= len(dropped)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
+
+TTS_MEMORY = TTSMemoryCache(TTS_CACHE_MAX_BYTES)
+
+# ---------------------------
+# TTS engines
+# ---------------------------
+class TTSEngine:
+    """
+    A way of turning text into audio bytes. available() is checked in the
+    app process; synthesize() is mindmate_workers.synthesize, which runs in
+    a TTS_POOL worker process.
+    """
+    name = None
+    suffix = ".mp3"
+
+    def available(self):
+        return True
+
+    def synthesize(self, text, lang, slow):
+        return mindmate_workers.synthesize(self.name, text, lang, slow)
+
+class GTTSEngine(TTSEngine):
+    """Google Translate speech through gTTS: mp3, needs the network."""
+    name = "gtts"
+
+    def available(self):
+        return get_gtts() is not None
+
+class EspeakEngine(TTSEngine):
+    """The local espeak-ng (or espeak) binary: WAV, no network."""
+    name = "espeak"
+    suffix = ".wav"
+
+    def available(self):
+        return mindmate_workers.espeak_binary() is not None
+
+class FakeEngine(TTSEngine):
+    """A tone whose pitch and length derive from the text: deterministic WAV for tests and benchmarks."""
+    name = "fake"
+    suffix = ".wav"
+
+TTS_ENGINES = {engine.name: engine for engine in (GTTSEngine(), EspeakEngine(), FakeEngine())}
+
+@functools.lru_cache(maxsize=None)
+def tts_engine():
+    """The TTSEngine selected by TTS_ENGINE, or None when it is unavailable."""
+    if TTS_ENGINE == "auto":
+        return TTS_ENGINES["espeak"] if TTS_ENGINES["espeak"].available() else TTS_ENGINES["gtts"]
+    engine = TTS_ENGINES.get(TTS_ENGINE)
+    if engine is None:
+        print("TTS error: unknown engine", TTS_ENGINE)
+    return engine
+
+def process_pool(workers):
+    """
+    A ProcessPoolExecutor whose workers start from a fresh interpreter
+    (forkserver, or spawn where that is unavailable). A plain fork of this
+    threaded process could copy a lock some other thread holds, and the
+    worker would then block on it forever.
+
+    Tasks must be mindmate_workers functions. A fresh worker re-imports the
+    parent's main module, which for `python app.py` would mean gradio, the
+    UI and ~190 MB per worker; multiprocessing imports a main module that
+    names its spec by that name instead, so app.py names mindmate_workers.
+    """
+    main = sys.modules.get("__main__")
+    if main is sys.modules.get(__name__) and getattr(main, "__spec__", None) is None:
+        main.__spec__ = importlib.util.find_spec("mindmate_workers")
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+class TTSPool:
+    """
+    Bounded process pool that engines synthesize in, so CPU-heavy local
+    speech never runs on a Gradio worker thread. With workers=0 synthesis
+    runs in the calling thread instead. A pool whose worker died, or did
+    not answer within TTS_TIMEOUT, is replaced on the next call.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.synthesized = 0
+        self.restarts = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = process_pool(self.workers)
+            return self._pool
+
+    def synthesize(self, engine, text, lang, slow):
+        if self.workers <= 0:
+            data = engine.synthesize(text, lang, slow)
+        else:
+            pool = self._get_pool()
+            try:
+                data = pool.submit(mindmate_workers.synthesize, engine.name, text, lang, slow).result(timeout=TTS_TIMEOUT)
+            except (BrokenProcessPool, TimeoutError):
+                self._discard(pool)
+                raise
+        self.synthesized += 1
+        return data
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self.restarts += 1
+        # A wedged worker never frees its slot on its own
+        for proc in list((pool._processes or {}).values()):
+            proc.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def stats(self):
+        return {"workers": self.workers, "synthesized": self.synthesized, "restarts": self.restarts}
+
+TTS_POOL = TTSPool(TTS_PROCESSES)
+
+_tts_local = threading.local()
+_tts_executor = None
+_tts_executor_lock = threading.Lock()
+_tts_background = set()  # keys queued by text_to_speech(background=True)
+
+def get_tts_executor():
+    global _tts_executor
+    with _tts_executor_lock:
+        if _tts_executor is None:
+            _tts_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+        return _tts_executor
+
+def _synthesize_later(fn, key, *args):
+    """Queue fn(*args) for key unless it is already queued; nothing waits for it."""
+    with _tts_executor_lock:
+        if key in _tts_background:
+            return
+        _tts_background.add(key)
+    def run():
+        try:
+            fn(*args)
+        finally:
+            with _tts_executor_lock:
+                _tts_background.discard(key)
+    get_tts_executor().submit(run)
+
+def _synthesize(engine, safe, slow, filepath, key):
+    try:
+        with METRICS.timer("mindmate_tts_seconds", delivery="file", engine=engine.name):
+            data = TTS_POOL.synthesize(engine, safe, TTS_LANG, slow)
+        with open(filepath, "wb") as f:
+            f.write(data)
+        if key is not None:
+            return TTS_CACHE.put(key, filepath)
+        return filepath
+    except Exception as e:
+        print("TTS error:", e)
+        METRICS.inc("mindmate_tts_failures_total", delivery="file", engine=engine.name)
+        if key is not None and os.path.exists(filepath):
+            os.remove(filepath)
+        return None
+
+def _synthesize_bytes(engine, safe, slow, key):
+    try:
+        with METRICS.timer("mindmate_tts_seconds", delivery="memory", engine=engine.name):
+            data = TTS_POOL.synthesize(engine, safe, TTS_LANG, slow)
+        TTS_MEMORY.put(key, data)
+        return data
+    except Exception as e:
+        print("TTS error:", e)
+        METRICS.inc("mindmate_tts_failures_total", delivery="memory", engine=engine.name)
+        return None
+
+def text_to_speech(text, filename=None, slow=True, background=False):
+    """
+    Speak text with the selected TTS engine (see tts_engine()).
+    Without an explicit filename the result is shared through TTS_CACHE,
+    so repeated replies reuse the same file instead of synthesizing again;
+    with TTS_DELIVERY="memory" it is audio bytes from TTS_MEMORY instead.
+    Return generated filepath (or bytes) or None if TTS unavailable or
+    muted (see tts_muted). Inside a with_deferred_audio handler a cache miss
+    returns a Future instead; with background=True it returns None and the
+    speech is synthesized for the next caller.
+    """
+    if not text or getattr(_tts_local, "muted", False):
+        return None
+    engine = tts_engine()
+    if engine is None:
+        return None
+    speak_emojis = current_user().settings.get("speak_emojis", False)
+    safe = clean_text_for_tts(text, speak_emojis=speak_emojis)
+    if filename is None and TTS_DELIVERY == "memory":
+        key = TTSCache.make_key(safe, TTS_LANG, slow, speak_emojis, engine)
+        cached = TTS_MEMORY.get(key)
+        if cached:
+            return cached
+        if not engine.available():
+            return None
+        if background:
+            return _synthesize_later(_synthesize_bytes, key, engine, safe, slow, key)
+        if getattr(_tts_local, "defer", False):
+            return get_tts_executor().submit(_synthesize_bytes, engine, safe, slow, key)
+        return _synthesize_bytes(engine, safe, slow, key)
+    TTS_JANITOR.ensure_started()
+    key = None
+    if filename is None:
+        key = TTSCache.make_key(safe, TTS_LANG, slow, speak_emojis, engine)
+        cached = TTS_CACHE.get(key)
+        if cached:
+            return cached
+        filepath = os.path.join(TTS_CACHE_DIR, f"{key}.{uuid.uuid4().hex}.tmp")
+    else:
+        filepath = os.path.join(DATA_DIR, filename)
+    if not engine.available():
+        return None
+    if background and key is not None:
+        return _synthesize_later(_synthesize, key, engine, safe, slow, filepath, key)
+    if getattr(_tts_local, "defer", False):
+        return get_tts_executor().submit(_synthesize, engine, safe, slow, filepath, key)
+    return _synthesize(engine, safe, slow, filepath, key)
+
+@contextlib.contextmanager
+def tts_muted(muted=True):
+    """Make text_to_speech return None on this thread for the enclosed code."""
+    prev = getattr(_tts_local, "muted", False)
+    _tts_local.muted = muted
+    try:
+        yield
+    finally:
+        _tts_local.muted = prev
+
+def with_deferred_audio(fn):
+    """
+    Turn a handler into a generator: the first yield carries its text with
+    pending audio left empty, the second fills the audio in once synthesized
+    (or leaves it empty if that takes longer than TTS_TIMEOUT).
+    """
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        _tts_local.defer = True
+        try:
+            out = fn(*args, **kwargs)
+        finally:
+            _tts_local.defer = False
+        single = not isinstance(out, tuple)
+        outs = [out] if single else list(out)
+        pending = [i for i, o in enumerate(outs) if isinstance(o, Future)]
+        if not pending:
+            yield out
+            return
+        first = list(outs)
+        for i in pending:
+            first[i] = None
+        yield first[0] if single else tuple(first)
+        for i in pending:
+            try:
+                outs[i] = outs[i].result(timeout=TTS_TIMEOUT)
+            except Exception:
+                traceback.print_exc()
+                outs[i] = None
+        yield outs[0] if single else tuple(outs)
+    return run
+
+# ---------------------------
+# CSV read/write helpers
+# ---------------------------
+class AppendLog:
+    """
+    Append-only CSV writer. Each row is flushed to the OS as it is written;
+    fsync runs for all dirty files together on a background thread.
+    """
+    def __init__(self, fsync_interval):
+        self.fsync_interval = fsync_interval
+        self.lock = threading.RLock()
+        self._files = {}
+        self._dirty = set()
+        self._truncate_to = {}
+        self._syncer = None
+
+    def mark_torn(self, path, length):
+        # Cut a half-written trailing record before the next append lands
+        with self.lock:
+            self._truncate_to[path] = length
+
+    def append(self, path, header, rows):
+        """Append rows; returns the file size before, and size and mtime_ns after (before includes a new header)."""
+        with self.lock:
+            f = self._files.get(path) or self._open(path, header)
+            f.flush()
+            before = os.fstat(f.fileno()).st_size
+            csv.writer(f).writerows(rows)
+            f.flush()
+            self._dirty.add(path)
+            if self._syncer is None:
+                self._syncer = threading.Thread(target=self._run, name="csv-fsync", daemon=True)
+                self._syncer.start()
+            st = os.fstat(f.fileno())
+            return before, st.st_size, st.st_mtime_ns
+
+    def _open(self, path, header):
+        f = open(path, "a", newline="", encoding="utf-8")
+        length = self._truncate_to.pop(path, None)
+        if length is not None:
+            os.ftruncate(f.fileno(), length)
+        if os.fstat(f.fileno()).st_size == 0:
+            csv.writer(f).writerow(header)
+        self._files[path] = f
+        return f
+
+    def close(self, path):
+        with self.lock:
+            f = self._files.pop(path, None)
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            self._dirty.discard(path)
+
+    def sync(self):
+        with self.lock:
+            for path in self._dirty:
+                os.fsync(self._files[path].fileno())
+            self._dirty.clear()
+
+    def _run(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                print("CSV fsync error:", e)
+
+APPEND_LOG = AppendLog(FSYNC_INTERVAL)
+atexit.register(APPEND_LOG.sync)
+_needs_compaction = set()
+
+def load_rows(path):
+    """
+    Read the data rows of a CSV file (header skipped).
+    Rows with the wrong number of columns, or a last record with no line
+    ending (both left by a crash mid-append), are dropped and the file is
+    flagged for compaction.
+    """
+    rows = []
+    started = time.perf_counter()
+    if os.path.exists(path):
+        try:
+            consumed = 0
+            good = 0
+            ended = True
+            bad = False
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                def lines():
+                    nonlocal consumed, ended
+                    for line in f:
+                        consumed += len(line.encode("utf-8"))
+                        ended = line.endswith("\n")
+                        yield line
+                r = csv.reader(lines())
+                header = next(r, None)
+                good = prev = consumed
+                for row in r:
+                    if header is not None and len(row) != len(header):
+                        bad = True
+                        continue
+                    rows.append(row)
+                    prev, good = good, consumed
+                if rows and good == consumed and not ended:
+                    # Every row we write ends in a newline, so this one was cut short
+                    rows.pop()
+                    good = prev
+            if good < os.path.getsize(path):
+                APPEND_LOG.mark_torn(path, good)
+                bad = True
+            if bad:
+                _needs_compaction.add(path)
+        except Exception:
+            pass
+    name = os.path.basename(path)
+    METRICS.observe("mindmate_csv_seconds", time.perf_counter() - started, op="load", file=name)
+    METRICS.inc("mindmate_csv_rows_total", len(rows), op="load", file=name)
+    return rows
+
+def save_rows(path, header, rows):
+    """Rewrite a whole CSV file atomically (temp file + rename)."""
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    started = time.perf_counter()
+    try:
+        with APPEND_LOG.lock:
+            APPEND_LOG.close(path)
+            n = 0
+            with open(tmp, "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow(header)
+                for r in rows:
+                    w.writerow(r)
+                    n += 1
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        name = os.path.basename(path)
+        METRICS.observe("mindmate_csv_seconds", time.perf_counter() - started, op="save", file=name)
+        METRICS.inc("mindmate_csv_rows_total", n, op="save", file=name)
+    except Exception as e:
+        print("CSV save error:", e)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def append_rows(path, header, rows):
+    """APPEND_LOG.append, logging failures; returns its (before, after, mtime_ns) or None."""
+    try:
+        return APPEND_LOG.append(path, header, rows)
+    except Exception as e:
+        print("CSV append error:", e)
+        return None
+
+def compact_rows(path, header, key=None):
+    """Drop malformed (and, with key, duplicate) rows from a CSV file."""
+    with APPEND_LOG.lock:
+        APPEND_LOG.close(path)
+        rows = load_rows(path)
+        if key is not None:
+            seen = set()
+            unique = []
+            for r in rows:
+                k = key(r)
+                if k not in seen:
+                    seen.add(k)
+                    unique.append(r)
+            rows = unique
+        save_rows(path, header, rows)
+        APPEND_LOG._truncate_to.pop(path, None)
+        _needs_compaction.discard(path)
+
+def start_compaction(jobs):
+    """Compact the (path, header, key) jobs that load_rows flagged, off-thread."""
+    jobs = [j for j in jobs if j[0] in _needs_compaction]
+    if not jobs:
+        return None
+    def run():
+        for path, header, key in jobs:
+            try:
+                compact_rows(path, header, key)
+            except Exception as e:
+                print("CSV compaction error:", e)
+    t = threading.Thread(target=run, name="csv-compact", daemon=True)
+    t.start()
+    return t
+
+# ---------------------------
+# Data directory lock
+# ---------------------------
+DATA_LOCK_PATH = os.path.join(DATA_DIR, ".mindmate.lock")
+
+class DataDirLock:
+    """
+    An exclusive lock on DATA_DIR, so the server and the CLI commands never
+    write the same shards at once. The lock file stays open for the whole
+    process lifetime once acquired; close() (registered with atexit)
+    releases it.
+    """
+    def __init__(self, path=DATA_LOCK_PATH):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """True once held; False when another process holds it."""
+        if self._file is not None:
+            return True
+        f = open(self.path, "a+")  # noqa: SIM115 - held until close()
+        try:
+            f.seek(0)
+            if os.name == "nt":
+                import msvcrt
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        atexit.register(self.close)
+        return True
+
+    def close(self):
+        # Closing the descriptor drops the lock on every platform
+        f, self._file = self._file, None
+        if f is not None:
+            f.close()
+
+DATA_LOCK = DataDirLock()
+
+def lock_data_dir():
+    """Hold DATA_LOCK until this process exits; False when another process holds it."""
+    return DATA_LOCK.acquire()
+
+# ---------------------------
+# Storage backends
+# ---------------------------
+def parse_polarity(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+STOPWORDS = frozenset("a an the and or but if while to from of in on for with at by is it this that these those am are was were be been being i me my we our you your he she they them their as".split())
+WORD_REGEX = re.compile(r"[A-Za-z']+")
+
+def theme_words(text):
+    return [w for w in WORD_REGEX.findall((text or "").lower()) if w not in STOPWORDS and len(w) > 2]
+
+class GrowthAggregate:
+    """Running polarity sum/count and theme-word counts behind growth_report."""
+    def __init__(self, count=0, pol_sum=0.0, words=None):
+        self.count = count
+        self.pol_sum = pol_sum
+        self.words = Counter(words or {})
+
+    def add(self, text, polarity):
+        self.count += 1
+        self.pol_sum += float(polarity)
+        self.words.update(theme_words(text))
+
+    def summary(self, top=6):
+        avg = self.pol_sum / self.count if self.count else None
+        return avg, self.count, [w for w, _ in self.words.most_common(top)]
+
+    def to_dict(self):
+        return {"count": self.count, "pol_sum": self.pol_sum, "words": dict(self.words)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(int(data["count"]), float(data["pol_sum"]), data["words"])
+
+class MoodSeries:
+    """
+    Journal polarity bucketed by calendar day: sorted day ordinals with
+    entry counts and polarity sums as NumPy arrays. add() updates one bucket
+    (inserting the day when it is new); weekly buckets, rolling means and
+    the trend are computed from a snapshot of these arrays.
+    """
+    def __init__(self, days=(), counts=(), sums=()):
+        self.days = np.asarray(days, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.sums = np.asarray(sums, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_entries(cls, days, polarity):
+        """Bucket per-entry day ordinals and polarities."""
+        days, inverse = np.unique(np.asarray(days, dtype=np.int64), return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(days))
+        sums = np.bincount(inverse, weights=np.asarray(polarity, dtype=np.float64), minlength=len(days))
+        return cls(days, counts, sums)
+
+    def add(self, ts, polarity):
+        """Count one entry; timestamps that are not "YYYY-MM-DD ..." are left out."""
+        try:
+            day = date.fromisoformat(str(ts)[:10]).toordinal()
+        except ValueError:
+            return
+        with self._lock:
+            i = int(np.searchsorted(self.days, day))
+            if i < len(self.days) and self.days[i] == day:
+                self.counts[i] += 1
+                self.sums[i] += float(polarity)
+            else:
+                self.days = np.insert(self.days, i, day)
+                self.counts = np.insert(self.counts, i, 1)
+                self.sums = np.insert(self.sums, i, float(polarity))
+
+    def snapshot(self):
+        with self._lock:
+            return self.days.copy(), self.counts.copy(), self.sums.copy()
+
+    @staticmethod
+    def weekly(days, counts, sums):
+        """(Monday ordinals, entry counts, mean polarity) per calendar week."""
+        weeks, inverse = np.unique(days - (days - 1) % 7, return_inverse=True)
+        n = np.bincount(inverse, weights=counts, minlength=len(weeks))
+        return weeks, n.astype(np.int64), np.bincount(inverse, weights=sums, minlength=len(weeks)) / n
+
+    @staticmethod
+    def rolling(days, counts, sums, window):
+        """
+        (every day from the first bucket to the last, mean polarity of the
+        entries in the `window` days ending there; NaN where there were none).
+        """
+        if not len(days):
+            return days, sums
+        span = np.arange(days[0], days[-1] + 1)
+        dense_n = np.zeros(len(span))
+        dense_s = np.zeros(len(span))
+        dense_n[days - days[0]] = counts
+        dense_s[days - days[0]] = sums
+        csum_n = np.concatenate(([0.0], np.cumsum(dense_n)))
+        csum_s = np.concatenate(([0.0], np.cumsum(dense_s)))
+        lo = np.maximum(np.arange(len(span)) + 1 - window, 0)
+        n = csum_n[1:] - csum_n[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return span, np.where(n > 0, (csum_s[1:] - csum_s[lo]) / n, np.nan)
+
+    @staticmethod
+    def trend(days, counts, sums, window=TREND_DAYS):
+        """
+        Least-squares slope of daily mean polarity, per week, over the
+        `window` days ending at the latest entry, each day weighted by its
+        entry count; None with fewer than three days of entries.
+        """
+        if not len(days):
+            return None
+        recent = days > days[-1] - window
+        if np.count_nonzero(recent) < 3:
+            return None
+        x = (days[recent] - days[-1]).astype(np.float64)
+        y = sums[recent] / counts[recent]
+        return float(np.polyfit(x, y, 1, w=np.sqrt(counts[recent]))[0]) * 7
+
+    @staticmethod
+    def window_mean(days, counts, sums, window):
+        """(mean polarity, entries) over the `window` days ending at the latest entry."""
+        if not len(days):
+            return None, 0
+        recent = days > days[-1] - window
+        n = int(counts[recent].sum())
+        return (float(sums[recent].sum()) / n if n else None), n
+
+class SearchIndex:
+    """
+    Positional inverted index over journal text, tokenized like growth_report:
+    term -> {entry number: positions among the entry's theme words}. Entries
+    where a term occurs more than once are also kept by weight, in tiers
+    (term -> {tf_weight: {entry: None}}) and boosted (term -> {entry:
+    tf_weight}), which is what rank_matches reads.
+    """
+    def __init__(self, count=0, postings=None):
+        self.count = count
+        self.postings = postings or {}
+        self.tiers = {}
+        self.boosted = {}
+        for term, entries in self.postings.items():
+            for entry, positions in entries.items():
+                if len(positions) > 1:
+                    self._boost(term, entry, len(positions))
+
+    def _boost(self, term, entry, tf):
+        weight = tf_weight(tf)
+        self.tiers.setdefault(term, {}).setdefault(weight, {})[entry] = None
+        self.boosted.setdefault(term, {})[entry] = weight
+
+    def add(self, text):
+        entry = self.count
+        self.count += 1
+        seen = {}
+        for i, w in enumerate(theme_words(text)):
+            positions = self.postings.setdefault(w, {}).setdefault(entry, [])
+            positions.append(i)
+            seen[w] = positions
+        for w, positions in seen.items():
+            if len(positions) > 1:
+                self._boost(w, entry, len(positions))
+
+    # The postings source interface of rank_matches
+    def df(self, term):
+        return len(self.postings.get(term, ()))
+
+    def levels(self, term):
+        return {weight: len(entries) for weight, entries in self.tiers.get(term, {}).items()}
+
+    def matches(self, want):
+        # Set lookups on the dicts keep the per-entry work in C
+        (term, weight), *rest = want
+        if weight == 1.0:
+            found = itertools.filterfalse(self.boosted.get(term, {}).__contains__, reversed(self.postings[term]))
+        else:
+            found = reversed(self.tiers[term][weight])
+        for term, weight in rest:
+            if weight == 1.0:
+                found = filter(self.postings[term].__contains__, found)
+                found = itertools.filterfalse(self.boosted.get(term, {}).__contains__, found)
+            else:
+                found = filter(self.tiers[term][weight].__contains__, found)
+        return found
+
+    def intersect(self, terms):
+        """(entry, weights in terms order) for every entry holding all terms, driven by the first."""
+        found = iter(self.postings[terms[0]])
+        for term in terms[1:]:
+            found = filter(self.postings[term].__contains__, found)
+        boosted = [self.boosted.get(term, {}) for term in terms]
+        for e in found:
+            yield e, [b.get(e, 1.0) for b in boosted]
+
+    def positions(self, entry, words):
+        return {w: self.postings[w][entry] for w in words}
+
+    def to_dict(self):
+        return {"count": self.count,
+                "postings": {t: [[e, *pos] for e, pos in entries.items()] for t, entries in self.postings.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(int(data["count"]), {t: {e[0]: e[1:] for e in entries} for t, entries in data["postings"].items()})
+
+def parse_query(query):
+    """(terms, phrases): bare words and "quoted phrases", tokenized like growth_report."""
+    phrases = [theme_words(p) for p in re.findall(r'"([^"]*)"', query or "")]
+    terms = theme_words(re.sub(r'"[^"]*"', " ", query or ""))
+    terms += [p[0] for p in phrases if len(p) == 1]
+    return terms, [p for p in phrases if len(p) > 1]
+
+def tf_weight(tf):
+    return 1 + math.log(tf)
+
+def has_phrase(positions, phrase):
+    """Whether phrase occurs in an entry, given positions[token] for each of its tokens."""
+    rest = [(k, set(positions[w])) for k, w in enumerate(phrase[1:], 1)]
+    return any(all(p + k in pos for k, pos in rest) for p in positions[phrase[0]])
+
+def rank_matches(source, n_docs, terms, phrases, keep=None, limit=None):
+    """
+    The best `limit` (score, entry) pairs for a parsed query, best first.
+    Every token must occur, every phrase match and keep(entry), if given, be
+    true; the score is a sum of tf weight x idf, ties going to the newer
+    entry.
+
+    An entry's score only depends on the weight each token has in it, so
+    the weight combinations are ranked first and matched in turn, each
+    driven by its shortest list. Ranking stops once `limit` entries are
+    found, usually long before the common tokens' postings are read. The
+    combinations multiply with every token, so past SEARCH_COMBOS_MAX the
+    postings are intersected once instead and the best `limit` kept.
+
+    source gives df(token); levels(token), {weight: entries} for weights
+    above 1; matches([(token, weight), ...]), the entries where each token
+    has exactly that weight, newest first, driven by the first pair;
+    intersect(tokens), (entry, weights) for the entries holding them all,
+    driven by the first; and positions(entry, words) -> {word: positions}.
+    """
+    tokens = sorted(set(terms).union(*phrases))
+    if not tokens:
+        return []
+    dfs = {t: source.df(t) for t in tokens}
+    if not all(dfs.values()):
+        return []
+    idf = {t: math.log(1 + n_docs / dfs[t]) for t in tokens}
+    sizes = {}
+    for t in tokens:
+        sizes[t] = source.levels(t)
+        # Weight-1 entries are only found by reading the whole postings
+        sizes[t][1.0] = dfs[t] if dfs[t] > sum(sizes[t].values()) else 0
+    weights = [sorted(w for w, n in sizes[t].items() if n) for t in tokens]
+    words = {w for phrase in phrases for w in phrase}
+
+    def accept(e):
+        if keep is not None and not keep(e):
+            return False
+        if phrases:
+            positions = source.positions(e, words)
+            return all(has_phrase(positions, phrase) for phrase in phrases)
+        return True
+
+    if math.prod(map(len, weights)) > SEARCH_COMBOS_MAX:
+        order = sorted(tokens, key=dfs.get)
+        at = [order.index(t) for t in tokens]
+        # Summed in tokens order, like the combinations, so equal entries score alike
+        scored = ((sum(ws[k] * idf[t] for k, t in zip(at, tokens)), e)
+                  for e, ws in source.intersect(order) if accept(e))
+        return heapq.nlargest(limit, scored) if limit is not None else sorted(scored, reverse=True)
+
+    combos = {}
+    for combo in itertools.product(*weights):
+        want = sorted(zip(tokens, combo), key=lambda p: sizes[p[0]][p[1]])
+        combos.setdefault(sum(w * idf[t] for t, w in zip(tokens, combo)), []).append(want)
+
+    ranked = []
+    for score in sorted(combos, reverse=True):
+        # Equal scores from different combinations interleave newest first
+        for e in heapq.merge(*map(source.matches, combos[score]), reverse=True):
+            if not accept(e):
+                continue
+            ranked.append((score, e))
+            if len(ranked) == limit:
+                return ranked
+    return ranked
+
+class TaskStreak:
+    """Sorted day ordinals for one task, plus the run ending at the last day and the longest run."""
+    __slots__ = ("days", "day_set", "last_run", "longest")
+
+    def __init__(self, days=()):
+        self.days = sorted(days)
+        self.day_set = set(self.days)
+        self.rescan()
+
+    def rescan(self):
+        self.last_run = self.longest = 0
+        prev = None
+        for o in self.days:
+            self.last_run = self.last_run + 1 if prev is not None and o == prev + 1 else 1
+            self.longest = max(self.longest, self.last_run)
+            prev = o
+
+    def add(self, o):
+        if o in self.day_set:
+            return False
+        self.day_set.add(o)
+        if not self.days or o > self.days[-1]:
+            self.last_run = self.last_run + 1 if self.days and o == self.days[-1] + 1 else 1
+            self.days.append(o)
+            self.longest = max(self.longest, self.last_run)
+        else:
+            # Back-filled day: rare, so just rescan this task
+            bisect.insort(self.days, o)
+            self.rescan()
+        return True
+
+    def current(self, today):
+        """Length of the run ending on today's ordinal (0 if today is not marked)."""
+        if not self.days or self.days[-1] < today:
+            return 0
+        if self.days[-1] == today:
+            return self.last_run
+        # Marks dated after today (clock changes): walk back from today
+        i = bisect.bisect_left(self.days, today)
+        if self.days[i] != today:
+            return 0
+        run = 1
+        while i > 0 and self.days[i - 1] == self.days[i] - 1:
+            run += 1
+            i -= 1
+        return run
+
+class StreakIndex:
+    """
+    Streak state for every task, in first-marked order. Marking a new day
+    updates the current and longest run in O(1); the current streak is
+    evaluated against date.today() at read time, so it rolls over at midnight.
+    """
+    def __init__(self, rows=()):
+        by_task = {}
+        for task, day in rows:
+            try:
+                by_task.setdefault(task, set()).add(date.fromisoformat(day).toordinal())
+            except (TypeError, ValueError):
+                continue
+        self.tasks = {task: TaskStreak(days) for task, days in by_task.items()}
+
+    def has(self, task, day):
+        s = self.tasks.get(task)
+        return s is not None and date.fromisoformat(day).toordinal() in s.day_set
+
+    def add(self, task, day):
+        o = date.fromisoformat(day).toordinal()
+        s = self.tasks.get(task)
+        if s is None:
+            s = self.tasks[task] = TaskStreak()
+        return s.add(o)
+
+    def summary(self, today=None):
+        """[(task, current streak, longest streak)] for every task."""
+        t = (today or date.today()).toordinal()
+        return [(task, s.current(t), s.longest) for task, s in self.tasks.items()]
+
+class WriteQueue:
+    """
+    The single writer for all storage shards. Handlers queue mutations and
+    return; the writer thread waits `interval` after the first one arrives
+    and then writes everything queued for a store in one batch.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.flushes = 0
+        self.ops_written = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_s = 0.0
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # store -> [(kind, row)]
+        self._flushing = set()
+        self._depth = 0
+        self._urgent = False
+        self._thread = None
+
+    def submit(self, store, op):
+        with self._cond:
+            self._pending.setdefault(store, []).append(op)
+            self._depth += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def sync(self, store=None):
+        """Block until everything queued for store (or for every store) is written."""
+        if threading.current_thread() is self._thread:
+            return
+        with self._cond:
+            def busy():
+                if store is None:
+                    return bool(self._pending or self._flushing)
+                return store in self._pending or store in self._flushing
+            if busy():
+                self._urgent = True
+                self._cond.notify_all()
+                while busy():
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.interval
+                while not self._urgent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, OrderedDict()
+                self._flushing = set(batch)
+                self._urgent = False
+            started = time.perf_counter()
+            errors = 0
+            for store, ops in batch.items():
+                try:
+                    store._write_batch(ops)
+                except Exception as e:
+                    errors += 1
+                    print("Storage write error:", e)
+            elapsed = time.perf_counter() - started
+            with self._cond:
+                written = sum(len(ops) for ops in batch.values())
+                self._depth -= written
+                self.ops_written += written
+                self.errors += errors
+                self.flushes += 1
+                self.last_flush_ms = elapsed * 1000
+                self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+                self._total_flush_s += elapsed
+                self._flushing = set()
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": self._depth,
+                "flushes": self.flushes,
+                "ops_written": self.ops_written,
+                "errors": self.errors,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+                "avg_flush_ms": round(self._total_flush_s * 1000 / self.flushes, 3) if self.flushes else 0.0,
+            }
+
+WRITER = WriteQueue(WRITE_INTERVAL)
+atexit.register(WRITER.sync)
+
+TS_REGEX = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}$")
+DATE_REGEX = re.compile(r"\d{4}-\d{2}-\d{2}$")
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def ts_to_epoch(ts, allow_date=False):
+    """
+    Seconds since 1970 for a "YYYY-MM-DD HH:MM" timestamp (or, with
+    allow_date, a bare date at midnight), read as UTC so it round-trips
+    through epoch_to_ts exactly. None if ts has another shape.
+    """
+    ts = str(ts)
+    if TS_REGEX.match(ts):
+        hours, minutes = int(ts[11:13]), int(ts[14:16])
+    elif allow_date and DATE_REGEX.match(ts):
+        hours = minutes = 0
+    else:
+        return None
+    try:
+        days = date(int(ts[:4]), int(ts[5:7]), int(ts[8:10])).toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        return None
+    if hours > 23 or minutes > 59:
+        return None
+    return days * 86400 + hours * 3600 + minutes * 60
+
+def epoch_to_ts(epoch):
+    days, rest = divmod(epoch, 86400)
+    return f"{date.fromordinal(days + _EPOCH_ORDINAL).isoformat()} {rest // 3600:02d}:{rest % 3600 // 60:02d}"
+
+class JournalColumns:
+    """
+    The CSV journal held column-wise: epoch timestamps (array "q"), polarity
+    ("d"), mood codes into a label table ("B") and text offsets into a blob
+    file that is memory-mapped and read lazily. Indexing, slicing and
+    iteration still give (timestamp, text, mood, polarity) tuples.
+
+    Timestamps and moods that do not fit their column are kept verbatim on
+    the side. Texts added since load stay in memory until persist() appends
+    them to the blob. Positions are in insertion order; order() gives them
+    by timestamp, which differs once older entries are imported. The
+    columns are cached next to the CSV together with
+    the CSV size they cover (csv_size), which only moves with our own
+    appends. A cache whose CSV has since grown is caught up from the tail;
+    one whose CSV changed in any other way, or that saw another process
+    append, is rebuilt from the CSV.
+    """
+    ODD_MOOD = 255
+    TAIL_CHECK = 4096  # bytes before csv_size whose checksum must still match
+
+    def __init__(self, csv_path):
+        stem = os.path.splitext(csv_path)[0]
+        self.csv_path = csv_path
+        self.blob_path = stem + ".text"
+        self.cols_path = stem + ".cols"
+        self._lock = threading.RLock()
+        self._map = None
+        self._reset()
+        if not self._load_cache():
+            self._reset()
+            self._rebuild()
+
+    def _reset(self):
+        self.epochs = array("q")
+        self.polarity = array("d")
+        self.moods = array("B")
+        self.labels = []
+        self._codes = {}
+        self._odd_ts = {}
+        self._odd_moods = {}
+        self._offsets = array("q", [0])
+        self._pending = []
+        self._order = None  # positions by (epoch, position); None while that is insertion order
+        self._order_stale = False
+        self.csv_size = 0
+        self._csv_mtime_ns = None
+        self._stale = False
+
+    def _tail_crc(self, size):
+        with open(self.csv_path, "rb") as f:
+            f.seek(max(0, size - self.TAIL_CHECK))
+            return zlib.crc32(f.read(min(size, self.TAIL_CHECK)))
+
+    def _load_cache(self):
+        try:
+            st = os.stat(self.csv_path)
+            with open(self.cols_path, "rb") as f:
+                meta = json.loads(f.readline())
+                covered = meta["csv_size"]
+                if st.st_size == covered:
+                    if st.st_mtime_ns != meta["csv_mtime_ns"]:
+                        return False
+                elif st.st_size < covered or self._tail_crc(covered) != meta["csv_tail_crc"]:
+                    return False
+                if os.path.getsize(self.blob_path) < meta["blob_size"]:
+                    return False
+                n = meta["count"]
+                self.epochs.fromfile(f, n)
+                self.polarity.fromfile(f, n)
+                self.moods.fromfile(f, n)
+                self._offsets = array("q")
+                self._offsets.fromfile(f, n + 1)
+            self.labels = list(meta["labels"])
+            self._codes = {label: code for code, label in enumerate(self.labels)}
+            self._odd_ts = {int(i): ts for i, ts in meta["odd_ts"].items()}
+            self._odd_moods = {int(i): m for i, m in meta["odd_moods"].items()}
+            self._order_stale = bool(n) and bool(np.any(np.diff(np.frombuffer(self.epochs, dtype=np.int64)) < 0))
+            self.csv_size, self._csv_mtime_ns = covered, st.st_mtime_ns
+            self._remap()
+            return st.st_size == covered or self._catch_up(st.st_size)
+        except Exception:
+            return False
+
+    def _catch_up(self, size):
+        """Append the rows another process wrote past csv_size; False if the tail is not whole rows."""
+        with open(self.csv_path, "rb") as f:
+            f.seek(self.csv_size)
+            tail = f.read(size - self.csv_size)
+        if not tail.endswith(b"\n"):
+            return False
+        rows = list(csv.reader(io.StringIO(tail.decode("utf-8"), newline="")))
+        if any(len(r) != len(JOURNAL_HEADER) for r in rows):
+            return False
+        for r in rows:
+            self.append((r[0], r[1], r[2], parse_polarity(r[3])))
+        self.csv_size = size
+        return True
+
+    def _rebuild(self):
+        tmp = f"{self.blob_path}.{uuid.uuid4().hex}.tmp"
+        self.resync()
+        try:
+            with open(tmp, "wb") as f:
+                for r in load_rows(self.csv_path):
+                    self._append_columns(r[0], r[2], parse_polarity(r[3]))
+                    data = r[1].encode("utf-8")
+                    f.write(data)
+                    self._offsets.append(self._offsets[-1] + len(data))
+            os.replace(tmp, self.blob_path)
+            self._remap()
+        except Exception as e:
+            print("Journal columns error:", e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self._reset()
+            # Keep every text in memory rather than lose the journal
+            for r in load_rows(self.csv_path):
+                self.append((r[0], r[1], r[2], parse_polarity(r[3])))
+
+    def resync(self):
+        """Take the CSV as it is now to be exactly what the columns hold (after loading or rewriting it)."""
+        with self._lock:
+            if os.path.exists(self.csv_path):
+                st = os.stat(self.csv_path)
+                self.csv_size, self._csv_mtime_ns = st.st_size, st.st_mtime_ns
+            else:
+                self.csv_size, self._csv_mtime_ns = 0, None
+            self._stale = False
+
+    def appended(self, result):
+        """Record one of our appends to the CSV, given append_rows' result."""
+        with self._lock:
+            if result is None or result[0] != self.csv_size:
+                # A failed append, or someone else wrote to the CSV: the columns no longer match it
+                self._stale = True
+            else:
+                self.csv_size, self._csv_mtime_ns = result[1], result[2]
+
+    def save(self):
+        """Persist pending texts and cache the columns; call once the CSV holds every entry."""
+        self.persist()
+        tmp = f"{self.cols_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with self._lock:
+                if self._pending or not os.path.exists(self.csv_path):
+                    return
+                st = os.stat(self.csv_path)
+                if self._stale or (st.st_size, st.st_mtime_ns) != (self.csv_size, self._csv_mtime_ns):
+                    # The next load rebuilds from the CSV instead
+                    if os.path.exists(self.cols_path):
+                        os.remove(self.cols_path)
+                    return
+                meta = {
+                    "count": len(self.epochs), "csv_size": self.csv_size, "csv_mtime_ns": self._csv_mtime_ns,
+                    "csv_tail_crc": self._tail_crc(self.csv_size),
+                    "blob_size": self._offsets[-1], "labels": self.labels,
+                    "odd_ts": {str(i): ts for i, ts in self._odd_ts.items()},
+                    "odd_moods": {str(i): m for i, m in self._odd_moods.items()},
+                }
+                with open(tmp, "wb") as f:
+                    f.write(json.dumps(meta).encode("utf-8") + b"\n")
+                    self.epochs.tofile(f)
+                    self.polarity.tofile(f)
+                    self.moods.tofile(f)
+                    self._offsets.tofile(f)
+            os.replace(tmp, self.cols_path)
+        except Exception as e:
+            print("Journal columns save error:", e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def persist(self):
+        """Append texts added since load to the blob file."""
+        with self._lock:
+            pending = list(self._pending)
+        if not pending:
+            return
+        data = [t.encode("utf-8") for t in pending]
+        try:
+            with open(self.blob_path, "ab") as f:
+                # Drop anything past the last known text, e.g. from an interrupted persist
+                f.truncate(self._offsets[-1])
+                f.write(b"".join(data))
+        except Exception as e:
+            print("Journal columns error:", e)
+            return
+        with self._lock:
+            for d in data:
+                self._offsets.append(self._offsets[-1] + len(d))
+            del self._pending[:len(pending)]
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if os.path.exists(self.blob_path) and os.path.getsize(self.blob_path) > 0:
+            with open(self.blob_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+    def _append_columns(self, ts, mood, polarity):
+        i = len(self.epochs)
+        epoch = ts_to_epoch(ts)
+        if epoch is None:
+            self._odd_ts[i] = ts
+            epoch = 0
+        code = self._codes.get(mood)
+        if code is None:
+            if len(self.labels) < self.ODD_MOOD:
+                code = self._codes[mood] = len(self.labels)
+                self.labels.append(mood)
+            else:
+                self._odd_moods[i] = mood
+                code = self.ODD_MOOD
+        if not self._order_stale and i:
+            last = self.epochs[i - 1] if self._order is None else self.epochs[self._order[-1]]
+            if epoch < last:
+                self._order_stale = True
+            elif self._order is not None:
+                self._order.append(i)
+        self.epochs.append(epoch)
+        self.moods.append(code)
+        self.polarity.append(float(polarity))
+
+    def append(self, row):
+        ts, text, mood, polarity = row
+        with self._lock:
+            self._append_columns(ts, mood, polarity)
+            self._pending.append(text)
+
+    def set_score(self, i, polarity, mood):
+        with self._lock:
+            self.polarity[i] = float(polarity)
+            self._odd_moods.pop(i, None)
+            code = self._codes.get(mood)
+            if code is None:
+                if len(self.labels) < self.ODD_MOOD:
+                    code = self._codes[mood] = len(self.labels)
+                    self.labels.append(mood)
+                else:
+                    self._odd_moods[i] = mood
+                    code = self.ODD_MOOD
+            self.moods[i] = code
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def order(self):
+        """Positions sorted by timestamp, ties in insertion order; None when that is just 0..n-1."""
+        with self._lock:
+            if self._order_stale:
+                ranked = np.argsort(np.frombuffer(self.epochs, dtype=np.int64), kind="stable")
+                self._order = array("q", ranked.astype(np.int64).tobytes())
+                self._order_stale = False
+            return self._order
+
+    def by_time(self, start, stop):
+        """Positions of the entries ranked start..stop-1 by timestamp."""
+        order = self.order()
+        return range(start, stop) if order is None else order[start:stop]
+
+    def rank(self, i):
+        """How many entries sort before the entry at position i."""
+        order = self.order()
+        if order is None:
+            return i
+        key = (self.epochs[i], i)
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (self.epochs[order[mid]], order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def ts(self, i):
+        odd = self._odd_ts.get(i)
+        return odd if odd is not None else epoch_to_ts(self.epochs[i])
+
+    def mood(self, i):
+        code = self.moods[i]
+        return self._odd_moods[i] if code == self.ODD_MOOD else self.labels[code]
+
+    def text(self, i):
+        with self._lock:
+            stored = len(self._offsets) - 1
+            if i >= stored:
+                return self._pending[i - stored]
+            start, end = self._offsets[i], self._offsets[i + 1]
+            if self._map is None or end > len(self._map):
+                self._remap()
+            return self._map[start:end].decode("utf-8")
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("journal index out of range")
+        with self._lock:
+            return self.ts(i), self.text(i), self.mood(i), self.polarity[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def indices(self, start=None, end=None):
+        """Positions of entries with start <= timestamp < end, compared on the epoch column."""
+        lo = None if start is None else ts_to_epoch(start, allow_date=True)
+        hi = None if end is None else ts_to_epoch(end, allow_date=True)
+        if (start is not None and lo is None) or (end is not None and hi is None) or self._odd_ts:
+            # Bounds or rows the epoch column cannot express: compare the text
+            for i in range(len(self)):
+                ts = self.ts(i)
+                if (start is None or ts >= start) and (end is None or ts < end):
+                    yield i
+            return
+        for i, epoch in enumerate(self.epochs):
+            if (lo is None or epoch >= lo) and (hi is None or epoch < hi):
+                yield i
+
+    def in_range(self, start=None, end=None):
+        """A test of position i for start <= timestamp < end, without visiting every entry like indices()."""
+        lo = None if start is None else ts_to_epoch(start, allow_date=True)
+        hi = None if end is None else ts_to_epoch(end, allow_date=True)
+        if (start is not None and lo is None) or (end is not None and hi is None):
+            return lambda i: (start is None or self.ts(i) >= start) and (end is None or self.ts(i) < end)
+        def test(i):
+            if i in self._odd_ts:
+                ts = self.ts(i)
+                return (start is None or ts >= start) and (end is None or ts < end)
+            epoch = self.epochs[i]
+            return (lo is None or epoch >= lo) and (hi is None or epoch < hi)
+        return test
+
+    def day_polarity(self):
+        """(day ordinals, polarity) arrays for the entries with a regular timestamp."""
+        with self._lock:
+            days = np.array(self.epochs, dtype=np.int64) // 86400 + _EPOCH_ORDINAL
+            polarity = np.array(self.polarity, dtype=np.float64)
+            if self._odd_ts:
+                keep = np.ones(len(days), dtype=bool)
+                keep[list(self._odd_ts)] = False
+                days, polarity = days[keep], polarity[keep]
+        return days, polarity
+
+class Storage:
+    """
+    Journal, visual journal and streak data as seen by the handlers.
+    Journal rows are (timestamp, text, mood, polarity) with polarity a float;
+    timestamps are "YYYY-MM-DD HH:MM" so they sort as text.
+
+    Mutations go through WRITER: add_journal, add_visual and mark_streak
+    update in-memory state and queue the write, and backends persist
+    queued ops in _write_batch. Reads that hit disk call flush() first.
+    journal_version changes whenever journal rows are added or rewritten,
+    streak_version whenever a streak day is marked.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.journal_version = 0
+        self.streak_version = 0
+        self._streaks = None
+        self._streak_lock = threading.Lock()
+        self._series = None
+        self._series_lock = threading.Lock()
+
+    def close(self):
+        """Write anything queued and release files and connections."""
+        self.flush()
+
+    def flush(self):
+        WRITER.sync(self)
+
+    def sizes(self):
+        """{dataset: rows held in memory}, for metrics."""
+        return {}
+
+    def _submit(self, kind, row):
+        self._apply(kind, row)
+        WRITER.submit(self, (kind, row))
+
+    def _apply(self, kind, row):
+        """Reflect a queued mutation in in-memory state (backends that keep any)."""
+
+    def _write_batch(self, ops):
+        """Persist [(kind, row)], kind being "journal", "visual" or "streak"."""
+        raise NotImplementedError
+
+    def add_journal(self, ts, text, mood, polarity):
+        with self._series_lock:
+            self._submit("journal", (ts, text, mood, float(polarity)))
+            if self._series is not None:
+                self._series.add(ts, polarity)
+        self.journal_version += 1
+
+    def journal_count(self):
+        raise NotImplementedError
+
+    def latest_journal(self):
+        raise NotImplementedError
+
+    def recent_journal(self, limit):
+        """The last `limit` entries, oldest first."""
+        raise NotImplementedError
+
+    def iter_journal(self, start=None, end=None):
+        """Entries with start <= timestamp < end, oldest first."""
+        raise NotImplementedError
+
+    def journal_since(self, count):
+        """Entries added after the first `count`, in the order they were added."""
+        raise NotImplementedError
+
+    def journal_page(self, before=None, limit=JOURNAL_PAGE_SIZE):
+        """
+        Up to `limit` entries older than cursor `before` (None for the newest),
+        newest first, and the cursor of the next page or None at the end.
+        Cursors stay valid as new entries arrive.
+        """
+        raise NotImplementedError
+
+    def search(self, query, start=None, end=None, moods=None, limit=SEARCH_LIMIT):
+        """
+        Journal entries matching every term and "quoted phrase" in query,
+        best first, with start <= timestamp < end and mood in moods (any if
+        empty). Returns up to `limit` (score, row) pairs.
+        """
+        terms, phrases = parse_query(query)
+        wanted = sorted({m.lower() for m in moods}) if moods else None
+        top = list(itertools.islice(self._search_ranked(terms, phrases, start, end, wanted, limit), limit))
+        return [(score, row) for (score, _), row in zip(top, self._journal_rows([e for _, e in top]))]
+
+    def _search_ranked(self, terms, phrases, start=None, end=None, moods=None, limit=None):
+        """
+        (score, entry key) pairs for a parsed query, best first, as
+        rank_matches ranks them, restricted to the date range and moods.
+        At least `limit` are produced when that many match.
+        """
+        raise NotImplementedError
+
+    def _journal_rows(self, keys):
+        """Journal rows for entry keys from _search_ranked, in the same order."""
+        raise NotImplementedError
+
+    def rebuild_search(self):
+        """Rebuild the search index from every journal entry; return the count."""
+        raise NotImplementedError
+
+    def growth_summary(self, top=6):
+        """(average polarity or None, entry count, most common theme words)."""
+        raise NotImplementedError
+
+    def rebuild_growth(self):
+        """Recompute the growth aggregate from every journal entry; return the count."""
+        raise NotImplementedError
+
+    def mood_series(self):
+        """The journal's MoodSeries, built by _daily_buckets on first use and kept current by add_journal."""
+        with self._series_lock:
+            if self._series is None:
+                self._series = self._daily_buckets()
+            return self._series
+
+    def _daily_buckets(self):
+        raise NotImplementedError
+
+    def _reset_series(self):
+        with self._series_lock:
+            self._series = None
+
+    def rescore_journal(self, scorer, chunk_size=1000):
+        """
+        Replace polarity and mood on every entry, chunk by chunk.
+        scorer maps a list of texts to a list of (polarity, mood) pairs.
+        """
+        raise NotImplementedError
+
+    def add_visual(self, ts, image_path, caption):
+        self._submit("visual", (ts, image_path, caption))
+
+    def recent_visual(self, limit):
+        raise NotImplementedError
+
+    def iter_visual(self):
+        raise NotImplementedError
+
+    def iter_streaks(self):
+        raise NotImplementedError
+
+    def streak_index(self):
+        """The StreakIndex, built from iter_streaks on first use."""
+        with self._streak_lock:
+            if self._streaks is None:
+                self._streaks = StreakIndex(self.iter_streaks())
+            return self._streaks
+
+    def mark_streak(self, task, day):
+        """Record task as done on day; False if it was already marked."""
+        index = self.streak_index()
+        with self._streak_lock:
+            if index.has(task, day):
+                return False
+            index.add(task, day)
+            self._submit("streak", (task, day))
+            self.streak_version += 1
+        return True
+
+class CsvStorage(Storage):
+    """
+    The CSV files in DATA_DIR, held in memory and appended to on write.
+    The journal is held column-wise (JournalColumns). The growth aggregate
+    is saved to a JSON file every GROWTH_SAVE_EVERY entries and at exit;
+    entries newer than the saved count are replayed on load. The search
+    index is only loaded by the first search and only saved on close (and
+    at exit), never by the writer: the journal is its append-only log, so
+    entries past the saved count are indexed again from their text.
+    """
+    GROWTH_SAVE_EVERY = 25
+
+    def __init__(self, directory, journal_path, vj_path, streaks_path, growth_path, search_path):
+        super().__init__(directory)
+        self.paths = {"journal": journal_path, "visual_journal": vj_path, "streaks": streaks_path}
+        self.growth_path = growth_path
+        self.search_path = search_path
+        self._growth_lock = threading.Lock()
+        self._search_lock = threading.Lock()
+        self._search = None
+        self._search_saved = 0
+        self.journal = JournalColumns(journal_path)
+        self.visual = [tuple(r) for r in load_rows(vj_path)]
+        self.streaks = [tuple(r) for r in load_rows(streaks_path)]
+        start_compaction([
+            (journal_path, JOURNAL_HEADER, None),
+            (vj_path, VJ_HEADER, None),
+            (streaks_path, STREAKS_HEADER, tuple),
+        ])
+        self.growth = self._load_growth()
+        self._growth_saved = self.growth.count
+        atexit.register(self._save_growth)
+        atexit.register(self._save_search)
+        atexit.register(self._save_columns)
+
+    def sizes(self):
+        return {"journal": len(self.journal), "visual_journal": len(self.visual), "streaks": len(self.streaks)}
+
+    def close(self):
+        super().close()
+        atexit.unregister(self._save_growth)
+        atexit.unregister(self._save_search)
+        atexit.unregister(self._save_columns)
+        self._save_growth()
+        self._save_search()
+        for path in self.paths.values():
+            APPEND_LOG.close(path)
+        self.journal.save()
+        self.journal.close()
+
+    def _save_columns(self):
+        # Runs before WRITER's own exit flush, so land queued rows first
+        self.flush()
+        self.journal.save()
+
+    def _load_growth(self):
+        growth = GrowthAggregate()
+        try:
+            with open(self.growth_path, "r", encoding="utf-8") as f:
+                growth = GrowthAggregate.from_dict(json.load(f))
+        except Exception:
+            pass
+        if growth.count > len(self.journal):
+            growth = GrowthAggregate()
+        for _, text, _, p in self.journal[growth.count:]:
+            growth.add(text, p)
+        return growth
+
+    def _save_growth(self):
+        tmp = f"{self.growth_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with self._growth_lock:
+                data = self.growth.to_dict()
+                self._growth_saved = self.growth.count
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.growth_path)
+        except Exception as e:
+            print("Growth save error:", e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _search_index(self):
+        """The search index, loaded (and caught up with the journal) on first use; call with _search_lock held."""
+        if self._search is None:
+            index = SearchIndex()
+            try:
+                with open(self.search_path, "r", encoding="utf-8") as f:
+                    index = SearchIndex.from_dict(json.load(f))
+            except Exception:
+                pass
+            if index.count > len(self.journal):
+                index = SearchIndex()
+            self._search_saved = index.count
+            for _, text, _, _ in self.journal[index.count:]:
+                index.add(text)
+            self._search = index
+        return self._search
+
+    def _save_search(self):
+        if self._search is None:
+            return
+        tmp = f"{self.search_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with self._search_lock:
+                if self._search.count == self._search_saved:
+                    return
+                data = self._search.to_dict()
+                self._search_saved = self._search.count
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, self.search_path)
+        except Exception as e:
+            print("Search index save error:", e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _apply(self, kind, row):
+        if kind == "journal":
+            with self._search_lock:
+                self.journal.append(row)
+                if self._search is not None:
+                    self._search.add(row[1])
+            with self._growth_lock:
+                self.growth.add(row[1], row[3])
+        elif kind == "visual":
+            self.visual.append(row)
+        elif kind == "streak":
+            self.streaks.append(row)
+
+    def _write_batch(self, ops):
+        rows = {"journal": [], "visual": [], "streak": []}
+        for kind, row in ops:
+            rows[kind].append(row)
+        for kind, key, header in (
+            ("journal", "journal", JOURNAL_HEADER),
+            ("visual", "visual_journal", VJ_HEADER),
+            ("streak", "streaks", STREAKS_HEADER),
+        ):
+            if rows[kind]:
+                result = append_rows(self.paths[key], header, rows[kind])
+                if kind == "journal":
+                    self.journal.appended(result)
+        if rows["journal"]:
+            self.journal.persist()
+        if self.growth.count - self._growth_saved >= self.GROWTH_SAVE_EVERY:
+            self._save_growth()
+
+    def journal_count(self):
+        return len(self.journal)
+
+    def latest_journal(self):
+        n = len(self.journal)
+        return self.journal[self.journal.by_time(n - 1, n)[0]] if n else None
+
+    def recent_journal(self, limit):
+        n = len(self.journal)
+        return [self.journal[i] for i in self.journal.by_time(max(0, n - limit), n)]
+
+    def journal_since(self, count):
+        return self.journal[count:]
+
+    def iter_journal(self, start=None, end=None):
+        if start is None and end is None:
+            positions = self.journal.by_time(0, len(self.journal))
+        else:
+            positions = self.journal.indices(start, end)
+            if self.journal.order() is not None:
+                positions = sorted(positions, key=lambda i: (self.journal.epochs[i], i))
+        for i in positions:
+            yield self.journal[i]
+
+    def journal_page(self, before=None, limit=JOURNAL_PAGE_SIZE):
+        # Cursors are the position of the oldest entry shown, so they stay put as entries arrive
+        n = len(self.journal)
+        end = n if before is None or before >= n else (0 if before < 0 else self.journal.rank(before))
+        start = max(0, end - limit)
+        positions = self.journal.by_time(start, end)
+        return [self.journal[i] for i in reversed(positions)], (positions[0] if start else None)
+
+    def _search_ranked(self, terms, phrases, start=None, end=None, moods=None, limit=None):
+        keep = None
+        if start is not None or end is not None or moods:
+            in_range = self.journal.in_range(start, end) if start is not None or end is not None else None
+            def keep(i):
+                return (in_range is None or in_range(i)) and (not moods or str(self.journal.mood(i)).lower() in moods)
+        with self._search_lock:
+            index = self._search_index()
+            return rank_matches(index, index.count, terms, phrases, keep, limit)
+
+    def _journal_rows(self, keys):
+        return [self.journal[i] for i in keys]
+
+    def rebuild_search(self):
+        with self._search_lock:
+            index = SearchIndex()
+            for _, text, _, _ in self.journal:
+                index.add(text)
+            self._search = index
+            self._search_saved = -1
+        self._save_search()
+        return index.count
+
+    def growth_summary(self, top=6):
+        return self.growth.summary(top)
+
+    def rebuild_growth(self):
+        growth = GrowthAggregate(len(self.journal), math.fsum(self.journal.polarity))
+        for i in range(len(self.journal)):
+            growth.words.update(theme_words(self.journal.text(i)))
+        with self._growth_lock:
+            self.growth = growth
+        self._save_growth()
+        self._reset_series()
+        return growth.count
+
+    def _daily_buckets(self):
+        return MoodSeries.from_entries(*self.journal.day_polarity())
+
+    def rescore_journal(self, scorer, chunk_size=1000):
+        # Queued appends must land before the file is rewritten from memory
+        self.flush()
+        total = len(self.journal)
+        for i in range(0, total, chunk_size):
+            chunk = range(i, min(i + chunk_size, total))
+            scores = scorer([self.journal.text(j) for j in chunk])
+            for j, (p, mood) in zip(chunk, scores):
+                self.journal.set_score(j, p, mood)
+        save_rows(self.paths["journal"], JOURNAL_HEADER, self.journal)
+        self.journal.resync()
+        self.journal_version += 1
+        self.rebuild_growth()
+        return total
+
+    def recent_visual(self, limit):
+        return self.visual[-limit:]
+
+    def iter_visual(self):
+        return iter(self.visual)
+
+    def iter_streaks(self):
+        return iter(self.streaks)
+
+class SqlitePostings:
+    """
+    search_postings as a postings source for one rank_matches call, with the
+    per-term counts from search_terms. A list of weight above 1 is read once,
+    with the other tokens' weights, and shared by every combination it
+    drives; each reads it only as far as its own entries go.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self._levels = {}
+        self._tiers = {}
+
+    def df(self, term):
+        self._levels[term] = dict(self.conn.execute("SELECT weight, n FROM search_terms WHERE term = ?", (term,)))
+        return sum(self._levels[term].values())
+
+    def levels(self, term):
+        return {weight: n for weight, n in self._levels[term].items() if weight > 1}
+
+    def _join(self, want, columns):
+        # CROSS JOIN keeps the driver first, read newest first off search_weights; the others are lookups
+        joins, clauses, args = [], [], []
+        for k, (term, weight) in enumerate(want):
+            joins.append("search_postings p%d%s" % (k, "" if k else " INDEXED BY search_weights"))
+            clauses.append("p%d.term = ?" % k + (" AND p%d.entry_id = p0.entry_id" % k if k else ""))
+            args.append(term)
+            if weight is not None:
+                clauses.append("p%d.weight = ?" % k)
+                args.append(weight)
+        return self.conn.execute(
+            "SELECT p0.entry_id%s FROM %s WHERE %s ORDER BY p0.entry_id DESC"
+            % ("".join(", p%d.weight" % k for k in columns), " CROSS JOIN ".join(joins), " AND ".join(clauses)), args,
+        )
+
+    def matches(self, want):
+        (term, weight), *rest = want
+        if weight == 1.0 or not rest:
+            return (e for (e,) in self._join(want, ()))
+        rest.sort()
+        if (term, weight) not in self._tiers:
+            rows = self._join([(term, weight)] + [(t, None) for t, _ in rest], range(1, len(want)))
+            self._tiers[term, weight] = (rows, {})
+        return self._read_tier(self._tiers[term, weight], tuple(w for _, w in rest))
+
+    @staticmethod
+    def _read_tier(tier, weights):
+        # One combination's entries, reading the shared cursor no further than they need
+        rows, found = tier
+        mine = found.setdefault(weights, [])
+        i = 0
+        while True:
+            if i < len(mine):
+                yield mine[i]
+                i += 1
+                continue
+            row = next(rows, None)
+            if row is None:
+                return
+            e, *others = row
+            found.setdefault(tuple(others), []).append(e)
+
+    def intersect(self, terms):
+        rows = self._join([(t, None) for t in terms], range(len(terms)))
+        return ((e, weights) for e, *weights in rows)
+
+    def positions(self, entry_id, words):
+        words = sorted(words)
+        return {w: [int(p) for p in pos.split()] for w, pos in self.conn.execute(
+            "SELECT term, positions FROM search_postings WHERE term IN (%s) AND entry_id = ?"
+            % ",".join("?" * len(words)), (*words, entry_id),
+        )}
+
+class SqliteStorage(Storage):
+    """
+    SQLite in WAL mode, one connection per thread. Nothing is cached in
+    memory; journal timestamps and (task, date) streak keys are indexed.
+    The CSV files are imported once, the first time the database opens.
+    Each batch from WRITER is one transaction.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS journal (
+        id INTEGER PRIMARY KEY,
+        ts TEXT NOT NULL,
+        text TEXT NOT NULL,
+        mood TEXT NOT NULL,
+        polarity REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS journal_ts ON journal(ts);
+    CREATE TABLE IF NOT EXISTS visual_journal (
+        id INTEGER PRIMARY KEY,
+        ts TEXT NOT NULL,
+        image_path TEXT NOT NULL,
+        caption TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS streaks (
+        task TEXT NOT NULL,
+        date TEXT NOT NULL,
+        PRIMARY KEY (task, date)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS growth_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        count INTEGER NOT NULL,
+        pol_sum REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS growth_words (
+        word TEXT PRIMARY KEY,
+        n INTEGER NOT NULL,
+        first_seen INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS growth_words_n ON growth_words(n DESC, first_seen);
+    CREATE TABLE IF NOT EXISTS mood_daily (
+        day TEXT PRIMARY KEY,
+        n INTEGER NOT NULL,
+        pol_sum REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS search_postings (
+        term TEXT NOT NULL,
+        entry_id INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        positions TEXT NOT NULL,
+        PRIMARY KEY (term, entry_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS search_weights ON search_postings(term, weight, entry_id);
+    CREATE TABLE IF NOT EXISTS search_terms (
+        term TEXT NOT NULL,
+        weight REAL NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (term, weight)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, journal_path=None, vj_path=None, streaks_path=None):
+        super().__init__(os.path.dirname(path))
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+        self._migrate(journal_path, vj_path, streaks_path)
+        conn = self._conn()
+        if not conn.execute("SELECT 1 FROM growth_totals").fetchone() or \
+                not conn.execute("SELECT 1 FROM meta WHERE key = 'mood_daily'").fetchone():
+            self.rebuild_growth()
+        if not self._conn().execute("SELECT 1 FROM meta WHERE key = 'search_indexed'").fetchone():
+            self.rebuild_search()
+        elif not conn.execute("SELECT 1 FROM search_terms").fetchone() and conn.execute("SELECT 1 FROM search_postings").fetchone():
+            # Indexed before search_terms existed
+            with conn:
+                conn.execute("INSERT INTO search_terms (term, weight, n) "
+                             "SELECT term, weight, COUNT(*) FROM search_postings GROUP BY term, weight")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self):
+        """Connection for a query that must see this store's queued writes."""
+        self.flush()
+        return self._conn()
+
+    def close(self):
+        super().close()
+        # Other threads' connections close when this object is collected
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def _migrate(self, journal_path, vj_path, streaks_path):
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'csv_migrated'").fetchone():
+            return
+        with conn:
+            if journal_path:
+                conn.executemany(
+                    "INSERT INTO journal (ts, text, mood, polarity) VALUES (?, ?, ?, ?)",
+                    ((r[0], r[1], r[2], parse_polarity(r[3])) for r in load_rows(journal_path)),
+                )
+            if vj_path:
+                conn.executemany(
+                    "INSERT INTO visual_journal (ts, image_path, caption) VALUES (?, ?, ?)",
+                    load_rows(vj_path),
+                )
+            if streaks_path:
+                conn.executemany("INSERT OR IGNORE INTO streaks (task, date) VALUES (?, ?)", load_rows(streaks_path))
+            conn.execute("INSERT INTO meta (key, value) VALUES ('csv_migrated', ?)", (datetime.now().isoformat(),))
+
+    def _write_batch(self, ops):
+        with self._conn() as conn:
+            for kind, row in ops:
+                if kind == "journal":
+                    cur = conn.execute("INSERT INTO journal (ts, text, mood, polarity) VALUES (?, ?, ?, ?)", row)
+                    self._add_growth(conn, cur.lastrowid, row[1], row[3])
+                    self._add_daily(conn, row[0], row[3])
+                    self._add_postings(conn, cur.lastrowid, row[1])
+                elif kind == "visual":
+                    conn.execute("INSERT INTO visual_journal (ts, image_path, caption) VALUES (?, ?, ?)", row)
+                elif kind == "streak":
+                    conn.execute("INSERT OR IGNORE INTO streaks (task, date) VALUES (?, ?)", row)
+
+    @staticmethod
+    def _add_daily(conn, ts, polarity):
+        conn.execute(
+            "INSERT INTO mood_daily (day, n, pol_sum) VALUES (?, 1, ?) "
+            "ON CONFLICT(day) DO UPDATE SET n = n + 1, pol_sum = pol_sum + excluded.pol_sum",
+            (str(ts)[:10], polarity),
+        )
+
+    @staticmethod
+    def _add_growth(conn, entry_id, text, polarity):
+        # first_seen orders ties the way Counter.most_common does: by first appearance
+        conn.execute(
+            "INSERT INTO growth_totals (id, count, pol_sum) VALUES (0, 1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET count = count + 1, pol_sum = pol_sum + excluded.pol_sum",
+            (float(polarity),),
+        )
+        conn.executemany(
+            "INSERT INTO growth_words (word, n, first_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT(word) DO UPDATE SET n = n + excluded.n",
+            ((w, n, (entry_id << 20) + i) for i, (w, n) in enumerate(Counter(theme_words(text)).items())),
+        )
+
+    @staticmethod
+    def _postings(entry_id, text):
+        """search_postings rows (term, entry_id, weight, positions) for one entry."""
+        positions = {}
+        for i, w in enumerate(theme_words(text)):
+            positions.setdefault(w, []).append(str(i))
+        return [(w, entry_id, tf_weight(len(pos)), " ".join(pos)) for w, pos in positions.items()]
+
+    @classmethod
+    def _add_postings(cls, conn, entry_id, text):
+        rows = cls._postings(entry_id, text)
+        conn.executemany(
+            "INSERT OR REPLACE INTO search_postings (term, entry_id, weight, positions) VALUES (?, ?, ?, ?)", rows,
+        )
+        conn.executemany(
+            "INSERT INTO search_terms (term, weight, n) VALUES (?, ?, 1) "
+            "ON CONFLICT(term, weight) DO UPDATE SET n = n + 1",
+            ((w, weight) for w, _, weight, _ in rows),
+        )
+
+    def rebuild_search(self):
+        conn = self._read()
+        with conn:
+            # One bulk insert, then search_weights and search_terms built once at the end
+            conn.execute("DELETE FROM search_postings")
+            conn.execute("DELETE FROM search_terms")
+            conn.execute("DROP INDEX IF EXISTS search_weights")
+            entries = conn.execute("SELECT id, text FROM journal ORDER BY id").fetchall()
+            conn.executemany(
+                "INSERT INTO search_postings (term, entry_id, weight, positions) VALUES (?, ?, ?, ?)",
+                (row for entry_id, text in entries for row in self._postings(entry_id, text)),
+            )
+            conn.execute("CREATE INDEX search_weights ON search_postings(term, weight, entry_id)")
+            conn.execute("INSERT INTO search_terms (term, weight, n) "
+                         "SELECT term, weight, COUNT(*) FROM search_postings GROUP BY term, weight")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('search_indexed', ?)", (datetime.now().isoformat(),))
+        return conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def _search_ranked(self, terms, phrases, start=None, end=None, moods=None, limit=None):
+        # rank_matches reads the postings through SqlitePostings; filters are checked per match
+        conn = self._read()
+        keep = None
+        clauses, args = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            args.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            args.append(end)
+        if moods:
+            clauses.append("LOWER(mood) IN (%s)" % ",".join("?" * len(moods)))
+            args.extend(moods)
+        if clauses:
+            sql = "SELECT 1 FROM journal WHERE id = ? AND " + " AND ".join(clauses)
+            def keep(entry_id):
+                return conn.execute(sql, (entry_id, *args)).fetchone() is not None
+        n_docs = conn.execute("SELECT count FROM growth_totals WHERE id = 0").fetchone()[0]
+        return rank_matches(SqlitePostings(conn), n_docs, terms, phrases, keep, limit)
+
+    def _journal_rows(self, keys):
+        rows = {}
+        conn = self._read()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            for entry_id, *row in conn.execute(
+                "SELECT id, ts, text, mood, polarity FROM journal WHERE id IN (%s)" % ",".join("?" * len(chunk)), chunk
+            ):
+                rows[entry_id] = tuple(row)
+        return [rows[k] for k in keys]
+
+    def growth_summary(self, top=6):
+        conn = self._read()
+        row = conn.execute("SELECT count, pol_sum FROM growth_totals WHERE id = 0").fetchone()
+        if not row or not row[0]:
+            return None, 0, []
+        words = [w for (w,) in conn.execute(
+            "SELECT word FROM growth_words ORDER BY n DESC, first_seen LIMIT ?", (top,)
+        )]
+        return row[1] / row[0], row[0], words
+
+    def rebuild_growth(self):
+        conn = self._read()
+        with conn:
+            # Totals are summed here and written once, rather than upserted per entry like _add_growth
+            conn.execute("DELETE FROM growth_totals")
+            conn.execute("DELETE FROM growth_words")
+            count, pol_sum, words = 0, 0.0, {}
+            for entry_id, text, p in conn.execute("SELECT id, text, polarity FROM journal ORDER BY id"):
+                count += 1
+                pol_sum += float(p)
+                for i, (w, n) in enumerate(Counter(theme_words(text)).items()):
+                    if w in words:
+                        words[w][0] += n
+                    else:
+                        words[w] = [n, (entry_id << 20) + i]
+            conn.execute("INSERT INTO growth_totals (id, count, pol_sum) VALUES (0, ?, ?)", (count, pol_sum))
+            conn.executemany("INSERT INTO growth_words (word, n, first_seen) VALUES (?, ?, ?)",
+                             ((w, n, first) for w, (n, first) in words.items()))
+            conn.execute("DELETE FROM mood_daily")
+            conn.execute(
+                "INSERT INTO mood_daily (day, n, pol_sum) "
+                "SELECT substr(ts, 1, 10), COUNT(*), SUM(polarity) FROM journal GROUP BY substr(ts, 1, 10)"
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('mood_daily', ?)", (datetime.now().isoformat(),))
+        self._reset_series()
+        return conn.execute("SELECT count FROM growth_totals WHERE id = 0").fetchone()[0]
+
+    def _daily_buckets(self):
+        days, counts, sums = [], [], []
+        for day, n, pol_sum in self._read().execute("SELECT day, n, pol_sum FROM mood_daily ORDER BY day"):
+            try:
+                days.append(date.fromisoformat(day).toordinal())
+            except ValueError:
+                continue
+            counts.append(n)
+            sums.append(pol_sum)
+        return MoodSeries(days, counts, sums)
+
+    def rescore_journal(self, scorer, chunk_size=1000):
+        conn = self._read()
+        last_id = 0
+        total = 0
+        while True:
+            chunk = conn.execute(
+                "SELECT id, text FROM journal WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk_size)
+            ).fetchall()
+            if not chunk:
+                break
+            scores = scorer([text for _, text in chunk])
+            with conn:
+                conn.executemany(
+                    "UPDATE journal SET polarity = ?, mood = ? WHERE id = ?",
+                    ((p, mood, entry_id) for (entry_id, _), (p, mood) in zip(chunk, scores)),
+                )
+            last_id = chunk[-1][0]
+            total += len(chunk)
+        self.journal_version += 1
+        self.rebuild_growth()
+        return total
+
+    def journal_count(self):
+        return self._read().execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def latest_journal(self):
+        return self._read().execute(
+            "SELECT ts, text, mood, polarity FROM journal ORDER BY ts DESC, id DESC LIMIT 1"
+        ).fetchone()
+
+    def recent_journal(self, limit):
+        rows = self._read().execute(
+            "SELECT ts, text, mood, polarity FROM journal ORDER BY ts DESC, id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    def journal_since(self, count):
+        return self._read().execute("SELECT ts, text, mood, polarity FROM journal ORDER BY id LIMIT -1 OFFSET ?", (count,))
+
+    def iter_journal(self, start=None, end=None):
+        if start is None and end is None:
+            return self._read().execute("SELECT ts, text, mood, polarity FROM journal ORDER BY ts, id")
+        clauses, args = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            args.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            args.append(end)
+        return self._read().execute(
+            "SELECT ts, text, mood, polarity FROM journal WHERE " + " AND ".join(clauses) + " ORDER BY ts, id",
+            args,
+        )
+
+    def journal_page(self, before=None, limit=JOURNAL_PAGE_SIZE):
+        # Cursors are the id of the oldest entry shown; pages follow journal_ts (ts, then id).
+        # One extra row tells whether another page exists.
+        if before is None:
+            rows = self._read().execute(
+                "SELECT id, ts, text, mood, polarity FROM journal ORDER BY ts DESC, id DESC LIMIT ?", (limit + 1,)
+            ).fetchall()
+        else:
+            rows = self._read().execute(
+                "SELECT id, ts, text, mood, polarity FROM journal"
+                " WHERE (ts, id) < (SELECT ts, id FROM journal WHERE id = ?) ORDER BY ts DESC, id DESC LIMIT ?",
+                (before, limit + 1),
+            ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return [row[1:] for row in rows], (rows[-1][0] if more else None)
+
+    def recent_visual(self, limit):
+        rows = self._read().execute(
+            "SELECT ts, image_path, caption FROM visual_journal ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    def iter_visual(self):
+        return self._read().execute("SELECT ts, image_path, caption FROM visual_journal ORDER BY id")
+
+    def iter_streaks(self):
+        return self._read().execute("SELECT task, date FROM streaks")
+
+def open_storage(directory=DATA_DIR, backend=STORAGE_BACKEND):
+    """Open the shard in directory; its CSV files are migrated into SQLite on first open."""
+    journal_path = os.path.join(directory, os.path.basename(JOURNAL_PATH))
+    vj_path = os.path.join(directory, os.path.basename(VJ_PATH))
+    streaks_path = os.path.join(directory, os.path.basename(STREAKS_PATH))
+    if backend == "csv":
+        growth_path = os.path.join(directory, os.path.basename(GROWTH_PATH))
+        search_path = os.path.join(directory, os.path.basename(SEARCH_PATH))
+        return CsvStorage(directory, journal_path, vj_path, streaks_path, growth_path, search_path)
+    return SqliteStorage(os.path.join(directory, os.path.basename(DB_PATH)), journal_path, vj_path, streaks_path)
 
-# Networking & NLP
-import requests
+def migrate_shards(progress=None):
+    """
+    Open the default shard and every logged-in user's, so CSV migration and
+    index rebuilds (tens of seconds at 100k entries) run now instead of on
+    someone's first request. Session shards are left alone. Returns how
+    many shards were opened.
+    """
+    directories = [DATA_DIR]
+    if os.path.isdir(USERS_DIR):
+        directories += sorted(e.path for e in os.scandir(USERS_DIR) if e.is_dir())
+    for directory in directories:
+        started = time.perf_counter()
+        store = open_storage(directory)
+        try:
+            n = store.journal_count()
+        finally:
+            store.close()
+        if progress:
+            progress(directory, n, time.perf_counter() - started)
+    return len(directories)
 
-try:
-    from textblob import TextBlob
-except Exception:
-    TextBlob = None
+# ---------------------------
+# Exports: filtered rows streamed to a temp file
+# ---------------------------
+EXPORT_FORMATS = ["csv", "jsonl", "csv.gz", "jsonl.gz"]
+EXPORT_HEADERS = {"journal": JOURNAL_HEADER, "visual_journal": VJ_HEADER, "streaks": STREAKS_HEADER}
+# Gradio copies a returned file into its own cache, so an export is only needed briefly
+EXPORT_MAX_AGE = float(os.environ.get("MINDMATE_EXPORT_MAX_AGE_SECONDS", "600"))
+_export_root = None
+_export_lock = threading.Lock()
 
-# TTS
-try:
-    from gtts import gTTS
-except Exception:
-    gTTS = None
+def sweep_exports(max_age=EXPORT_MAX_AGE):
+    """Delete export directories older than max_age seconds; return how many were removed."""
+    if _export_root is None:
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(_export_root):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed
 
-# UI
-import gradio as gr
+def export_dir():
+    """
+    A fresh directory under this process's export temp root (removed at
+    exit). Each call first sweeps away exports older than EXPORT_MAX_AGE.
+    """
+    global _export_root
+    with _export_lock:
+        if _export_root is None:
+            _export_root = tempfile.mkdtemp(prefix="mindmate-exports-")
+            atexit.register(shutil.rmtree, _export_root, True)
+        sweep_exports()
+        return tempfile.mkdtemp(dir=_export_root)
+
+def date_bounds(start=None, end=None):
+    """
+    Inclusive YYYY-MM-DD dates as a [start, end) pair of timestamp bounds;
+    blank means unbounded. Raises ValueError on a malformed date.
+    """
+    start = (start or "").strip() or None
+    end = (end or "").strip() or None
+    if start is not None:
+        start = date.fromisoformat(start).isoformat()
+    if end is not None:
+        end = (date.fromisoformat(end) + timedelta(days=1)).isoformat()
+    return start, end
+
+def export_rows(store, kind, start=None, end=None, moods=None):
+    """
+    Generator over one dataset's rows with start <= date < end (bounds from
+    date_bounds) and, for the journal, mood in moods. Rows come straight
+    from the store's iterators, so nothing is collected in memory.
+    """
+    if kind == "journal":
+        wanted = {m.lower() for m in moods} if moods else None
+        for row in store.iter_journal(start, end):
+            if wanted is None or str(row[2]).lower() in wanted:
+                yield row
+        return
+    rows, ts_col = (store.iter_visual(), 0) if kind == "visual_journal" else (store.iter_streaks(), 1)
+    for row in rows:
+        ts = row[ts_col]
+        if (start is None or ts >= start) and (end is None or ts < end):
+            yield row
+
+def write_export(rows, header, path, fmt="csv"):
+    """Stream rows to path as CSV or JSONL, gzip-compressed for the .gz formats; return the row count."""
+    opener = gzip.open if fmt.endswith(".gz") else open
+    count = 0
+    with opener(path, "wt", encoding="utf-8", newline="") as f:
+        if fmt.startswith("csv"):
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(header, row)), ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+def export_dataset(store, kind, start=None, end=None, moods=None, fmt="csv"):
+    """Export one filtered dataset to a new temp file and return its path."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    lo, hi = date_bounds(start, end)
+    name = kind
+    if lo or hi:
+        last = (date.fromisoformat(hi) - timedelta(days=1)).isoformat() if hi else "latest"
+        name += f"_{lo or 'first'}_to_{last}"
+    path = os.path.join(export_dir(), f"{name}.{fmt}")
+    write_export(export_rows(store, kind, lo, hi, moods), EXPORT_HEADERS[kind], path, fmt)
+    return path
 
 # ---------------------------
-# Paths and data directories
+# Bulk import: journal history from CSV / JSONL, chunked and resumable
 # ---------------------------
-BASE_DIR = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
-DATA_DIR = os.path.join(BASE_DIR, "data")
-os.makedirs(DATA_DIR, exist_ok=True)
+IMPORT_FORMATS = ["csv", "jsonl"]
+IMPORT_CHUNK = int(os.environ.get("MINDMATE_IMPORT_CHUNK", "1000"))
+# Source fields tried, in order, for the entry text and its time
+IMPORT_TEXT_FIELDS = ("text", "entry", "body", "content", "note")
+IMPORT_TIME_FIELDS = ("timestamp", "date", "created_at", "created", "time")
 
-JOURNAL_PATH = os.path.join(DATA_DIR, "journal.csv")
-VJ_PATH = os.path.join(DATA_DIR, "visual_journal.csv")
-STREAKS_PATH = os.path.join(DATA_DIR, "streaks.csv")
+def import_format(path, fmt=None):
+    """The import format for path: fmt if given, else from the extension (CSV by default)."""
+    if fmt:
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f"Unknown import format: {fmt}")
+        return fmt
+    name = path.lower()
+    name = name[:-3] if name.endswith(".gz") else name
+    return "jsonl" if name.endswith((".jsonl", ".ndjson")) else "csv"
+
+def import_timestamp(value, default):
+    """A source time as "YYYY-MM-DD HH:MM": default when blank, None when unreadable."""
+    value = str(value or "").strip()
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M")
+    except ValueError:
+        return None
+
+def _import_records(f, fmt, offset):
+    """
+    (record, byte offset just past it) for each record of binary file f,
+    read from its current position, offset. CSV records are lists of
+    fields; JSONL records are dicts, or None for a line that is not one.
+    """
+    if fmt == "jsonl":
+        for line in f:
+            offset += len(line)
+            if line.strip():
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    obj = None
+                yield (obj if isinstance(obj, dict) else None), offset
+        return
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    def lines():
+        nonlocal offset
+        for line in text:
+            offset += len(line.encode("utf-8"))
+            yield line
+    # The reader pulls lines one at a time, so offset is at the end of each row it yields
+    for row in csv.reader(lines()):
+        yield row, offset
+
+def _save_checkpoint(path, state):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def import_journal(store, path, fmt=None, chunk_size=IMPORT_CHUNK, progress=None):
+    """
+    Stream journal entries from a CSV or JSONL file (optionally .gz) into
+    store. Each chunk of chunk_size entries is scored in one batch, written
+    and then checkpointed under the shard's imports/ directory, keyed by the
+    file's SHA-256: importing the same file again resumes after the last
+    checkpointed chunk, or does nothing once it has finished.
+
+    The writer may commit part of a chunk before a crash, so the checkpoint
+    marks a chunk as pending (with the journal's size) before writing it.
+    A resumed import skips the pending chunk's entries that are already
+    among the entries added since, instead of adding them twice.
+    progress(state) is called after every chunk. Returns the final state.
+    """
+    fmt = import_format(path, fmt)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    ckpt_dir = os.path.join(store.directory, "imports")
+    os.makedirs(ckpt_dir, exist_ok=True)
+    ckpt_path = os.path.join(ckpt_dir, digest.hexdigest() + ".json")
+    state = {"source": os.path.basename(path), "format": fmt, "offset": 0, "header": None,
+             "imported": 0, "skipped": 0, "done": False, "pending": None,
+             # Entries without a time get the import's start time, also when resumed
+             "now": datetime.now().strftime("%Y-%m-%d %H:%M")}
+    if os.path.exists(ckpt_path):
+        with open(ckpt_path, "r", encoding="utf-8") as f:
+            state.update(json.load(f))
+    if state["done"]:
+        return state
+    now = state["now"]
+    pending = state["pending"]
+    written = Counter()
+    if pending:
+        written.update((ts, text) for ts, text, *_ in store.journal_since(pending["journal_count"]))
+    chunk = []
+    with (gzip.open if path.lower().endswith(".gz") else open)(path, "rb") as f:
+        offset = state["offset"]
+        if offset:
+            f.seek(offset)
+        elif f.read(3) == b"\xef\xbb\xbf":
+            offset = 3
+        else:
+            f.seek(0)
+        records = _import_records(f, fmt, offset)
+        header = state["header"]
+        if fmt == "csv" and header is None:
+            first = next(records, None)
+            header = state["header"] = [h.strip().lower() for h in first[0]] if first else []
+            state["offset"] = first[1] if first else offset
+
+        def commit(end):
+            state["pending"] = {"end": end, "journal_count": store.journal_count()}
+            _save_checkpoint(ckpt_path, state)
+            scores = SENTIMENT.score_many([text[:1000] for _, text in chunk])
+            for (ts, text), p in zip(chunk, scores):
+                store.add_journal(ts, text, journal_mood(p), p)
+            # Entries are on disk before the checkpoint says so
+            store.flush()
+            APPEND_LOG.sync()
+            state["offset"] = end
+            state["imported"] += len(chunk)
+            state["pending"] = None
+            chunk.clear()
+            _save_checkpoint(ckpt_path, state)
+            if progress:
+                progress(state)
+
+        end = state["offset"]
+        for record, end in records:
+            if fmt == "csv":
+                record = dict(zip(header, record))
+            text = ts = None
+            if record:
+                text = next((str(record[k]).strip() for k in IMPORT_TEXT_FIELDS if record.get(k)), "")
+                ts = import_timestamp(next((record[k] for k in IMPORT_TIME_FIELDS if record.get(k)), None), now)
+            if not text or ts is None:
+                state["skipped"] += 1
+                continue
+            if pending and end <= pending["end"] and written[ts, text]:
+                # Written by the interrupted run before its checkpoint
+                written[ts, text] -= 1
+                state["imported"] += 1
+                continue
+            chunk.append((ts, text))
+            if len(chunk) >= chunk_size:
+                commit(end)
+        state["done"] = True
+        commit(end)
+    return state
+
+def describe_import(state):
+    msg = f"Imported {state['imported']} entries from {state['source']}"
+    if state["skipped"]:
+        msg += f" ({state['skipped']} records skipped: no text or an unreadable date)"
+    return msg + ("." if state["done"] else " so far; import the same file again to resume.")
 
 # ---------------------------
-# Settings & helpers
+# Users: per-user settings and storage shards
 # ---------------------------
-SETTINGS = {
-    "speak_emojis": False,
-}
+def _shard_name(user_id):
+    # Hashed so user names never become paths
+    return hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
 
-EMOJI_REGEX = re.compile(r'[^\w\s.,?!\'"\-]')
+# Prefix of anonymous user ids -> (directory of their shards, seconds unused before deletion)
+ANONYMOUS_SHARDS = {"session:": (SESSIONS_DIR, SESSION_MAX_AGE), "visitor:": (VISITORS_DIR, VISITOR_MAX_AGE)}
 
-def clean_text_for_tts(text, speak_emojis=False):
-    if speak_emojis:
-        return text or " "
-    return EMOJI_REGEX.sub("", (text or " "))
+def _anonymous(user_id):
+    return next((prefix for prefix in ANONYMOUS_SHARDS if user_id.startswith(prefix)), None)
+
+def shard_dir(user_id):
+    if user_id == DEFAULT_USER:
+        return DATA_DIR
+    prefix = _anonymous(user_id)
+    root = ANONYMOUS_SHARDS[prefix][0] if prefix else USERS_DIR
+    path = os.path.join(root, _shard_name(user_id))
+    os.makedirs(path, exist_ok=True)
+    if prefix:
+        SESSION_JANITOR.ensure_started()
+    return path
 
-def text_to_speech(text, filename=None, slow=True):
+def _last_modified(path):
+    newest = os.path.getmtime(path)
+    for entry in os.scandir(path):
+        try:
+            newest = max(newest, entry.stat().st_mtime)
+        except OSError:
+            pass
+    return newest
+
+def sweep_sessions(max_age, active, prefix="session:"):
     """
-    Create TTS mp3 using gTTS (if installed).
-    Return generated filepath or None if TTS unavailable.
+    Delete the shards of anonymous user ids starting with prefix (see
+    ANONYMOUS_SHARDS) not modified for max_age seconds, except those of the
+    loaded user ids in active. Returns how many were removed.
     """
-    if not text:
-        return None
-    if filename is None:
-        filename = f"tts_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.mp3"
-    filepath = os.path.join(DATA_DIR, filename)
-    safe = clean_text_for_tts(text, speak_emojis=SETTINGS.get("speak_emojis", False))
-    if gTTS is None:
-        return None
+    directory = ANONYMOUS_SHARDS[prefix][0]
+    if not os.path.isdir(directory):
+        return 0
+    keep = {_shard_name(user_id) for user_id in active if user_id.startswith(prefix)}
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(directory):
+        if not entry.is_dir() or entry.name in keep or entry.name.endswith(".expired"):
+            continue
+        try:
+            if _last_modified(entry.path) > cutoff:
+                continue
+            # Renamed first, so a returning session starts a fresh shard rather than a half-deleted one
+            doomed = entry.path + ".expired"
+            os.replace(entry.path, doomed)
+            shutil.rmtree(doomed, ignore_errors=True)
+            removed += 1
+        except OSError as e:
+            print("Session sweep error:", e)
+    return removed
+
+class SessionJanitor:
+    """Background thread running sweep_sessions for each of ANONYMOUS_SHARDS every interval seconds."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.removed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="session-janitor", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                active = [u.user_id for u in USERS.loaded()]
+                for prefix, (_, max_age) in ANONYMOUS_SHARDS.items():
+                    self.removed += sweep_sessions(max_age, active, prefix)
+            except Exception as e:
+                print("Session janitor error:", e)
+            time.sleep(self.interval)
+
+    def stats(self):
+        return {"removed": self.removed}
+
+SESSION_JANITOR = SessionJanitor(SESSION_JANITOR_INTERVAL)
+
+class PageCache:
+    """
+    Rendered pages of one store's journal, keyed by cursor and page size.
+    Everything is dropped when the store's journal_version moves on.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._pages = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, store, cursor, limit, render):
+        """(rendered page, next cursor), calling render(rows) on a miss."""
+        key = (cursor, limit)
+        with self._lock:
+            if self._version != store.journal_version:
+                self._pages.clear()
+                self._version = store.journal_version
+            if key in self._pages:
+                self._pages.move_to_end(key)
+                return self._pages[key]
+            version = self._version
+        rows, next_cursor = store.journal_page(cursor, limit)
+        page = (render(rows), next_cursor)
+        with self._lock:
+            if self._version == version:
+                self._pages[key] = page
+                while len(self._pages) > self.size:
+                    self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._version = None
+
+class DashboardView:
+    """
+    One user's rendered Dashboard panels, rebuilt only when the date changes
+    (streaks and the tip are per day) or the store's journal or streak
+    version moves on.
+    """
+    def __init__(self):
+        self.builds = 0
+        self._key = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self, store, build):
+        # The key is read before building, so a write that lands mid-build
+        # leaves a stale key and the next visit rebuilds
+        key = (date.today(), store.journal_version, store.streak_version)
+        with self._lock:
+            if self._key == key:
+                return self._value
+        value = build()
+        with self._lock:
+            self._key, self._value = key, value
+            self.builds += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._key = self._value = None
+
+class UserState:
+    """One user's settings and (lazily opened) storage shard."""
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.settings = dict(SETTINGS)
+        self.last_used = time.monotonic()
+        self.journal_pages = PageCache(JOURNAL_PAGE_CACHE)
+        self.dashboard = DashboardView()
+        self._store = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        with self._lock:
+            if self._store is None:
+                with METRICS.timer("mindmate_storage_open_seconds", backend=STORAGE_BACKEND):
+                    self._store = open_storage(shard_dir(self.user_id))
+            return self._store
+
+    def close(self):
+        with self._lock:
+            store, self._store = self._store, None
+        self.journal_pages.clear()
+        self.dashboard.clear()
+        if store is not None:
+            store.close()
+            if _anonymous(self.user_id):
+                # Reads leave no trace on disk; mark the shard used so the janitor keeps it
+                try:
+                    os.utime(shard_dir(self.user_id))
+                except OSError:
+                    pass
+
+class UserRegistry:
+    """
+    Active users, least recently used first. Users beyond max_active, or idle
+    for longer than idle_seconds, are unloaded and reopened on their next
+    request, so memory tracks the active users rather than the user base.
+    Unloading (flushing and closing the shard) runs on a background thread;
+    a user reopened meanwhile waits for their old shard to close first.
+    """
+    def __init__(self, max_active, idle_seconds):
+        self.max_active = max_active
+        self.idle_seconds = idle_seconds
+        self.unloaded = 0
+        self._users = OrderedDict()
+        self._closing = {}  # user_id -> Future of the unload in progress
+        self._lock = threading.Lock()
+        self._unloader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-unload")
+
+    def get(self, user_id, evict=True):
+        """
+        The UserState for user_id, marked most recently used. With
+        evict=False nobody is unloaded, which keeps the call to a dict
+        update for the emergency lane.
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            user = self._users.pop(user_id, None)
+            closing = self._closing.get(user_id) if user is None else None
+            if user is None:
+                user = UserState(user_id)
+            user.last_used = now
+            self._users[user_id] = user
+            while evict and len(self._users) > 1:
+                oldest = next(iter(self._users.values()))
+                if len(self._users) <= self.max_active and now - oldest.last_used <= self.idle_seconds:
+                    break
+                evicted.append(self._users.popitem(last=False)[1])
+            self.unloaded += len(evicted)
+            unloading = [(old.user_id, self._unloader.submit(self._unload, old)) for old in evicted]
+            self._closing.update(unloading)
+        for old_id, fut in unloading:
+            fut.add_done_callback(functools.partial(self._unloaded, old_id))
+        if closing is not None:
+            closing.result()
+        return user
+
+    @staticmethod
+    def _unload(user):
+        try:
+            user.close()
+        except Exception as e:
+            print("User unload error:", e)
+
+    def _unloaded(self, user_id, fut):
+        with self._lock:
+            if self._closing.get(user_id) is fut:
+                del self._closing[user_id]
+
+    def loaded(self):
+        """Snapshot of the active UserStates."""
+        with self._lock:
+            return list(self._users.values())
+
+    def stats(self):
+        with self._lock:
+            return {"active": len(self._users), "unloaded": self.unloaded}
+
+USERS = UserRegistry(MAX_ACTIVE_USERS, USER_IDLE_SECONDS)
+_user_local = threading.local()
+
+def _cookie(headers, name):
+    # headers: (name, value) byte pairs, as in an ASGI scope
+    for key, value in headers:
+        if key.lower() == b"cookie":
+            for part in value.decode("latin-1").split(";"):
+                k, _, v = part.strip().partition("=")
+                if k == name:
+                    return v
+    return None
+
+def _visitor(value):
+    # Ids are what VisitorCookies issues; anything else is ignored
+    return value if value and re.fullmatch(r"[0-9a-f]{32}", value) else None
+
+def visitor_id(request):
+    """The visitor id VisitorCookies gave request's browser, or None."""
     try:
-        tts = gTTS(text=safe, lang="en", slow=bool(slow))
-        tts.save(filepath)
-        return filepath
-    except Exception as e:
-        print("TTS error:", e)
+        return _visitor(request.cookies.get(VISITOR_COOKIE))
+    except Exception:
         return None
 
+class VisitorCookies:
+    """
+    ASGI middleware giving every browser a random visitor id, so a visitor
+    who has not logged in keeps a journal of their own across reloads
+    (MINDMATE_USER_SCOPE="user"). A request arriving without the cookie is
+    handled as if it had sent the new one.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _visitor(_cookie(scope["headers"], VISITOR_COOKIE)):
+            return await self.app(scope, receive, send)
+        value = uuid.uuid4().hex
+        headers = [(k, v) for k, v in scope["headers"] if k.lower() != b"cookie"]
+        cookies = [v.decode("latin-1") for k, v in scope["headers"] if k.lower() == b"cookie"]
+        headers.append((b"cookie", "; ".join([*cookies, f"{VISITOR_COOKIE}={value}"]).encode("latin-1")))
+        set_cookie = (f"{VISITOR_COOKIE}={value}; Max-Age={int(VISITOR_MAX_AGE)}; Path=/; HttpOnly; SameSite=Lax"
+                      .encode("latin-1"))
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=[*message.get("headers", []), (b"set-cookie", set_cookie)])
+            await send(message)
+
+        await self.app(dict(scope, headers=headers), receive, send_with_cookie)
+
+def user_id_for(request):
+    """Map a gr.Request to a user id (see MINDMATE_USER_SCOPE)."""
+    if request is None or USER_SCOPE == "shared":
+        return DEFAULT_USER
+    username = getattr(request, "username", None)
+    if username:
+        return f"user:{username}"
+    session = getattr(request, "session_hash", None)
+    if USER_SCOPE == "session" and session:
+        return f"session:{session}"
+    # Anonymous visitors never share the default shard
+    visitor = visitor_id(request)
+    if visitor:
+        return f"visitor:{visitor}"
+    return f"session:{session}" if session else DEFAULT_USER
+
+@contextlib.contextmanager
+def as_user(user_id, evict=True):
+    """Run the enclosed code as user_id on this thread (see UserRegistry.get for evict)."""
+    prev = getattr(_user_local, "user", None)
+    _user_local.user = USERS.get(user_id or DEFAULT_USER, evict)
+    try:
+        yield _user_local.user
+    finally:
+        _user_local.user = prev
+
+def current_user():
+    return getattr(_user_local, "user", None) or USERS.get(DEFAULT_USER)
+
+def get_store():
+    """Storage shard of the user the current handler runs as."""
+    return current_user().store
+
+def ui_handler(fn, name=None, deferred=DEFERRED_TTS, evict=True):
+    """
+    Wrap a UI event handler so it runs as the requesting user and, when
+    deferred, streams its audio in after the text. The wrapper takes a
+    trailing gr.Request, which Gradio fills in from the annotation. Latency
+    and errors are recorded in METRICS under name (default fn.__name__).
+    evict=False never unloads other users on the way (see UserRegistry.get).
+    """
+    name = name or fn.__name__
+    def bound(*args):
+        request = None
+        if args and isinstance(args[-1], gr.Request):
+            args, request = args[:-1], args[-1]
+        started = time.perf_counter()
+        try:
+            with as_user(user_id_for(request), evict):
+                return fn(*args)
+        except Exception:
+            METRICS.inc("mindmate_handler_errors_total", handler=name)
+            raise
+        finally:
+            METRICS.observe("mindmate_handler_seconds", time.perf_counter() - started, handler=name)
+    run = with_deferred_audio(bound) if deferred else bound
+    functools.update_wrapper(run, fn)
+    sig = inspect.signature(fn)
+    request_param = inspect.Parameter("request", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=gr.Request)
+    run.__signature__ = sig.replace(parameters=[*sig.parameters.values(), request_param])
+    run.__annotations__ = {**getattr(fn, "__annotations__", {}), "request": gr.Request}
+    return run
+
+_emergency_executor = ThreadPoolExecutor(max_workers=EMERGENCY_WORKERS, thread_name_prefix="emergency")
+
+def fast_lane(fn, name=None):
+    """
+    ui_handler for events that must answer at once whatever else is running.
+    Gradio awaits the coroutine directly instead of taking one of its shared
+    worker threads, and fn runs on a small pool of its own; fn itself must
+    not wait on TTS or other lanes. Resolving the user never unloads anyone.
+    """
+    handler = ui_handler(fn, name, deferred=False, evict=False)
+    async def run(*args):
+        return await asyncio.get_running_loop().run_in_executor(_emergency_executor, handler, *args)
+    functools.update_wrapper(run, handler)
+    run.__signature__ = handler.__signature__
+    return run
+
+def lane(name):
+    """Listener keyword arguments that put an event in one of LANES."""
+    return {"concurrency_id": name, "concurrency_limit": LANES[name]}
+
 # ---------------------------
-# CSV read/write helpers
+# Sentiment scoring
 # ---------------------------
-def load_rows(path):
-    rows = []
-    if os.path.exists(path):
+def text_polarity(text):
+    """TextBlob polarity in [-1, 1]; 0.0 for blank text or when TextBlob is unavailable."""
+    return mindmate_workers.polarity(get_textblob(), text)
+
+def _polarity_chunk(texts):
+    # In this process; pool workers run mindmate_workers.polarity_chunk
+    TextBlob = get_textblob()
+    return [mindmate_workers.polarity(TextBlob, t) for t in texts]
+
+class SentimentService:
+    """
+    Memoized polarity scoring. score() serves repeated texts from an LRU
+    keyed by a hash of the text; score_many() scores the misses of a whole
+    batch across a process pool.
+    """
+    def __init__(self, cache_size, workers):
+        self.cache_size = cache_size
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()
+        self._pool = None
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def _get(self, key):
+        with self._lock:
+            p = self._memo.get(key)
+            if p is None:
+                self.misses += 1
+            else:
+                self._memo.move_to_end(key)
+                self.hits += 1
+            return p
+
+    def _put(self, key, p):
+        with self._lock:
+            self._memo[key] = p
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.cache_size:
+                self._memo.popitem(last=False)
+
+    def score(self, text):
+        text = text or ""
+        key = self._key(text)
+        p = self._get(key)
+        if p is None:
+            p = text_polarity(text)
+            self._put(key, p)
+        return p
+
+    def score_many(self, texts, chunk_size=256):
+        texts = [t or "" for t in texts]
+        results = [None] * len(texts)
+        todo = OrderedDict()  # key -> (text, [indices])
+        for i, t in enumerate(texts):
+            key = self._key(t)
+            p = self._get(key)
+            if p is not None:
+                results[i] = p
+            elif key in todo:
+                todo[key][1].append(i)
+            else:
+                todo[key] = (t, [i])
+        pending = [t for t, _ in todo.values()]
+        if len(pending) <= chunk_size or self.workers <= 1:
+            scores = _polarity_chunk(pending)
+        else:
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            scores = [p for part in self._get_pool().map(mindmate_workers.polarity_chunk, chunks) for p in part]
+        for (key, (_, indices)), p in zip(todo.items(), scores):
+            self._put(key, p)
+            for i in indices:
+                results[i] = p
+        return results
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = process_pool(self.workers)
+                atexit.register(self.close)
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._memo)}
+
+SENTIMENT = SentimentService(SENTIMENT_CACHE_SIZE, SENTIMENT_WORKERS)
+
+def journal_mood(polarity):
+    if polarity > 0.25:
+        return "happy"
+    if polarity < -0.25:
+        return "sad"
+    return "neutral"
+
+def score_journal_texts(texts):
+    """Batch (polarity, mood) for journal texts, truncated as journal_entry does."""
+    pols = SENTIMENT.score_many([(t or "")[:1000] for t in texts])
+    return [(p, journal_mood(p)) for p in pols]
+
+def rescore_journal(store=None, chunk_size=1000):
+    """Re-score every stored journal entry (e.g. after a threshold change)."""
+    return (store or get_store()).rescore_journal(score_journal_texts, chunk_size)
+
+# ---------------------------
+# Visual journal images
+# ---------------------------
+class ImageStore:
+    """
+    Content-addressed copies of uploaded images, named by SHA-256, so a
+    repeat upload costs no extra disk. JPEG thumbnails are made in a
+    process pool, off the request path, and kept under thumbs/.
+    """
+    def __init__(self, directory, thumb_size, workers):
+        self.directory = directory
+        self.thumb_size = thumb_size
+        self.workers = workers
+        self.stored = 0
+        self.deduplicated = 0
+        self.thumbnail_failures = 0
+        self._lock = threading.Lock()
+        self._pending = {}  # thumbnail path -> Future
+        self._failed = set()  # thumbnail paths whose image could not be read
+        self._pool = None
+
+    def put(self, src):
+        """Store the file at src and return the path of its stored copy."""
+        digest = hashlib.sha256()
+        with open(src, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        name = digest.hexdigest()
+        ext = os.path.splitext(src)[1].lower() or ".img"
+        dest = os.path.join(self.directory, name[:2], name + ext)
+        if os.path.exists(dest):
+            with self._lock:
+                self.deduplicated += 1
+            return dest
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                r = csv.reader(f)
-                _ = next(r, None)
-                for row in r:
-                    rows.append(row)
-        except Exception:
-            pass
-    return rows
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            self.stored += 1
+        return dest
 
-def save_rows(path, header, rows):
-    try:
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            w.writerow(header)
-            for r in rows:
-                w.writerow(r)
-    except Exception as e:
-        print("CSV save error:", e)
+    def thumbnail_path(self, path):
+        if os.path.dirname(os.path.dirname(os.path.abspath(path))) == os.path.abspath(self.directory):
+            name = os.path.splitext(os.path.basename(path))[0]
+        else:
+            # Images recorded before the store existed are keyed by their path
+            name = "path-" + hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "thumbs", name + ".jpg")
+
+    def request_thumbnail(self, path):
+        """A Future for the thumbnail of the image at path, made in the pool unless already on disk."""
+        thumb = self.thumbnail_path(path)
+        if os.path.exists(thumb):
+            done = Future()
+            done.set_result(thumb)
+            return done
+        with self._lock:
+            fut = self._pending.get(thumb)
+            if fut is None:
+                os.makedirs(os.path.dirname(thumb), exist_ok=True)
+                fut = self._get_pool().submit(mindmate_workers.make_thumbnail, path, thumb, self.thumb_size)
+                self._pending[thumb] = fut
+                fut.add_done_callback(lambda done, key=thumb, src=path: self._forget(key, src, done))
+            return fut
+
+    def gallery_image(self, path):
+        """
+        What a gallery shows for the image at path, without waiting: its
+        thumbnail once made, else the image itself with the thumbnail
+        queued; None when the image is gone or could not be read.
+        """
+        thumb = self.thumbnail_path(path)
+        if os.path.exists(thumb):
+            return thumb
+        if thumb in self._failed or not os.path.exists(path):
+            return None
+        try:
+            self.request_thumbnail(path)
+        except Exception as e:
+            print("Thumbnail error:", path, e)
+            return None
+        return path
+
+    def _forget(self, thumb, src, fut):
+        error = fut.exception()
+        with self._lock:
+            self._pending.pop(thumb, None)
+            if error is not None:
+                self._failed.add(thumb)
+                self.thumbnail_failures += 1
+        if error is not None:
+            print("Thumbnail error:", src, error)
+
+    def _get_pool(self):
+        # Called with _lock held
+        if self._pool is None:
+            self._pool = process_pool(self.workers)
+            atexit.register(self.close)
+        return self._pool
 
-journal_history = [tuple(r) for r in load_rows(JOURNAL_PATH)]
-visual_journal = [list(r) for r in load_rows(VJ_PATH)]
-streak_rows = [list(r) for r in load_rows(STREAKS_PATH)]
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {"stored": self.stored, "deduplicated": self.deduplicated, "thumbnails_pending": len(self._pending),
+                    "thumbnail_failures": self.thumbnail_failures}
+
+IMAGES = ImageStore(IMAGES_DIR, THUMB_SIZE, IMAGE_WORKERS)
 
 # ---------------------------
 # Curated content banks
@@ -267,33 +3832,112 @@ STREAK_REPLIES = [
     "Already marked today — nice consistency."
 ]
 
+ANXIETY_REPLIES = [
+    "I hear the worry in your words. Let's try a grounding step: name five things you can see.",
+    "That sense of worry is heavy — try an extended exhale now: breathe out slowly for six counts.",
+    "When anxiety spikes, focusing on the body helps. Would you like a 2-minute breathing guide?"
+]
+
+SADNESS_REPLIES = [
+    "I'm sorry you're feeling this way — a small comforting plan might help. Would you like a gentle step?",
+    "Feeling low is valid. Would you like to try a short reflective prompt or a tiny self-care idea?",
+    "This sadness matters. Consider reaching out to one trusted person — connection often eases the load."
+]
+
+ANGER_REPLIES = [
+    "Anger can be energizing and also tiring. Would a short grounding or movement help?",
+    "Notice the body where the tension shows: shoulders, jaw, chest. A movement release often helps.",
+    "Let's turn the feeling into a small practical action — what's one step that might reduce friction?"
+]
+
+# ---------------------------
+# Chatbot intents
+# ---------------------------
+# Keywords are lowercase substrings, so stems like "worri" also match "worried".
+# The highest priority intent present wins; ties go to the earlier entry.
+INTENTS = [
+    {"name": "crisis", "priority": 100, "replies": EMERGENCY_REPLIES,
+     "keywords": ["suicid", "kill myself", "end my life", "want to die", "self harm", "self-harm", "hurt myself", "no reason to live"]},
+    {"name": "anxiety", "priority": 30, "replies": ANXIETY_REPLIES,
+     "keywords": ["anx", "worri", "scared", "fear", "panic"]},
+    {"name": "sadness", "priority": 20, "replies": SADNESS_REPLIES,
+     "keywords": ["sad", "lonely", "down", "hopeless"]},
+    {"name": "anger", "priority": 10, "replies": ANGER_REPLIES,
+     "keywords": ["angry", "frustrat", "annoyed", "irritat"]},
+]
+
+def _trie_pattern(words):
+    """Regex source matching any of words, shaped as a trie so each position costs O(keyword length)."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        # Greedy optional group: the longest keyword at a position is tried first
+        return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+    return build(trie)
+
+class IntentMatcher:
+    """
+    An intent table compiled into one regex, so matching is a single pass
+    over the input however many intents and keywords there are.
+    """
+    def __init__(self, intents):
+        self.intents = list(intents)
+        owners = {}
+        for rank, intent in enumerate(self.intents):
+            for kw in intent["keywords"]:
+                owners.setdefault(kw.lower(), set()).add(rank)
+        # The scan reports only the longest keyword at each position, so fold
+        # in the intents of shorter keywords that are prefixes of it.
+        self._owners = {}
+        for kw in owners:
+            ranks = set()
+            for i in range(1, len(kw) + 1):
+                ranks |= owners.get(kw[:i], set())
+            self._owners[kw] = tuple(ranks)
+        self._regex = re.compile("(?=(" + _trie_pattern(owners) + "))") if owners else None
+
+    def match(self, text):
+        """The winning intent dict for text, or None."""
+        if self._regex is None:
+            return None
+        best = None
+        best_key = None
+        for m in self._regex.finditer((text or "").lower()):
+            for rank in self._owners[m.group(1)]:
+                key = (self.intents[rank]["priority"], -rank)
+                if best_key is None or key > best_key:
+                    best, best_key = rank, key
+        return self.intents[best] if best is not None else None
+
+INTENT_MATCHER = IntentMatcher(INTENTS)
+
 # ---------------------------
 # Utility: random picker & data fetchers
 # ---------------------------
 def pick_random(lst):
     return random.choice(lst) if lst else ""
 
-def get_latest_journal_entry():
-    if not journal_history:
+def format_latest_entry(row):
+    if row is None:
         return "No entries yet. Write your first one!"
-    ts, text, mood, _ = journal_history[-1]
+    ts, text, mood, _ = row
     return f"**Latest Entry ({ts}):**\nMood: {mood}\n{text[:120]}..."
 
+def get_latest_journal_entry():
+    return format_latest_entry(get_store().latest_journal())
+
 def get_streak_summary():
-    if not streak_rows:
+    streaks = get_store().streak_index().summary()
+    if not streaks:
         return "No streaks. Start tracking a habit!"
-    by_task = defaultdict(set)
-    for t, d in streak_rows:
-        by_task[t].add(d)
-    lines = []
-    for t, dates in by_task.items():
-        cur = 0
-        d = date.today()
-        while d.isoformat() in dates:
-            cur += 1
-            d = d - timedelta(days=1)
-        if cur > 0:
-            lines.append(f"• **{t}**: {cur} days")
+    lines = [f"• **{t}**: {cur} days" for t, cur, _ in streaks if cur > 0]
     if not lines:
         return "No active streaks today."
     return "**Active Streaks:**\n" + "\n".join(lines)
@@ -306,103 +3950,168 @@ def chatbot_response(user_input: str):
     if not ui:
         reply = "Tell me in a sentence how you're feeling or what you're facing — I'm listening."
         return reply, text_to_speech(reply, slow=True)
-    lower = ui.lower()
-    if any(w in lower for w in ["anx", "worri", "scared", "fear", "panic"]):
-        reply = pick_random([
-            "I hear the worry in your words. Let's try a grounding step: name five things you can see.",
-            "That sense of worry is heavy — try an extended exhale now: breathe out slowly for six counts.",
-            "When anxiety spikes, focusing on the body helps. Would you like a 2-minute breathing guide?"
-        ])
-    elif any(w in lower for w in ["sad", "lonely", "down", "hopeless"]):
-        reply = pick_random([
-            "I'm sorry you're feeling this way — a small comforting plan might help. Would you like a gentle step?",
-            "Feeling low is valid. Would you like to try a short reflective prompt or a tiny self-care idea?",
-            "This sadness matters. Consider reaching out to one trusted person — connection often eases the load."
-        ])
-    elif any(w in lower for w in ["angry", "frustrat", "annoyed", "irritat"]):
-        reply = pick_random([
-            "Anger can be energizing and also tiring. Would a short grounding or movement help?",
-            "Notice the body where the tension shows: shoulders, jaw, chest. A movement release often helps.",
-            "Let's turn the feeling into a small practical action — what's one step that might reduce friction?"
-        ])
-    else:
-        reply = pick_random(CHATBOT_REPLIES)
+    intent = INTENT_MATCHER.match(ui)
+    reply = pick_random(intent["replies"] if intent else CHATBOT_REPLIES)
     audio = text_to_speech(reply, slow=True)
     return reply, audio
 
+def mood_label(polarity):
+    """(mood, background color) for a Mood Analyzer polarity."""
+    if polarity > 0.25:
+        return "positive", "#e8fff6"
+    if polarity < -0.25:
+        return "sad", "#eef6ff"
+    return "neutral", "#f6efff"
+
 def analyze_mood(text: str):
     t = (text or "")[:800]
-    polarity = 0.0
-    if TextBlob is not None and t.strip():
-        try:
-            polarity = TextBlob(t).sentiment.polarity
-        except Exception:
-            polarity = 0.0
-    if polarity > 0.25:
-        mood = "positive"
-        color = "#e8fff6"
-    elif polarity < -0.25:
-        mood = "sad"
-        color = "#eef6ff"
-    else:
-        mood = "neutral"
-        color = "#f6efff"
+    polarity = SENTIMENT.score(t)
+    mood, color = mood_label(polarity)
     reply = pick_random(MOOD_REPLIES)
     audio = text_to_speech(reply, slow=True)
     return reply, color, audio, mood
 
+def tip_of_the_day(day=None):
+    """The same tip all day, for every user and process."""
+    return DAILY_TIPS[(day or date.today()).toordinal() % len(DAILY_TIPS)]
+
+def dashboard_view():
+    """(tip, streak summary, latest entry) Markdown for the Dashboard, from the user's DashboardView."""
+    user = current_user()
+    return user.dashboard.get(user.store, lambda: (
+        f"<div class='card' style='padding:14px; text-align:center;'><b>Daily Tip:</b><br>{tip_of_the_day()}</div>",
+        get_streak_summary(),
+        get_latest_journal_entry(),
+    ))
+
 def daily_tip():
     tip = pick_random(DAILY_TIPS)
     audio = text_to_speech(tip, slow=True)
     return tip, audio
 
-def journal_entry(text: str):
+def save_journal(text):
+    """Score and store one journal entry for the current user; returns its row."""
     ts = datetime.now().strftime("%Y-%m-%d %H:%M")
-    polarity = 0.0
-    if TextBlob is not None and text:
-        try:
-            polarity = TextBlob(text[:1000]).sentiment.polarity
-        except Exception:
-            polarity = 0.0
-    mood = "neutral"
-    if polarity > 0.25:
-        mood = "happy"
-    elif polarity < -0.25:
-        mood = "sad"
-    journal_history.append((ts, text or "", mood, str(float(polarity))))
-    save_rows(JOURNAL_PATH, ["timestamp","text","mood","polarity"], journal_history)
+    polarity = SENTIMENT.score((text or "")[:1000])
+    row = (ts, text or "", journal_mood(polarity), polarity)
+    get_store().add_journal(*row)
+    return row
+
+def journal_entry(text: str):
+    row = save_journal(text)
     reply = pick_random(JOURNAL_REPLIES)
     audio = text_to_speech(reply, slow=True)
-    return reply, audio, gr.Markdown(value=get_latest_journal_entry())
+    # Rendered from the new row: the write may still be queued
+    return reply, audio, gr.Markdown(value=format_latest_entry(row))
+
+def render_journal_page(rows):
+    return "\n\n".join(f"**{ts}** • Mood: {m}\n{t}" for ts, t, m, _ in rows)
+
+def journal_history(nav):
+    """
+    Render the history page at the top of nav, the list of cursors of the
+    pages browsed so far (None being the newest page).
+    """
+    user = current_user()
+    page, next_cursor = user.journal_pages.get(user.store, nav[-1], JOURNAL_PAGE_SIZE, render_journal_page)
+    if not page:
+        return "No journal entries yet. Try writing two honest sentences."
+    footer = f"Page {len(nav)}" + (" • older entries available" if next_cursor is not None else " • oldest entries")
+    return page + f"\n\n<div style='color:#94a3b8;'>{footer}</div>"
 
 def show_journal():
-    if not journal_history:
-        msg = "No journal entries yet. Try writing two honest sentences."
-        return msg, text_to_speech(msg, slow=True)
-    lines = [f"**{ts}** • Mood: {m}\n{t}" for ts, t, m, _ in journal_history[-200:]]
-    msg = "\n\n".join(lines)
+    nav = [None]
+    msg = journal_history(nav)
+    if msg.startswith("No journal entries"):
+        return msg, text_to_speech(msg, slow=True), nav
     audio = text_to_speech(pick_random(JOURNAL_REPLIES), slow=True)
-    return msg, audio
+    return msg, audio, nav
+
+def journal_older(nav):
+    nav = list(nav or [None])
+    user = current_user()
+    _, next_cursor = user.journal_pages.get(user.store, nav[-1], JOURNAL_PAGE_SIZE, render_journal_page)
+    if next_cursor is not None:
+        nav.append(next_cursor)
+    return journal_history(nav), nav
+
+def journal_newer(nav):
+    nav = list(nav or [None])[:-1] or [None]
+    return journal_history(nav), nav
+
+def search_journal(query, start, end, moods):
+    try:
+        lo, hi = date_bounds(start, end)
+    except ValueError as e:
+        raise gr.Error(f"Search failed: {e}")
+    if not any(parse_query(query)):
+        return "Type a word or a \"quoted phrase\" to search your journal."
+    results = get_store().search(query, lo, hi, moods)
+    if not results:
+        return "No matching entries."
+    return f"**{len(results)} best matches**\n\n" + render_journal_page([row for _, row in results])
+
+def import_upload(file, fmt):
+    if not file:
+        return "Choose a CSV or JSONL file to import."
+    try:
+        state = import_journal(get_store(), file, None if fmt == "auto" else fmt)
+    except (ValueError, OSError) as e:
+        raise gr.Error(f"Import failed: {e}")
+    return describe_import(state)
+
+def export_journal(start, end, moods, fmt):
+    try:
+        return export_dataset(get_store(), "journal", start, end, moods, fmt or "csv")
+    except ValueError as e:
+        raise gr.Error(f"Export failed: {e}")
+
+def growth_chart(days, counts, sums):
+    """Long-form frame for the Growth Report LinePlot: 7-day rolling mean and weekly means."""
+    import pandas as pd
+    span, rolling = MoodSeries.rolling(days, counts, sums, 7)
+    weeks, _, weekly = MoodSeries.weekly(days, counts, sums)
+    keep = ~np.isnan(rolling)
+    to_dates = lambda ordinals: (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+    return pd.DataFrame({
+        "date": np.concatenate((to_dates(span[keep]), to_dates(weeks))),
+        "polarity": np.round(np.concatenate((rolling[keep], weekly)), 3),
+        "series": ["7-day average"] * int(keep.sum()) + ["weekly mean"] * len(weeks),
+    })
+
+def describe_trend(slope):
+    if slope is None:
+        return "not enough days yet ➡️"
+    label = "rising 📈" if slope > TREND_THRESHOLD else ("dipping 📉" if slope < -TREND_THRESHOLD else "steady ➡️")
+    return f"{label} ({slope:+.2f} per week over the last {TREND_DAYS} days)"
 
-def export_journal():
-    if not os.path.exists(JOURNAL_PATH):
-        save_rows(JOURNAL_PATH, ["timestamp","text","mood","polarity"], [])
-    return JOURNAL_PATH
+def growth_stats():
+    """The numbers behind the Growth Report for the current user; None before the first entry."""
+    store = get_store()
+    avg, count, top_words = store.growth_summary(6)
+    if not count:
+        return None
+    days, counts, sums = store.mood_series().snapshot()
+    return {
+        "entries": count,
+        "average": avg,
+        "themes": top_words,
+        "trend_per_week": MoodSeries.trend(days, counts, sums),
+        "last_7_days": MoodSeries.window_mean(days, counts, sums, 7),
+        "last_30_days": MoodSeries.window_mean(days, counts, sums, 30),
+        "series": (days, counts, sums),
+    }
 
 def growth_report():
-    if not journal_history:
+    stats = growth_stats()
+    if stats is None:
         msg = "No data yet — add a few journal entries to generate a Growth Report."
-        return msg, text_to_speech(msg, slow=True)
-    pols = [float(p) for _, _, _, p in journal_history]
-    avg = sum(pols) / len(pols)
-    trend = "rising 📈" if avg > 0.15 else ("dipping 📉" if avg < -0.15 else "steady ➡️")
-    words = []
-    STOPWORDS = set("a an the and or but if while to from of in on for with at by is it this that these those am are was were be been being i me my we our you your he she they them their as".split())
-    for _, text, _, _ in journal_history:
-        for w in re.findall(r"[A-Za-z']+", (text or "").lower()):
-            if w not in STOPWORDS and len(w) > 2:
-                words.append(w)
-    common = ", ".join([w for w,_ in Counter(words).most_common(6)]) if words else "—"
+        return msg, text_to_speech(msg, slow=True), None
+    avg = stats["average"]
+    trend = describe_trend(stats["trend_per_week"])
+    (week_avg, week_n), (month_avg, month_n) = stats["last_7_days"], stats["last_30_days"]
+    recent = lambda a, n: f"{a:+.2f} over {n} entries" if n else "—"
+    common = ", ".join(stats["themes"]) if stats["themes"] else "—"
     if avg < -0.15:
         goals = ["Text one supportive person", "Take a 5 min breathing break", "Write one compassionate sentence"]
     elif avg > 0.15:
@@ -412,6 +4121,7 @@ def growth_report():
     msg = (
         "### Daily Growth Report ✨\n"
         f"**Mood trend:** {trend}\n"
+        f"**Last 7 days:** {recent(week_avg, week_n)} • **Last 30 days:** {recent(month_avg, month_n)}\n"
         f"**Common themes:** {common}\n"
         f"**3 Focus Goals:**\n"
         f"1. {goals[0]}\n"
@@ -419,7 +4129,7 @@ def growth_report():
         f"3. {goals[2]}"
     )
     audio = text_to_speech(pick_random(GROWTH_REPLIES), slow=True)
-    return msg, audio
+    return msg, audio, growth_chart(*stats["series"])
 
 def breathing_exercise():
     r = pick_random(BREATHING_REPLIES)
@@ -432,10 +4142,17 @@ def affirmation():
     return a, audio
 
 def emergency_help():
+    # Never waits on TTS: speech comes from the cache (warmed at launch) or not at all
     r = pick_random(EMERGENCY_REPLIES)
-    audio = text_to_speech(r, slow=True)
+    audio = text_to_speech(r, slow=True, background=True)
     return r, audio
 
+def warm_emergency_speech():
+    """Queue speech for every emergency reply so emergency_help finds it cached."""
+    with as_user(DEFAULT_USER):
+        for reply in EMERGENCY_REPLIES:
+            text_to_speech(reply, slow=True, background=True)
+
 def cognitive_reframe(automatic_thought):
     thought = (automatic_thought or "").strip()
     if not thought:
@@ -458,62 +4175,61 @@ def vjournal_add(image, caption):
     img_path = ""
     if image:
         img_path = image if isinstance(image, str) else getattr(image, "name", "")
-    visual_journal.append([ts, img_path, caption or ""])
-    save_rows(VJ_PATH, ["timestamp","image_path","caption"], visual_journal)
+    if img_path:
+        # Gradio's upload is temporary: keep our own copy, thumbnailed in the background
+        try:
+            img_path = IMAGES.put(img_path)
+            IMAGES.request_thumbnail(img_path)
+        except Exception as e:
+            print("Image store error:", e)
+    get_store().add_visual(ts, img_path, caption or "")
     reply = pick_random(VJ_REPLIES)
     audio = text_to_speech(reply, slow=True)
     return f"**{reply}** ({ts})", audio
 
 def vjournal_show():
-    if not visual_journal:
+    recent = get_store().recent_visual(200)
+    if not recent:
         return "No visual entries yet.", text_to_speech("No visual entries yet.", slow=True)
-    lines = [f"**{ts}** • {os.path.basename(img) if img else '[no image]'} — {cap[:120]}" for ts, img, cap in visual_journal[-200:]]
+    lines = [f"**{ts}** • {'🖼️' if img else '[no image]'} — {cap[:120]}" for ts, img, cap in recent]
     return "\n".join(lines), text_to_speech("Showing recent visual entries.", slow=True)
 
-def vjournal_export():
-    if not os.path.exists(VJ_PATH):
-        save_rows(VJ_PATH, ["timestamp","image_path","caption"], [])
-    return VJ_PATH
+def vjournal_gallery():
+    """
+    Thumbnails of the latest visual entries, newest first; full-size images
+    are never decoded here. Missing thumbnails are queued, not waited for:
+    the original is shown until the next refresh finds its thumbnail.
+    """
+    items = []
+    for _, img, cap in reversed(get_store().recent_visual(GALLERY_LIMIT)):
+        # None: image gone (e.g. an old temporary upload) or unreadable
+        shown = IMAGES.gallery_image(img) if img else None
+        if shown is not None:
+            items.append((shown, cap[:120]))
+    return items
+
+def vjournal_export(start, end, fmt):
+    try:
+        return export_dataset(get_store(), "visual_journal", start, end, None, fmt or "csv")
+    except ValueError as e:
+        raise gr.Error(f"Export failed: {e}")
 
 def streak_mark(task_name):
     task = (task_name or "").strip()
     if not task:
         return "Enter a task name to mark a streak.", text_to_speech("Enter a task name to mark a streak.", slow=True), gr.Markdown(value=get_streak_summary())
     today_iso = date.today().isoformat()
-    for row in streak_rows:
-        if row[0] == task and row[1] == today_iso:
-            return f"Already marked today for '{task}'.", text_to_speech(pick_random(STREAK_REPLIES), slow=True), gr.Markdown(value=get_streak_summary())
-    streak_rows.append([task, today_iso])
-    save_rows(STREAKS_PATH, ["task","date"], streak_rows)
+    if not get_store().mark_streak(task, today_iso):
+        return f"Already marked today for '{task}'.", text_to_speech(pick_random(STREAK_REPLIES), slow=True), gr.Markdown(value=get_streak_summary())
     return f"Marked '{task}' for today ({today_iso}).", text_to_speech(pick_random(STREAK_REPLIES), slow=True), gr.Markdown(value=get_streak_summary())
 
 def streaks_status():
-    if not streak_rows:
+    streaks = get_store().streak_index().summary()
+    if not streaks:
         return "No streaks yet. Create one by entering a task name and marking today.", text_to_speech("No streaks yet.", slow=True)
-    by_task = defaultdict(set)
-    for t, d in streak_rows:
-        by_task[t].add(d)
     lines = []
     momentum_scores = []
-    for t, dates in by_task.items():
-        cur = 0
-        d = date.today()
-        while d.isoformat() in dates:
-            cur += 1
-            d = d - timedelta(days=1)
-        longest = 0
-        sorted_dates = sorted(dates)
-        if sorted_dates:
-            consec = 1
-            for i in range(1, len(sorted_dates)):
-                prev = datetime.fromisoformat(sorted_dates[i-1]).date()
-                curr = datetime.fromisoformat(sorted_dates[i]).date()
-                if (curr - prev).days == 1:
-                    consec += 1
-                else:
-                    longest = max(longest, consec)
-                    consec = 1
-            longest = max(longest, consec)
+    for t, cur, longest in streaks:
         lines.append(f"• **{t}** — current: {cur} days, longest: {longest} days")
         momentum_scores.append(min(cur, longest))
     if momentum_scores:
@@ -525,10 +4241,149 @@ def streaks_status():
     audio = text_to_speech(f"Streaks status. Momentum {momentum_pct} percent.", slow=True)
     return msg, audio
 
-def streaks_export():
-    if not os.path.exists(STREAKS_PATH):
-        save_rows(STREAKS_PATH, ["task","date"], [])
-    return STREAKS_PATH
+def streaks_export(start, end, fmt):
+    try:
+        return export_dataset(get_store(), "streaks", start, end, None, fmt or "csv")
+    except ValueError as e:
+        raise gr.Error(f"Export failed: {e}")
+
+# ---------------------------
+# JSON API: the same core functions under /v1, TTS off unless asked for
+# ---------------------------
+API_BATCH_MAX = int(os.environ.get("MINDMATE_API_BATCH_MAX", "1000"))
+API_PAGE_MAX = 100
+# Without MINDMATE_AUTH, routes that touch a journal, streaks or growth data are refused (403):
+# anyone could otherwise read the default shard. Set to 1 for a trusted, single-user deployment.
+API_OPEN = os.environ.get("MINDMATE_API_OPEN", "0") == "1"
+
+def api_user_id(request, personal=False):
+    """
+    User id for an API request: with MINDMATE_AUTH set, the HTTP Basic
+    user (401 otherwise), mapped like a UI login; else DEFAULT_USER, which
+    personal routes only get with MINDMATE_API_OPEN=1 (403 otherwise).
+    """
+    from fastapi import HTTPException
+    if not AUTH_USERS:
+        if personal and not API_OPEN:
+            raise HTTPException(403, "Set MINDMATE_AUTH to use this route (or MINDMATE_API_OPEN=1 on a trusted host)")
+        return DEFAULT_USER
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    try:
+        name, _, password = base64.b64decode(token).decode("utf-8").partition(":")
+    except Exception:
+        name = password = ""
+    expected = AUTH_USERS.get(name)
+    if scheme.lower() != "basic" or expected is None or not hmac.compare_digest(expected.encode("utf-8"), password.encode("utf-8")):
+        raise HTTPException(401, "Authentication required", headers={"WWW-Authenticate": 'Basic realm="MindMate"'})
+    return DEFAULT_USER if USER_SCOPE == "shared" else f"user:{name}"
+
+def api_audio(audio):
+    """text_to_speech output as {"mime", "base64"}, or None."""
+    if audio is None:
+        return None
+    if isinstance(audio, str):
+        with open(audio, "rb") as f:
+            audio = f.read()
+    mime = "audio/wav" if audio[:4] == b"RIFF" else "audio/mpeg"
+    return {"mime": mime, "base64": base64.b64encode(audio).decode("ascii")}
+
+def api_row(row):
+    ts, text, mood, polarity = row
+    return {"timestamp": ts, "text": text, "mood": mood, "polarity": float(polarity)}
+
+def mount_api(app):
+    """Add the /v1 JSON routes to the FastAPI app Gradio serves from."""
+    from fastapi import APIRouter, HTTPException, Query, Request
+    from pydantic import BaseModel, Field
+
+    class TextIn(BaseModel):
+        text: str
+        tts: bool = False
+
+    class TextsIn(BaseModel):
+        texts: list[str] = Field(max_length=API_BATCH_MAX)
+
+    class TaskIn(BaseModel):
+        task: str
+
+    def call(request, name, fn, tts=False, personal=True):
+        started = time.perf_counter()
+        try:
+            with as_user(api_user_id(request, personal)), tts_muted(not tts):
+                return fn()
+        except HTTPException:
+            raise
+        except Exception:
+            METRICS.inc("mindmate_handler_errors_total", handler=name)
+            raise
+        finally:
+            METRICS.observe("mindmate_handler_seconds", time.perf_counter() - started, handler=name)
+
+    router = APIRouter(prefix="/v1")
+
+    @router.post("/mood")
+    def mood(body: TextIn, request: Request):
+        def run():
+            reply, color, audio, label = analyze_mood(body.text)
+            polarity = SENTIMENT.score(body.text[:800])
+            return {"mood": label, "polarity": polarity, "color": color, "reply": reply, "audio": api_audio(audio)}
+        return call(request, "api_mood", run, body.tts, personal=False)
+
+    @router.post("/mood/batch")
+    def mood_batch(body: TextsIn, request: Request):
+        def run():
+            scores = SENTIMENT.score_many([t[:800] for t in body.texts])
+            return {"results": [{"mood": mood_label(p)[0], "polarity": p} for p in scores]}
+        return call(request, "api_mood_batch", run, personal=False)
+
+    @router.post("/journal")
+    def journal_add(body: TextIn, request: Request):
+        def run():
+            if not body.text.strip():
+                raise HTTPException(400, "text is empty")
+            row = save_journal(body.text)
+            reply = pick_random(JOURNAL_REPLIES)
+            return {"entry": api_row(row), "reply": reply, "audio": api_audio(text_to_speech(reply, slow=True))}
+        return call(request, "api_journal_add", run, body.tts)
+
+    @router.get("/journal")
+    def journal_list(request: Request, before: int | None = None, limit: int = Query(JOURNAL_PAGE_SIZE, ge=1, le=API_PAGE_MAX)):
+        def run():
+            rows, next_cursor = get_store().journal_page(before, limit)
+            return {"entries": [api_row(r) for r in rows], "next": next_cursor}
+        return call(request, "api_journal_list", run)
+
+    @router.get("/streaks")
+    def streaks(request: Request):
+        def run():
+            summary = get_store().streak_index().summary()
+            return {"streaks": [{"task": t, "current": cur, "longest": longest} for t, cur, longest in summary]}
+        return call(request, "api_streaks", run)
+
+    @router.post("/streaks")
+    def streak_add(body: TaskIn, request: Request):
+        def run():
+            task = body.task.strip()
+            if not task:
+                raise HTTPException(400, "task is empty")
+            today_iso = date.today().isoformat()
+            return {"task": task, "date": today_iso, "marked": get_store().mark_streak(task, today_iso)}
+        return call(request, "api_streak_mark", run)
+
+    @router.get("/growth")
+    def growth(request: Request):
+        def run():
+            stats = growth_stats()
+            if stats is None:
+                return {"entries": 0}
+            stats.pop("series")
+            (week_avg, week_n), (month_avg, month_n) = stats.pop("last_7_days"), stats.pop("last_30_days")
+            stats["last_7_days"] = {"average": week_avg, "entries": week_n}
+            stats["last_30_days"] = {"average": month_avg, "entries": month_n}
+            return stats
+        return call(request, "api_growth", run)
+
+    app.include_router(router)
 
 # ---------------------------
 # UI CSS: fixed dark theme with animations
@@ -677,7 +4532,9 @@ body {
 # ---------------------------
 # Build Gradio UI
 # ---------------------------
-with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wellness") as demo:
+_build_started = time.perf_counter()
+# Gradio copies every returned file or audio buffer into its own cache; drop copies older than a day, hourly
+with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wellness", delete_cache=(3600, 86400)) as demo:
     with gr.Column(elem_classes="app-inner"):
         # Header
         header_html = gr.HTML(value=(
@@ -693,13 +4550,13 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
             status_box = gr.Textbox(value="Ready", label="Status", interactive=False, container=False)
             
             def apply_settings(speak_emojis_val):
-                SETTINGS["speak_emojis"] = bool(speak_emojis_val)
+                current_user().settings["speak_emojis"] = bool(speak_emojis_val)
                 status = "Settings applied."
                 audio = text_to_speech(status, slow=True)
                 return status, audio
             
             gr.Button("Apply Settings", elem_classes="big-btn").click(
-                fn=apply_settings, inputs=[speak_emojis_cb], outputs=[status_box, gr.Audio()]
+                fn=ui_handler(apply_settings), inputs=[speak_emojis_cb], outputs=[status_box, gr.Audio()]
             )
         
         # Tabs
@@ -708,16 +4565,14 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
                 with gr.Row(elem_classes="dashboard-grid"):
                     with gr.Column(scale=2):
                         gr.Markdown("### Welcome to your MindMate Dashboard! ✨")
-                        gr.Markdown(
-                            f"<div class='card' style='padding:14px; text-align:center;'><b>Daily Tip:</b><br>{daily_tip()[0]}</div>"
-                        )
+                        home_tip_out = gr.Markdown()
                         home_mood_in = gr.Textbox(label="How are you feeling right now?", placeholder="e.g., A bit stressed about work.")
                         home_mood_btn = gr.Button("Analyze Mood & Get Support")
                         home_mood_out = gr.Textbox(label="MindMate's Insight", lines=2)
                     with gr.Column(scale=1):
                         gr.Markdown("<div class='card'>**Your Progress at a Glance**</div>")
-                        home_streak_out = gr.Markdown(get_streak_summary())
-                        home_journal_out = gr.Markdown(get_latest_journal_entry())
+                        home_streak_out = gr.Markdown()
+                        home_journal_out = gr.Markdown()
             
             with gr.TabItem("💬 Chatbot"):
                 with gr.Row():
@@ -766,10 +4621,36 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
                     with gr.Column(scale=1):
                         hist_btn = gr.Button("Show Recent Journal Entries 📖")
                         hist_out = gr.Markdown(value="<div style='color:#94a3b8;'>Start writing to see your history here.</div>", label="Journal History")
+                        with gr.Row():
+                            hist_newer_btn = gr.Button("◀ Newer")
+                            hist_older_btn = gr.Button("Older ▶")
+                        hist_nav = gr.State([None])
                         j_audio = gr.Audio(label="Voice Reply", autoplay=False)
                 with gr.Row():
-                    j_export_btn = gr.Button("Export Journal (.csv)")
-                    j_export_file = gr.File(label="Download Journal (.csv)", interactive=False)
+                    j_export_start = gr.Textbox(label="From (YYYY-MM-DD)", placeholder="first entry")
+                    j_export_end = gr.Textbox(label="To (YYYY-MM-DD)", placeholder="latest entry")
+                    j_export_moods = gr.CheckboxGroup(["happy", "neutral", "sad"], label="Moods (none = all)")
+                    j_export_fmt = gr.Dropdown(EXPORT_FORMATS, value="csv", label="Format")
+                with gr.Row():
+                    j_export_btn = gr.Button("Export Journal")
+                    j_export_file = gr.File(label="Download Journal", interactive=False)
+                with gr.Row():
+                    j_import_file = gr.File(label="Import history (CSV or JSONL with a text column and optional timestamp)",
+                                            file_types=[".csv", ".jsonl", ".ndjson", ".gz"], type="filepath")
+                    with gr.Column():
+                        j_import_fmt = gr.Dropdown(["auto"] + IMPORT_FORMATS, value="auto", label="Import format")
+                        j_import_btn = gr.Button("Import Entries 📥")
+                        j_import_out = gr.Markdown()
+
+            with gr.TabItem("🔎 Search"):
+                with gr.Row():
+                    s_query = gr.Textbox(label="Search your journal", placeholder='e.g. sleep "felt calm"', scale=3)
+                    s_btn = gr.Button("Search 🔎", elem_classes="big-btn", scale=1)
+                with gr.Row():
+                    s_start = gr.Textbox(label="From (YYYY-MM-DD)", placeholder="first entry")
+                    s_end = gr.Textbox(label="To (YYYY-MM-DD)", placeholder="latest entry")
+                    s_moods = gr.CheckboxGroup(["happy", "neutral", "sad"], label="Moods (none = all)")
+                s_out = gr.Markdown(value="<div style='color:#94a3b8;'>Matching entries will appear here, best first.</div>")
 
             with gr.TabItem("📈 Growth Report"):
                 with gr.Row():
@@ -777,6 +4658,9 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
                     gr_audio = gr.Audio(label="Voice Reply", autoplay=False)
                 with gr.Row():
                     gr_out = gr.Markdown(label="Growth Report", value="<div style='color:#94a3b8;'>Your personal insights will appear here after you save a few journal entries.</div>")
+                with gr.Row():
+                    gr_chart = gr.LinePlot(x="date", y="polarity", color="series", title="Mood over time",
+                                           y_title="Polarity", y_lim=[-1, 1], height=280)
 
             with gr.TabItem("🌞 Daily Tip"):
                 with gr.Row():
@@ -821,8 +4705,14 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
                     with gr.Column(scale=1):
                         v_show = gr.Button("Show Visual Journal 📸")
                         v_list = gr.Textbox(label="Recent Visual Entries", lines=8, interactive=False)
-                        v_export = gr.Button("Export Visual Journal (.csv)")
-                        v_export_file = gr.File(label="Download Visual Journal (.csv)", interactive=False)
+                        v_gallery_btn = gr.Button("Show Gallery 🖼️")
+                        v_gallery = gr.Gallery(label="Gallery", columns=4, height="auto", preview=False)
+                        with gr.Row():
+                            v_export_start = gr.Textbox(label="From (YYYY-MM-DD)", placeholder="first entry")
+                            v_export_end = gr.Textbox(label="To (YYYY-MM-DD)", placeholder="latest entry")
+                            v_export_fmt = gr.Dropdown(EXPORT_FORMATS, value="csv", label="Format")
+                        v_export = gr.Button("Export Visual Journal")
+                        v_export_file = gr.File(label="Download Visual Journal", interactive=False)
 
             with gr.TabItem("📈 Streaks & Momentum"):
                 with gr.Row():
@@ -830,8 +4720,12 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
                         streak_task = gr.Textbox(label="Streak Task (e.g., Meditate)", lines=1, placeholder="Your habit name here...")
                         streak_mark_btn = gr.Button("Mark Today ✅", elem_classes="big-btn")
                         streak_status = gr.Textbox(label="Status", lines=3, interactive=False)
-                        streak_export_btn = gr.Button("Export Streaks (.csv)")
-                        streak_export_file = gr.File(label="Download Streaks (.csv)", interactive=False)
+                        with gr.Row():
+                            streak_export_start = gr.Textbox(label="From (YYYY-MM-DD)", placeholder="first mark")
+                            streak_export_end = gr.Textbox(label="To (YYYY-MM-DD)", placeholder="latest mark")
+                            streak_export_fmt = gr.Dropdown(EXPORT_FORMATS, value="csv", label="Format")
+                        streak_export_btn = gr.Button("Export Streaks")
+                        streak_export_file = gr.File(label="Download Streaks", interactive=False)
                     with gr.Column(scale=1):
                         streaks_view = gr.Markdown(label="All streaks & momentum", value="<div style='color:#94a3b8;'>Mark a task above to see your momentum grow.</div>")
                         streak_view_btn = gr.Button("View Streaks & Momentum 🔥")
@@ -843,9 +4737,9 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
     # ---------------------------
     # Wiring: event handlers
     # ---------------------------
-    home_mood_btn.click(analyze_mood, inputs=[home_mood_in], outputs=[home_mood_out, gr.Textbox(visible=False), gr.Audio(visible=False), gr.Textbox(visible=False)])
-    j_save.click(journal_entry, inputs=[j_in], outputs=[j_out, j_audio, home_journal_out])
-    streak_mark_btn.click(streak_mark, inputs=[streak_task], outputs=[streak_status, streak_audio, home_streak_out])
+    home_mood_btn.click(ui_handler(analyze_mood), inputs=[home_mood_in], outputs=[home_mood_out, gr.Textbox(visible=False), gr.Audio(visible=False), gr.Textbox(visible=False)], **lane("cpu"))
+    j_save.click(ui_handler(journal_entry), inputs=[j_in], outputs=[j_out, j_audio, home_journal_out], **lane("cpu"))
+    streak_mark_btn.click(ui_handler(streak_mark), inputs=[streak_task], outputs=[streak_status, streak_audio, home_streak_out], **lane("io"))
 
     def _chat_run(inp):
         try:
@@ -853,12 +4747,13 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
             return out, audio
         except Exception:
             traceback.print_exc()
+            METRICS.inc("mindmate_handler_errors_total", handler="chatbot_response")
             fallback = "An error occurred. I'm sorry."
             return fallback, text_to_speech(fallback, slow=True)
-    chat_btn.click(_chat_run, inputs=[chatbot_input], outputs=[chat_out, chat_audio])
-    btn_breath.click(lambda: breathing_exercise(), None, [chat_out, chat_audio])
-    cog_btn.click(lambda: (pick_random(COGNITIVE_REFRAMES), text_to_speech(pick_random(COGNITIVE_REFRAMES), slow=True)), None, [chat_out, chat_audio])
-    plan_btn.click(lambda: micro_plan(None), None, [chat_out, chat_audio])
+    chat_btn.click(ui_handler(_chat_run, "chatbot_response"), inputs=[chatbot_input], outputs=[chat_out, chat_audio], api_name="chatbot_response", **lane("tts"))
+    btn_breath.click(ui_handler(lambda: breathing_exercise(), "breathing_exercise"), None, [chat_out, chat_audio], **lane("tts"))
+    cog_btn.click(ui_handler(lambda: (pick_random(COGNITIVE_REFRAMES), text_to_speech(pick_random(COGNITIVE_REFRAMES), slow=True)), "cognitive_reframe"), None, [chat_out, chat_audio], **lane("tts"))
+    plan_btn.click(ui_handler(lambda: micro_plan(None), "micro_plan"), None, [chat_out, chat_audio], **lane("tts"))
 
     def _mood_run(txt):
         try:
@@ -866,22 +4761,34 @@ with gr.Blocks(css=GLOBAL_CSS, title="MindMate AI — A Super App for Mental Wel
             return out, audio, f"Color: {color} • Mood: {mood}"
         except Exception:
             traceback.print_exc()
+            METRICS.inc("mindmate_handler_errors_total", handler="analyze_mood")
             return "Error analyzing mood.", None, ""
-    mood_btn.click(_mood_run, inputs=[mood_in], outputs=[mood_out, mood_audio, mood_color])
-
-    tip_btn.click(lambda: daily_tip(), None, [tip_out, tip_audio])
-    hist_btn.click(show_journal, None, [hist_out, j_audio])
-    j_export_btn.click(lambda: export_journal(), None, j_export_file)
-    gr_btn.click(lambda: growth_report(), None, [gr_out, gr_audio])
-    aff_btn.click(lambda: affirmation(), None, [aff_out, aff_audio])
-    help_btn.click(lambda: emergency_help(), None, [help_out, help_audio])
-    cog_btn_reframe.click(cognitive_reframe, inputs=[cog_in], outputs=[cog_out, cog_audio])
-    plan_btn_create.click(micro_plan, inputs=[plan_in], outputs=[plan_out, plan_audio])
-    v_add.click(vjournal_add, inputs=[v_img, v_caption], outputs=[v_res, v_audio])
-    v_show.click(vjournal_show, None, [v_list, v_audio])
-    v_export.click(lambda: vjournal_export(), None, v_export_file)
-    streak_view_btn.click(streaks_status, None, [streaks_view, streak_audio])
-    streak_export_btn.click(lambda: streaks_export(), None, streak_export_file)
+    mood_btn.click(ui_handler(_mood_run, "analyze_mood"), inputs=[mood_in], outputs=[mood_out, mood_audio, mood_color], api_name="analyze_mood", **lane("cpu"))
+
+    tip_btn.click(ui_handler(lambda: daily_tip(), "daily_tip"), None, [tip_out, tip_audio], **lane("tts"))
+    hist_btn.click(ui_handler(show_journal), None, [hist_out, j_audio, hist_nav], **lane("tts"))
+    hist_older_btn.click(ui_handler(journal_older), hist_nav, [hist_out, hist_nav], **lane("io"))
+    hist_newer_btn.click(ui_handler(journal_newer), hist_nav, [hist_out, hist_nav], **lane("io"))
+    j_export_btn.click(ui_handler(export_journal), [j_export_start, j_export_end, j_export_moods, j_export_fmt], j_export_file, **lane("io"))
+    j_import_btn.click(ui_handler(import_upload), [j_import_file, j_import_fmt], j_import_out, **lane("cpu"))
+    s_btn.click(ui_handler(search_journal), [s_query, s_start, s_end, s_moods], s_out, **lane("cpu"))
+    s_query.submit(ui_handler(search_journal), [s_query, s_start, s_end, s_moods], s_out, **lane("cpu"))
+    gr_btn.click(ui_handler(lambda: growth_report(), "growth_report"), None, [gr_out, gr_audio, gr_chart], **lane("cpu"))
+    aff_btn.click(ui_handler(lambda: affirmation(), "affirmation"), None, [aff_out, aff_audio], **lane("tts"))
+    # Its own unbounded lane, off Gradio's worker threads: never queued behind TTS
+    help_btn.click(fast_lane(emergency_help), None, [help_out, help_audio],
+                   api_name="emergency_help", concurrency_id="emergency", concurrency_limit=None)
+    cog_btn_reframe.click(ui_handler(cognitive_reframe), inputs=[cog_in], outputs=[cog_out, cog_audio], api_name="cognitive_reframe", **lane("tts"))
+    plan_btn_create.click(ui_handler(micro_plan), inputs=[plan_in], outputs=[plan_out, plan_audio], **lane("tts"))
+    v_add.click(ui_handler(vjournal_add), inputs=[v_img, v_caption], outputs=[v_res, v_audio], **lane("tts"))
+    v_show.click(ui_handler(vjournal_show), None, [v_list, v_audio], **lane("tts"))
+    v_gallery_btn.click(ui_handler(vjournal_gallery), None, v_gallery, **lane("io"))
+    v_export.click(ui_handler(vjournal_export), [v_export_start, v_export_end, v_export_fmt], v_export_file, **lane("io"))
+    streak_view_btn.click(ui_handler(streaks_status), None, [streaks_view, streak_audio], **lane("tts"))
+    streak_export_btn.click(ui_handler(streaks_export), [streak_export_start, streak_export_end, streak_export_fmt], streak_export_file, **lane("io"))
+    # Storage is opened by the first page load, not while building the layout
+    demo.load(ui_handler(dashboard_view), None, [home_tip_out, home_streak_out, home_journal_out], **lane("io"))
+STARTUP_TIMINGS.append(("build UI", time.perf_counter() - _build_started))
 
 # ---------------------------
 # Launch logic (choose free port)
@@ -902,6 +4809,82 @@ def find_free_port(preferred=7860):
         return port
 
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 7860))  # Get port from environment variable
-    print(f"Launching MindMate AI on http://0.0.0.0:{port}")
-    demo.launch(server_name="0.0.0.0", server_port=port, share=False)
+    import argparse
+    parser = argparse.ArgumentParser(description="MindMate AI")
+    parser.add_argument("--startup-timing", action="store_true", help="print per-import and per-phase startup timings")
+    parser.add_argument("--user", default=DEFAULT_USER, help="user id whose shard a command works on, e.g. user:alice")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("migrate", help="migrate CSV data and build indexes for every shard ahead of serving")
+    commands.add_parser("rebuild-growth", help="recompute the Growth Report aggregate from the whole journal")
+    commands.add_parser("rebuild-search", help="rebuild the journal search index")
+    rescore_cmd = commands.add_parser("rescore", help="re-score journal polarity and mood in parallel")
+    rescore_cmd.add_argument("--workers", type=int, default=SENTIMENT_WORKERS)
+    rescore_cmd.add_argument("--chunk-size", type=int, default=1000)
+    export_cmd = commands.add_parser("export", help="export one dataset, optionally filtered, to a file")
+    export_cmd.add_argument("kind", choices=sorted(EXPORT_HEADERS))
+    export_cmd.add_argument("output", help="destination file")
+    export_cmd.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export_cmd.add_argument("--start", help="first date, YYYY-MM-DD")
+    export_cmd.add_argument("--end", help="last date, YYYY-MM-DD")
+    export_cmd.add_argument("--mood", action="append", help="journal mood to keep (repeatable)")
+    import_cmd = commands.add_parser("import", help="import journal history from CSV or JSONL (resumable)")
+    import_cmd.add_argument("input", help="source file, optionally .gz")
+    import_cmd.add_argument("--format", choices=IMPORT_FORMATS, help="default: from the file extension")
+    import_cmd.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK)
+    args = parser.parse_args()
+    if not lock_data_dir():
+        what = f"'{args.command}'" if args.command else "the server"
+        print(f"Cannot run {what}: another MindMate process (server or command) is using {DATA_DIR}. Stop it first.")
+        sys.exit(1)
+    if args.command == "migrate":
+        n = migrate_shards(progress=lambda d, rows, s: print(f"  {os.path.relpath(d, DATA_DIR)}: {rows} journal entries, {s:.1f}s"))
+        print(f"Migrated {n} shards.")
+    elif args.command == "rebuild-growth":
+        with as_user(args.user):
+            n = get_store().rebuild_growth()
+        print(f"Rebuilt growth aggregate from {n} journal entries.")
+    elif args.command == "rebuild-search":
+        with as_user(args.user):
+            n = get_store().rebuild_search()
+        print(f"Rebuilt search index from {n} journal entries.")
+    elif args.command == "rescore":
+        SENTIMENT.workers = args.workers
+        started = time.perf_counter()
+        with as_user(args.user):
+            n = rescore_journal(chunk_size=args.chunk_size)
+        print(f"Re-scored {n} journal entries in {time.perf_counter() - started:.1f}s.")
+    elif args.command == "export":
+        start, end = date_bounds(args.start, args.end)
+        with as_user(args.user):
+            rows = export_rows(get_store(), args.kind, start, end, args.mood)
+            n = write_export(rows, EXPORT_HEADERS[args.kind], args.output, args.format)
+        print(f"Exported {n} rows to {args.output}.")
+    elif args.command == "import":
+        with as_user(args.user):
+            state = import_journal(get_store(), args.input, args.format, args.chunk_size,
+                                   progress=lambda s: print(f"  {s['imported']} imported, {s['skipped']} skipped"))
+        print(describe_import(state))
+    else:
+        port = int(os.environ.get("PORT", 7860))  # Get port from environment variable
+        # Logging in gives each user a persistent shard; without it each browser gets one (VisitorCookies)
+        auth = list(AUTH_USERS.items()) or None
+        if auth is None and USER_SCOPE == "user":
+            print("No MINDMATE_AUTH: each browser keeps its own journal, tied to a cookie.")
+        from starlette.middleware import Middleware
+        middleware = [Middleware(VisitorCookies)] if USER_SCOPE == "user" else []
+        # Open the default shard now: a first start migrates its CSV data, which
+        # must not land on the first request (`python app.py migrate` does it ahead)
+        with startup_phase("open default shard"), as_user(DEFAULT_USER) as user:
+            print(f"Opening storage ({STORAGE_BACKEND}) ...")
+            print(f"{user.store.journal_count()} journal entries ready.")
+        print(f"Launching MindMate AI on http://0.0.0.0:{port}")
+        with startup_phase("launch (server bound)"):
+            # Queue slots and worker threads for every lane at full, with room left for emergency help
+            demo.launch(server_name="0.0.0.0", server_port=port, share=False, auth=auth, prevent_thread_lock=True,
+                        max_threads=sum(LANES.values()) + 8, app_kwargs={"middleware": middleware})
+        mount_metrics(demo.app)
+        mount_api(demo.app)
+        threading.Thread(target=warm_emergency_speech, name="warm-emergency", daemon=True).start()
+        if args.startup_timing:
+            print(startup_report())
+        demo.block_thread()
@@ -0,0 +1,214 @@
+"""
+Benchmark the storage path and the handlers that sit on it, at 1k to 1M
+rows of synthetic journal, visual journal and streak history. Speech uses
+the deterministic "fake" TTS engine in-process and TextBlob is replaced by
+a cheap stub, so the numbers measure MindMate itself rather than the
+network or NLP.
+
+    python benchmarks/bench_data_path.py --output results.json
+    python benchmarks/bench_data_path.py --sizes 1000 10000 --compare results.json
+
+Each backend runs in its own process (MINDMATE_STORAGE is read at import).
+Results are JSON: one record per (backend, rows, op) with min / median /
+mean milliseconds, plus enough metadata to compare runs across versions.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+CALLS = 200  # journal_entry / streak_mark calls per size
+# Words many entries share (three draws per entry, each adding the word with this chance), so search meets long postings
+COMMON_WORDS = [("today", 0.8), ("felt", 0.5), ("calm", 0.3), ("work", 0.3), ("tired", 0.2)]
+SEARCHES = [("search_common", "today"), ("search_two_common", "felt calm"),
+            ("search_phrase", '"felt calm"'), ("search_common_rare", "today {rare}"),
+            ("search_many_common", "today felt calm work tired")]
+
+class StubTextBlob:
+    def __init__(self, text):
+        self.sentiment = SimpleNamespace(polarity=(zlib.crc32(text.encode("utf-8")) % 2001 - 1000) / 1000.0)
+
+def write_dataset(directory, rows, seed=0):
+    """Synthetic journal.csv, visual_journal.csv and streaks.csv with `rows` rows each."""
+    rng = random.Random(seed)
+    common = random.Random(seed + 1)  # separate, so the rest of the dataset stays as it was
+    vocab = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9))) for _ in range(2000)]
+    start = datetime(2020, 1, 1)
+    with open(os.path.join(directory, "journal.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["timestamp", "text", "mood", "polarity"])
+        for i in range(rows):
+            p = rng.uniform(-1, 1)
+            w.writerow([
+                (start + timedelta(minutes=7 * i)).strftime("%Y-%m-%d %H:%M"),
+                " ".join(rng.choices(vocab, k=rng.randint(8, 40))
+                         + [word for word, share in COMMON_WORDS for _ in range(3) if common.random() < share]),
+                "happy" if p > 0.25 else ("sad" if p < -0.25 else "neutral"),
+                f"{p:.3f}",
+            ])
+    with open(os.path.join(directory, "visual_journal.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["timestamp", "image_path", "caption"])
+        for i in range(rows):
+            w.writerow([(start + timedelta(minutes=7 * i)).strftime("%Y-%m-%d %H:%M"), "", " ".join(rng.choices(vocab, k=6))])
+    tasks = min(50, max(1, rows // 100))
+    per_task = rows // tasks
+    with open(os.path.join(directory, "streaks.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["task", "date"])
+        for t in range(tasks):
+            day = start.date()
+            for _ in range(per_task):
+                # Mostly consecutive days with an occasional gap
+                day += timedelta(days=1 if rng.random() < 0.9 else 2)
+                w.writerow([f"habit-{t}", day.isoformat()])
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples
+
+def record(results, backend, rows, op, samples):
+    results.append({
+        "backend": backend, "rows": rows, "op": op, "repeat": len(samples),
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+    })
+    print(f"{backend:>7} {rows:>8} {op:<28} median {statistics.median(samples):10.3f} ms", file=sys.stderr)
+
+def run_worker(backend, sizes):
+    """Benchmark one backend in this process; returns result records."""
+    sys.path.insert(0, ROOT)
+    import app
+
+    app._backends["textblob"] = StubTextBlob
+    results = []
+    for rows in sizes:
+        directory = tempfile.mkdtemp(prefix=f"mindmate-bench-{backend}-{rows}-")
+        try:
+            write_dataset(directory, rows)
+            journal_path = os.path.join(directory, "journal.csv")
+            reps = 3 if rows < 1000000 else 1
+
+            loaded = []
+            record(results, backend, rows, "load_rows", timed(lambda: loaded.append(app.load_rows(journal_path)), reps))
+            copy_path = os.path.join(directory, "journal_copy.csv")
+            record(results, backend, rows, "save_rows", timed(lambda: app.save_rows(copy_path, app.JOURNAL_HEADER, loaded[-1]), reps))
+            del loaded[:]
+            os.remove(copy_path)
+
+            # First open migrates CSV (SQLite) or builds the column cache (CSV); the second reuses it
+            app.shard_dir = lambda user_id: directory
+            user_id = f"user:bench-{rows}"
+            for op in ("open_store_first", "open_store"):
+                with app.as_user(user_id) as user:
+                    record(results, backend, rows, op, timed(lambda: user.store, 1))
+                    if op == "open_store_first":
+                        user.close()
+
+            with app.as_user(user_id) as user:
+                record(results, backend, rows, "get_streak_summary_first", timed(app.get_streak_summary, 1))
+                record(results, backend, rows, "get_streak_summary", timed(app.get_streak_summary, 20))
+                record(results, backend, rows, "streaks_status", timed(app.streaks_status, 20))
+                record(results, backend, rows, "show_journal_first", timed(app.show_journal, 1))
+                record(results, backend, rows, "show_journal", timed(app.show_journal, 20))
+                record(results, backend, rows, "growth_report", timed(app.growth_report, 20))
+                rare = app.theme_words(user.store.latest_journal()[1])[0]
+                for op, query in SEARCHES:
+                    record(results, backend, rows, op, timed(lambda: user.store.search(query.format(rare=rare)), 20))
+                texts = iter([f"benchmark entry {i} felt calm after a long walk" for i in range(CALLS)])
+                record(results, backend, rows, "journal_entry", timed(lambda: app.journal_entry(next(texts)), CALLS))
+                tasks = iter([f"bench-task-{i}" for i in range(CALLS)])
+                record(results, backend, rows, "streak_mark", timed(lambda: app.streak_mark(next(tasks)), CALLS))
+                record(results, backend, rows, "writer_flush", timed(user.store.flush, 1))
+                record(results, backend, rows, "show_journal_after_write", timed(app.show_journal, 1))
+                user.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Print median ratios against a previous run; return the number of regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["backend"], r["rows"], r["op"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    for r in results:
+        old = baseline.get((r["backend"], r["rows"], r["op"]))
+        if not old or not old["median_ms"]:
+            continue
+        ratio = r["median_ms"] / old["median_ms"]
+        flag = "REGRESSION" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['backend']:>7} {r['rows']:>8} {r['op']:<28} {old['median_ms']:10.3f} -> {r['median_ms']:10.3f} ms  x{ratio:5.2f} {flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="MindMate data-path benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--backends", nargs="+", default=["csv", "sqlite"], choices=["csv", "sqlite"])
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="previous JSON results to compare medians against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="median ratio reported as a regression")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(run_worker(args.worker, args.sizes), sys.stdout)
+        return 0
+
+    results = []
+    for backend in args.backends:
+        env = dict(os.environ, MINDMATE_STORAGE=backend, MINDMATE_TTS_DELIVERY="memory", MINDMATE_DEFERRED_TTS="0",
+                   MINDMATE_TTS_ENGINE="fake", MINDMATE_TTS_PROCESSES="0")
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend, "--sizes", *map(str, args.sizes)],
+            env=env, stdout=subprocess.PIPE, text=True, check=True,
+        ).stdout
+        # The app may print to stdout while importing; the results are the last line
+        results.extend(json.loads(out.strip().splitlines()[-1]))
+
+    report = {
+        "suite": "data-path",
+        "schema": 1,
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "sizes": args.sizes,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Benchmark the compiled chatbot intent matcher against a naive per-intent
+keyword scan, for the shipped INTENTS table and synthetic tables of up to
+hundreds of intents, on inputs with keywords and without (the scan's worst
+case). The matcher is checked against the scan on every input.
+
+    python benchmarks/bench_intents.py [--intents 50 200 800] [--chars 1000 20000]
+"""
+import os
+import sys
+import time
+import random
+import functools
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import INTENTS, IntentMatcher
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+def synthetic_intents(n, keywords_per_intent=5, seed=0):
+    rng = random.Random(seed)
+    return [
+        {"name": f"intent{i}", "priority": rng.randint(0, 100), "replies": [f"reply {i}"],
+         "keywords": ["".join(rng.choices(LETTERS, k=rng.randint(4, 9))) for _ in range(keywords_per_intent)]}
+        for i in range(n)
+    ]
+
+def synthetic_text(chars, intents, seed=1, keyword_rate=0.02):
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < chars:
+        if rng.random() < keyword_rate:
+            w = rng.choice(rng.choice(intents)["keywords"])
+        else:
+            w = "".join(rng.choices(LETTERS, k=rng.randint(2, 8)))
+        words.append(w)
+        size += len(w) + 1
+    return " ".join(words)
+
+def naive_match(intents, text):
+    lower = text.lower()
+    best = None
+    for rank, intent in enumerate(intents):
+        if any(w in lower for w in intent["keywords"]):
+            if best is None or intent["priority"] > intents[best]["priority"]:
+                best = rank
+    return intents[best] if best is not None else None
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--intents", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--chars", type=int, nargs="+", default=[200, 5000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tables = [("shipped", INTENTS)] + [(str(n), synthetic_intents(n)) for n in args.intents]
+    # "miss" inputs contain no keyword
+    print(f"{'intents':>8} {'chars':>8} {'compile ms':>11} {'compiled ms':>12} {'naive ms':>10} "
+          f"{'miss compiled':>14} {'miss naive':>11}")
+    for name, intents in tables:
+        t0 = time.perf_counter()
+        matcher = IntentMatcher(intents)
+        compile_ms = (time.perf_counter() - t0) * 1000.0
+        for chars in args.chars:
+            times = []
+            for rate in (0.02, 0.0):
+                sample = synthetic_text(chars, intents, keyword_rate=rate)
+                got = matcher.match(sample)
+                want = naive_match(intents, sample)
+                assert (got and got["priority"]) == (want and want["priority"]), "matcher disagrees with naive scan"
+                times.append(timed(functools.partial(matcher.match, sample), args.repeat))
+                times.append(timed(functools.partial(naive_match, intents, sample), args.repeat))
+            print(f"{name:>8} {chars:>8} {compile_ms:>11.2f} {times[0]:>12.3f} {times[1]:>10.3f} "
+                  f"{times[2]:>14.3f} {times[3]:>11.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Load test for the event lanes: flood the TTS lane with replies that always
+miss the speech cache, synthesized by a deliberately slow "fake" engine,
+and check that emergency help still answers within a latency bound.
+
+    python benchmarks/load_lanes.py
+    python benchmarks/load_lanes.py --clients 64 --tts-delay 1.0 --bound 0.5 --output lanes.json
+
+The app runs as a subprocess on a free port, the same way it is deployed,
+and is driven over Gradio's REST protocol (POST /call/<api_name>, then read
+the event stream) with plain urllib, which keeps the load generator itself
+light enough not to starve a small server. Apart from the engine, the app
+runs on its defaults (TTS worker processes, speech served as files), with
+its data in a temporary directory (MINDMATE_DATA_DIR) removed afterwards.
+Exits non-zero when the slowest emergency response exceeds --bound.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import statistics
+import threading
+import tempfile
+import subprocess
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_app(port, args, data_dir):
+    env = dict(os.environ, PORT=str(port), MINDMATE_TTS_ENGINE="fake", MINDMATE_TTS_FAKE_DELAY=str(args.tts_delay),
+               MINDMATE_DATA_DIR=data_dir, GRADIO_ANALYTICS_ENABLED="False",
+               MINDMATE_AUTH="")  # no login, so the probes and /metrics need no credentials
+    for name in ("MINDMATE_TTS_PROCESSES", "MINDMATE_TTS_DELIVERY"):
+        env.pop(name, None)
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py")], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"app exited during startup with code {proc.returncode}")
+        try:
+            urllib.request.urlopen(url + "metrics", timeout=1).read()
+            return proc, url
+        except Exception:
+            time.sleep(0.5)
+    proc.kill()
+    raise SystemExit("app did not start in time")
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+def call(url, api_name, data, timeout=120):
+    """Run one Gradio event to completion and return its final outputs."""
+    req = urllib.request.Request(url + f"call/{api_name}", data=json.dumps({"data": data}).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        event_id = json.load(r)["event_id"]
+    event = None
+    with urllib.request.urlopen(url + f"call/{api_name}/{event_id}", timeout=timeout) as r:
+        for line in r:
+            line = line.decode("utf-8").strip()
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event in ("complete", "error"):
+                if event == "error":
+                    raise RuntimeError(f"{api_name} failed: {line[5:].strip()}")
+                return json.loads(line[5:])
+    raise RuntimeError(f"{api_name} stream ended without a result")
+
+def probe(url, count, interval):
+    """Time `count` emergency_help calls, one every `interval` seconds."""
+    samples = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        reply, _audio = call(url, "emergency_help", [])
+        samples.append(time.perf_counter() - t0)
+        assert reply, "empty emergency reply"
+        time.sleep(interval)
+    return samples
+
+def flood(url, clients):
+    """Keep `clients` clients sending cognitive_reframe until SIGTERM; print their latencies as JSON."""
+    import signal
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    samples, errors = [], []
+    def run(worker):
+        i = 0
+        while not stop.is_set():
+            # Unique text, so every reply misses the speech cache
+            t0 = time.perf_counter()
+            try:
+                call(url, "cognitive_reframe", [f"load client {worker} thought {i}: I always get everything wrong"])
+                if not stop.is_set():
+                    samples.append(time.perf_counter() - t0)
+            except Exception:
+                if not stop.is_set():
+                    errors.append(1)
+            i += 1
+    for w in range(clients):
+        threading.Thread(target=run, args=(w,), daemon=True).start()
+    while not stop.wait(0.2):
+        pass
+    print(json.dumps({"samples": list(samples), "errors": len(errors)}))
+
+def main():
+    parser = argparse.ArgumentParser(description="MindMate lane load test")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients flooding the TTS lane")
+    parser.add_argument("--tts-delay", type=float, default=0.5, help="seconds per synthesis for the fake engine")
+    parser.add_argument("--probes", type=int, default=40, help="emergency_help calls measured under load")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between emergency_help calls")
+    parser.add_argument("--bound", type=float, default=1.0, help="max emergency_help latency allowed, seconds")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--flood", metavar="URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.flood:
+        flood(args.flood, args.clients)
+        return 0
+
+    data_dir = tempfile.mkdtemp(prefix="mindmate-lanes-")
+    try:
+        proc, url = start_app(free_port(), args, data_dir)
+    except BaseException:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        raise
+    try:
+        idle = probe(url, 10, 0.0)
+
+        # The flood runs in its own process, so its threads don't share a GIL with the probe
+        flooder = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--flood", url, "--clients", str(args.clients)],
+                                 stdout=subprocess.PIPE, text=True)
+        time.sleep(max(3.0, 4 * args.tts_delay))  # let the TTS lane fill and back up
+        loaded = probe(url, args.probes, args.interval)
+        flooder.terminate()
+        load = json.loads(flooder.communicate(timeout=60)[0].strip().splitlines()[-1])
+        metrics = urllib.request.urlopen(url + "metrics", timeout=5).read().decode()
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "suite": "lanes",
+        "schema": 1,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "params": vars(args),
+        "emergency_idle": summarize(idle),
+        "emergency_under_load": summarize(loaded),
+        "tts_lane_load": dict(summarize(load["samples"]), errors=load["errors"]),
+        "tts_syntheses": sum(float(line.rsplit(" ", 1)[1]) for line in metrics.splitlines()
+                             if line.startswith("mindmate_tts_seconds_count")),
+    }
+    worst = report["emergency_under_load"]["max_ms"] / 1000
+    report["bound_s"] = args.bound
+    report["passed"] = worst <= args.bound
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    print(f"emergency_help under load: p95 {report['emergency_under_load']['p95_ms']} ms, max {worst * 1000:.1f} ms "
+          f"(bound {args.bound * 1000:.0f} ms) while TTS-lane replies took p50 {report['tts_lane_load'].get('p50_ms')} ms "
+          f"-> {'PASS' if report['passed'] else 'FAIL'}", file=sys.stderr)
+    return 0 if report["passed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# mindmate_workers.py — entry points for MindMate's worker processes
+#
+# Process pools start their workers from a fresh interpreter, and each worker
+# imports the module its tasks live in. Keeping them here, with nothing but
+# the standard library imported up front, means a worker never loads gradio,
+# builds the UI or parses app.py's settings; the backend a task needs
+# (TextBlob, Pillow, gTTS, NumPy) is imported on its first use instead.
+
+import io
+import os
+import time
+import wave
+import shutil
+import hashlib
+import importlib
+import subprocess
+
+_backends = {}
+
+def _backend(module, attr):
+    """module.attr, imported on first use; None if the package is missing."""
+    if module not in _backends:
+        try:
+            _backends[module] = getattr(importlib.import_module(module), attr)
+        except Exception:
+            _backends[module] = None
+    return _backends[module]
+
+# ---------------------------
+# Sentiment
+# ---------------------------
+def polarity(TextBlob, text):
+    """TextBlob polarity in [-1, 1]; 0.0 for blank text or when TextBlob is None."""
+    if TextBlob is None or not (text or "").strip():
+        return 0.0
+    try:
+        return TextBlob(text).sentiment.polarity
+    except Exception:
+        return 0.0
+
+def polarity_chunk(texts):
+    TextBlob = _backend("textblob", "TextBlob")
+    return [polarity(TextBlob, t) for t in texts]
+
+# ---------------------------
+# Speech
+# ---------------------------
+FAKE_RATE = 8000
+# Seconds to sleep per fake synthesis, to stand in for a slow engine under load tests
+FAKE_DELAY = float(os.environ.get("MINDMATE_TTS_FAKE_DELAY", "0"))
+
+def espeak_binary():
+    return shutil.which("espeak-ng") or shutil.which("espeak")
+
+def _gtts(text, lang, slow):
+    buf = io.BytesIO()
+    _backend("gtts", "gTTS")(text=text, lang=lang, slow=bool(slow)).write_to_fp(buf)
+    return buf.getvalue()
+
+def _espeak(text, lang, slow):
+    # Text goes in on stdin so it can never be read as an option
+    out = subprocess.run(
+        [espeak_binary(), "-v", lang, "-s", "130" if slow else "170", "--stdin", "--stdout"],
+        input=text.encode("utf-8"), capture_output=True, check=True, timeout=60,
+    )
+    return out.stdout
+
+def _fake(text, lang, slow):
+    import numpy as np
+    if FAKE_DELAY:
+        time.sleep(FAKE_DELAY)
+    digest = hashlib.sha256(f"{lang}|{bool(slow)}|{text}".encode("utf-8")).digest()
+    seconds = min(0.2 + 0.02 * len(text), 5.0) * (1.5 if slow else 1.0)
+    t = np.arange(int(FAKE_RATE * seconds)) / FAKE_RATE
+    samples = (np.sin(2 * np.pi * (220 + 2 * digest[0]) * t) * 8000).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(FAKE_RATE)
+        w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+SYNTHESIZERS = {"gtts": _gtts, "espeak": _espeak, "fake": _fake}
+
+def synthesize(engine, text, lang, slow):
+    """Audio bytes for text from the named engine (see app.TTS_ENGINES)."""
+    return SYNTHESIZERS[engine](text, lang, slow)
+
+# ---------------------------
+# Images
+# ---------------------------
+def make_thumbnail(src, dst, size):
+    from PIL import Image, ImageOps
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with Image.open(src) as im:
+        im.draft("RGB", (size, size))  # JPEGs decode straight at reduced scale
+        thumb = ImageOps.exif_transpose(im)
+        thumb.thumbnail((size, size))
+        if thumb.mode not in ("RGB", "L"):
+            thumb = thumb.convert("RGB")
+        thumb.save(tmp, "JPEG", quality=80)
+    os.replace(tmp, dst)
+    return dst
@@ -0,0 +1,28 @@
+"""
+Shared setup: app.py reads its configuration at import, so the data
+directory and the backends are pointed somewhere harmless before the first
+test imports it.
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_DATA_DIR = tempfile.mkdtemp(prefix="mindmate-tests-")
+os.environ["MINDMATE_DATA_DIR"] = _DATA_DIR
+os.environ.setdefault("MINDMATE_TTS_ENGINE", "fake")
+os.environ.setdefault("MINDMATE_TTS_PROCESSES", "0")
+os.environ.setdefault("GRADIO_ANALYTICS_ENABLED", "False")
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
+
+@pytest.fixture(scope="session")
+def app():
+    import app as module
+    return module
@@ -0,0 +1,160 @@
+import json
+import math
+import random
+import re
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+# Stopwords as growth_report listed them before theme_words
+STOPWORDS = set("a an the and or but if while to from of in on for with at by is it this that these those am are was were be been being i me my we our you your he she they them their as".split())
+WORDS = "calm tired work family walk sleep anxious friends music rain coffee proud".split()
+
+def entries(n, seed):
+    """(timestamp, text, mood, polarity) rows spread unevenly over about two months."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, 8, 0)
+    rows = []
+    for _ in range(n):
+        ts = start + timedelta(days=rng.choice([rng.randrange(60), rng.randrange(5)]), minutes=rng.randrange(900))
+        text = "I was " + " and ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5)))
+        p = round(rng.uniform(-1, 1), 3)
+        rows.append((ts.strftime("%Y-%m-%d %H:%M"), text, "neutral", p))
+    return rows
+
+def reference_growth(rows, top=6):
+    """Average polarity and common themes as growth_report computed them from the full journal."""
+    words = Counter()
+    for _, text, _, _ in rows:
+        words.update(theme_words_reference(text))
+    return sum(p for *_, p in rows) / len(rows), len(rows), [w for w, _ in words.most_common(top)]
+
+def theme_words_reference(text):
+    return [w for w in re.findall(r"[A-Za-z']+", (text or "").lower()) if w not in STOPWORDS and len(w) > 2]
+
+def reference_days(rows):
+    """{day ordinal: [polarity, ...]} for rows with a regular timestamp."""
+    days = {}
+    for ts, _, _, p in rows:
+        days.setdefault(date.fromisoformat(ts[:10]).toordinal(), []).append(p)
+    return days
+
+def assert_growth(summary, expected):
+    assert summary[1] == expected[1]
+    assert summary[0] == pytest.approx(expected[0])
+    assert summary[2] == expected[2]
+
+def test_growth_aggregate_matches_reference(app):
+    rows = entries(300, 3)
+    growth = app.GrowthAggregate()
+    for _, text, _, p in rows:
+        growth.add(text, p)
+    assert_growth(growth.summary(), reference_growth(rows))
+    assert_growth(app.GrowthAggregate.from_dict(growth.to_dict()).summary(), reference_growth(rows))
+    assert app.GrowthAggregate().summary() == (None, 0, [])
+
+def test_mood_series_add_matches_from_entries(app):
+    rows = entries(300, 4)
+    built = app.MoodSeries.from_entries(
+        [date.fromisoformat(ts[:10]).toordinal() for ts, *_ in rows], [p for *_, p in rows]
+    )
+    grown = app.MoodSeries()
+    for ts, _, _, p in rows:
+        grown.add(ts, p)
+    grown.add("not a timestamp", 1.0)
+    for a, b in zip(built.snapshot(), grown.snapshot()):
+        np.testing.assert_allclose(a, b)
+
+def test_mood_series_views_match_reference(app):
+    rows = entries(300, 5)
+    by_day = reference_days(rows)
+    series = app.MoodSeries()
+    for ts, _, _, p in rows:
+        series.add(ts, p)
+    days, counts, sums = series.snapshot()
+    assert list(days) == sorted(by_day)
+    last = max(by_day)
+
+    for window in (7, 30):
+        recent = [p for d, ps in by_day.items() if d > last - window for p in ps]
+        mean, n = app.MoodSeries.window_mean(days, counts, sums, window)
+        assert n == len(recent)
+        assert mean == pytest.approx(sum(recent) / len(recent))
+
+    weeks, n, weekly = app.MoodSeries.weekly(days, counts, sums)
+    by_week = {}
+    for d, ps in by_day.items():
+        by_week.setdefault(d - date.fromordinal(d).weekday(), []).extend(ps)
+    assert list(weeks) == sorted(by_week)
+    assert list(n) == [len(by_week[w]) for w in sorted(by_week)]
+    np.testing.assert_allclose(weekly, [sum(by_week[w]) / len(by_week[w]) for w in sorted(by_week)])
+
+    span, rolling = app.MoodSeries.rolling(days, counts, sums, 7)
+    assert list(span) == list(range(min(by_day), last + 1))
+    for d, value in zip(span, rolling):
+        window = [p for o in range(d - 6, d + 1) for p in by_day.get(o, [])]
+        if window:
+            assert value == pytest.approx(sum(window) / len(window))
+        else:
+            assert math.isnan(value)
+
+def test_mood_trend(app):
+    days = np.arange(100, 110)
+    counts = np.ones(10, dtype=np.int64)
+    # Daily mean rising by 0.01 a day is 0.07 a week
+    assert app.MoodSeries.trend(days, counts, 0.01 * np.arange(10)) == pytest.approx(0.07)
+    assert app.MoodSeries.trend(days[:2], counts[:2], np.zeros(2)) is None
+    assert app.MoodSeries.trend(days[:0], counts[:0], np.zeros(0)) is None
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_storage_growth_matches_reference(app, tmp_path, backend):
+    rows = entries(120, 6)
+    store = app.open_storage(str(tmp_path), backend)
+    try:
+        for row in rows[:80]:
+            store.add_journal(*row)
+        series = store.mood_series()
+        for row in rows[80:]:
+            store.add_journal(*row)
+        store.flush()
+        assert_growth(store.growth_summary(6), reference_growth(rows))
+        expected = reference_days(rows)
+        days, counts, sums = series.snapshot()
+        assert list(days) == sorted(expected)
+        assert list(counts) == [len(expected[d]) for d in sorted(expected)]
+        np.testing.assert_allclose(sums, [sum(expected[d]) for d in sorted(expected)])
+    finally:
+        store.close()
+
+    store = app.open_storage(str(tmp_path), backend)
+    try:
+        assert_growth(store.growth_summary(6), reference_growth(rows))
+        assert store.rebuild_growth() == len(rows)
+        assert_growth(store.growth_summary(6), reference_growth(rows))
+        for a, b in zip(series.snapshot(), store.mood_series().snapshot()):
+            np.testing.assert_allclose(a, b)
+    finally:
+        store.close()
+
+def test_csv_growth_replays_entries_past_the_saved_count(app, tmp_path):
+    rows = entries(40, 7)
+    store = app.open_storage(str(tmp_path), "csv")
+    try:
+        for row in rows:
+            store.add_journal(*row)
+        store.flush()
+    finally:
+        store.close()
+    # As if the process died after the writer's save at 25 entries
+    growth = app.GrowthAggregate()
+    for _, text, _, p in rows[:25]:
+        growth.add(text, p)
+    with open(tmp_path / "growth.json", "w", encoding="utf-8") as f:
+        json.dump(growth.to_dict(), f)
+    store = app.open_storage(str(tmp_path), "csv")
+    try:
+        assert_growth(store.growth_summary(6), reference_growth(rows))
+    finally:
+        store.close()
@@ -0,0 +1,53 @@
+import csv
+from collections import Counter
+
+import pytest
+
+def write_source(path, n):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["timestamp", "text"])
+        for i in range(n):
+            # Every fifth entry has no time and gets the import's start time
+            w.writerow(["" if i % 5 == 0 else f"2023-03-{1 + i // 24:02d} {i % 24:02d}:00", f"imported entry {i}"])
+
+class Crash(Exception):
+    pass
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_import_resumes_after_crash_without_duplicates(app, tmp_path, monkeypatch, backend):
+    source = tmp_path / "history.csv"
+    write_source(source, 95)
+    shard = tmp_path / "shard"
+    shard.mkdir()
+
+    store = app.open_storage(str(shard), backend)
+    store.add_journal("2023-01-01 09:00", "written before the import", "neutral", 0.0)
+    add_journal = store.add_journal
+    calls = []
+    def crashing_add(*args):
+        calls.append(args)
+        add_journal(*args)
+        if len(calls) == 47:
+            # The writer committed part of the third chunk, then the process died
+            store.flush()
+            raise Crash()
+    monkeypatch.setattr(store, "add_journal", crashing_add)
+    with pytest.raises(Crash):
+        app.import_journal(store, str(source), chunk_size=20)
+    monkeypatch.undo()
+    store.close()
+
+    store = app.open_storage(str(shard), backend)
+    try:
+        state = app.import_journal(store, str(source), chunk_size=20)
+        assert state["done"] and state["imported"] == 95 and state["skipped"] == 0
+        texts = Counter(text for _, text, _, _ in store.iter_journal())
+        assert texts == Counter(["written before the import"] + [f"imported entry {i}" for i in range(95)])
+        # Entries without a time got the same one in both runs
+        assert len({ts for ts, text, _, _ in store.iter_journal() if text.endswith(("entry 0", "entry 45"))}) == 1
+        # Finished imports are not repeated
+        assert app.import_journal(store, str(source), chunk_size=20)["imported"] == 95
+        assert store.journal_count() == 96
+    finally:
+        store.close()
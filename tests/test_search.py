@@ -0,0 +1,106 @@
+import json
+import math
+import time
+import random
+from collections import Counter
+
+import pytest
+
+VOCAB = ["calm", "walk", "tired", "work", "sleep", "friend", "rain", "music"]
+
+def corpus(n, seed=7):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        # Each word 0-6 times, so most terms have six tf weights
+        words = [w for w in VOCAB for _ in range(rng.choice([0, 1, 1, 2, 3, 4, 5, 6]))]
+        rng.shuffle(words)
+        texts.append(" ".join(words) or "nothing")
+    return texts
+
+def reference(app, texts, query, keep=None, limit=None):
+    """Every entry scored directly from its term counts: the ranking search must reproduce."""
+    terms, phrases = app.parse_query(query)
+    tokens = sorted(set(terms).union(*phrases))
+    counts = [Counter(app.theme_words(t)) for t in texts]
+    df = {t: sum(1 for c in counts if c[t]) for t in tokens}
+    if not tokens or not all(df.values()):
+        return []
+    ranked = []
+    for e, (text, c) in enumerate(zip(texts, counts)):
+        if not all(c[t] for t in tokens) or (keep is not None and not keep(e)):
+            continue
+        words = app.theme_words(text)
+        if not all(any(words[i:i + len(p)] == p for i in range(len(words))) for p in phrases):
+            continue
+        ranked.append((sum(app.tf_weight(c[t]) * math.log(1 + len(texts) / df[t]) for t in tokens), e))
+    ranked.sort(reverse=True)
+    return ranked[:limit] if limit is not None else ranked
+
+@pytest.fixture(scope="module")
+def index(app):
+    texts = corpus(400)
+    index = app.SearchIndex()
+    for text in texts:
+        index.add(text)
+    return texts, index
+
+@pytest.mark.parametrize("query", ["calm", "calm walk", "tired work sleep", '"calm walk"', "calm walk tired work sleep friend"])
+@pytest.mark.parametrize("combos_max", [0, 10 ** 9])
+def test_rank_matches_agrees_with_reference(app, index, monkeypatch, query, combos_max):
+    # combos_max 0 always intersects; 10**9 always walks the weight combinations
+    monkeypatch.setattr(app, "SEARCH_COMBOS_MAX", combos_max)
+    texts, idx = index
+    terms, phrases = app.parse_query(query)
+    for keep in (None, lambda e: e % 3 == 0):
+        assert app.rank_matches(idx, idx.count, terms, phrases, keep, 20) == reference(app, texts, query, keep, 20)
+
+@pytest.mark.parametrize("n_terms", [6, 8])
+def test_rank_matches_many_terms_is_bounded(app, n_terms):
+    texts = corpus(5000)
+    idx = app.SearchIndex()
+    for text in texts:
+        idx.add(text)
+    terms = VOCAB[:n_terms]
+    assert all(len(idx.levels(t)) >= 5 for t in terms)
+    started = time.perf_counter()
+    # A filter that matches nothing forces every candidate to be read
+    assert app.rank_matches(idx, idx.count, terms, [], lambda e: False, 20) == []
+    found = app.rank_matches(idx, idx.count, terms, [], None, 20)
+    assert time.perf_counter() - started < 1.0
+    assert found == reference(app, texts, " ".join(terms), None, 20)
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+@pytest.mark.parametrize("query", ["walk", "rain music", '"sleep friend" calm', "calm walk tired work sleep friend rain music"])
+def test_storage_search_agrees_with_reference(app, tmp_path, backend, query):
+    texts = corpus(200, seed=11)
+    store = app.open_storage(str(tmp_path), backend)
+    try:
+        for i, text in enumerate(texts):
+            store.add_journal(f"2024-01-{1 + i // 24:02d} {i % 24:02d}:00", text, "neutral", 0.0)
+        got = store.search(query, limit=20)
+        want = reference(app, texts, query, None, 20)
+        assert [row[1] for _, row in got] == [texts[e] for _, e in want]
+        assert [score for score, _ in got] == pytest.approx([score for score, _ in want])
+    finally:
+        store.close()
+
+def test_csv_search_index_survives_reopen(app, tmp_path):
+    texts = corpus(120, seed=3)
+    store = app.open_storage(str(tmp_path), "csv")
+    for i, text in enumerate(texts[:80]):
+        store.add_journal(f"2024-02-01 00:{i:02d}", text, "neutral", 0.0)
+    store.search("calm")  # loads the index, so close() saves it
+    store.close()
+    with open(tmp_path / "search.json", encoding="utf-8") as f:
+        assert app.SearchIndex.from_dict(json.load(f)).count == 80
+
+    store = app.open_storage(str(tmp_path), "csv")
+    try:
+        for i, text in enumerate(texts[80:], 80):
+            store.add_journal(f"2024-02-02 00:{i - 80:02d}", text, "neutral", 0.0)
+        # Entries past the saved count are indexed again from the journal
+        got = store.search("rain walk", limit=20)
+        assert [row[1] for _, row in got] == [texts[e] for _, e in reference(app, texts, "rain walk", None, 20)]
+    finally:
+        store.close()
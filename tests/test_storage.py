@@ -0,0 +1,233 @@
+import csv
+import os
+import threading
+
+import pytest
+
+def write_csv(path, header, rows, tail=""):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+        f.write(tail)
+
+def journal_rows(n, start=0):
+    return [(f"2024-02-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}", f"entry {i} — ünïcode", "neutral", i / 100) for i in range(start, start + n)]
+
+# ---------------------------
+# AppendLog and compaction
+# ---------------------------
+def test_torn_record_is_cut_before_the_next_append(app, tmp_path):
+    path = str(tmp_path / "streaks.csv")
+    write_csv(path, app.STREAKS_HEADER, [("walk", "2024-01-01"), ("read", "2024-01-02")], tail='stretch,"2024-01')
+    try:
+        assert app.load_rows(path) == [["walk", "2024-01-01"], ["read", "2024-01-02"]]
+        assert path in app._needs_compaction
+        app.append_rows(path, app.STREAKS_HEADER, [("water", "2024-01-03")])
+        app.APPEND_LOG.close(path)
+        assert app.load_rows(path) == [["walk", "2024-01-01"], ["read", "2024-01-02"], ["water", "2024-01-03"]]
+    finally:
+        app.APPEND_LOG.close(path)
+        app._needs_compaction.discard(path)
+
+def test_append_reports_sizes(app, tmp_path):
+    path = str(tmp_path / "journal.csv")
+    try:
+        first = app.append_rows(path, app.JOURNAL_HEADER, journal_rows(2))
+        second = app.append_rows(path, app.JOURNAL_HEADER, journal_rows(1, 2))
+        # A new file's size before the append counts the header written with it
+        assert first[0] == len(",".join(app.JOURNAL_HEADER)) + 2 and second[0] == first[1]
+        app.APPEND_LOG.close(path)
+        assert second[1] == os.path.getsize(path)
+    finally:
+        app.APPEND_LOG.close(path)
+
+def test_compaction_drops_malformed_and_duplicate_rows(app, tmp_path):
+    path = str(tmp_path / "streaks.csv")
+    rows = [("walk", "2024-01-01"), ("walk", "2024-01-01", "extra"), ("read", "2024-01-01"), ("walk", "2024-01-01")]
+    write_csv(path, app.STREAKS_HEADER, rows, tail="torn")
+    app.load_rows(path)
+    assert path in app._needs_compaction
+    thread = app.start_compaction([(path, app.STREAKS_HEADER, tuple)])
+    thread.join(10)
+    assert path not in app._needs_compaction
+    with open(path, newline="", encoding="utf-8") as f:
+        assert list(csv.reader(f)) == [app.STREAKS_HEADER, ["walk", "2024-01-01"], ["read", "2024-01-01"]]
+    assert app.start_compaction([(path, app.STREAKS_HEADER, tuple)]) is None
+
+def test_csv_storage_recovers_a_torn_journal(app, tmp_path):
+    rows = journal_rows(5)
+    write_csv(tmp_path / "journal.csv", app.JOURNAL_HEADER, rows, tail="2024-03-01 10:00,half written")
+    store = app.open_storage(str(tmp_path), "csv")
+    try:
+        assert list(store.iter_journal()) == rows
+        store.add_journal("2024-03-02 10:00", "after the crash", "neutral", 0.0)
+    finally:
+        store.close()
+    assert app.load_rows(str(tmp_path / "journal.csv"))[-1] == ["2024-03-02 10:00", "after the crash", "neutral", "0.0"]
+    assert len(app.load_rows(str(tmp_path / "journal.csv"))) == 6
+
+# ---------------------------
+# JournalColumns cache
+# ---------------------------
+def open_columns(app, path):
+    columns = app.JournalColumns(str(path))
+    return columns, list(columns)
+
+def cached_columns(app, path, monkeypatch):
+    """JournalColumns for path, failing the test if it had to rebuild from the CSV."""
+    def rebuild(self):
+        raise AssertionError("columns were rebuilt")
+    with monkeypatch.context() as m:
+        m.setattr(app.JournalColumns, "_rebuild", rebuild)
+        return open_columns(app, path)
+
+def test_columns_round_trip_through_the_cache(app, tmp_path, monkeypatch):
+    path = tmp_path / "journal.csv"
+    rows = journal_rows(50) + [("yesterday-ish", "odd timestamp", "custom mood", -0.5)]
+    write_csv(path, app.JOURNAL_HEADER, rows)
+    columns, loaded = open_columns(app, path)
+    assert loaded == rows
+    columns.save()
+    columns.close()
+    columns, loaded = cached_columns(app, path, monkeypatch)
+    assert loaded == rows
+    assert columns.text(3) == rows[3][1]
+    columns.close()
+
+def test_columns_catch_up_with_rows_appended_elsewhere(app, tmp_path, monkeypatch):
+    path = tmp_path / "journal.csv"
+    write_csv(path, app.JOURNAL_HEADER, journal_rows(20))
+    columns, _ = open_columns(app, path)
+    columns.save()
+    columns.close()
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(journal_rows(5, 20))
+    columns, loaded = cached_columns(app, path, monkeypatch)
+    assert loaded == journal_rows(25)
+    columns.close()
+
+@pytest.mark.parametrize("change", ["same_size", "grown", "truncated"])
+def test_columns_rebuild_when_the_csv_was_rewritten(app, tmp_path, change):
+    path = tmp_path / "journal.csv"
+    rows = journal_rows(20)
+    write_csv(path, app.JOURNAL_HEADER, rows)
+    columns, _ = open_columns(app, path)
+    columns.save()
+    columns.close()
+    if change == "same_size":
+        rows[-1] = (rows[-1][0], rows[-1][1].replace("entry", "ENTRY"), *rows[-1][2:])
+        st = os.stat(path)
+        write_csv(path, app.JOURNAL_HEADER, rows)
+        assert os.path.getsize(path) == st.st_size
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    elif change == "grown":
+        rows[-1] = (rows[-1][0], "rewritten", *rows[-1][2:])
+        rows += journal_rows(10, 20)
+        write_csv(path, app.JOURNAL_HEADER, rows)
+    else:
+        rows = rows[:10]
+        write_csv(path, app.JOURNAL_HEADER, rows)
+    columns, loaded = open_columns(app, path)
+    assert loaded == rows
+    columns.close()
+
+def test_columns_cache_is_dropped_after_a_foreign_append(app, tmp_path):
+    path = tmp_path / "journal.csv"
+    write_csv(path, app.JOURNAL_HEADER, journal_rows(10))
+    columns, _ = open_columns(app, path)
+    # Another writer lands a row between our load and our own append
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(journal_rows(1, 10)[0])
+    row = journal_rows(1, 11)[0]
+    columns.append(row)
+    try:
+        columns.appended(app.append_rows(str(path), app.JOURNAL_HEADER, [row]))
+    finally:
+        app.APPEND_LOG.close(str(path))
+    columns.save()
+    columns.close()
+    assert not os.path.exists(tmp_path / "journal.cols")
+    columns, loaded = open_columns(app, path)
+    assert loaded == journal_rows(12)
+    columns.close()
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_storage_journal_survives_reopen(app, tmp_path, backend):
+    # Appended in two sessions, out of timestamp order
+    first, second = journal_rows(30, 10), journal_rows(10)
+    for rows in (first, second):
+        store = app.open_storage(str(tmp_path), backend)
+        try:
+            for row in rows:
+                store.add_journal(*row)
+        finally:
+            store.close()
+    store = app.open_storage(str(tmp_path), backend)
+    try:
+        everything = sorted(first + second, key=lambda r: r[0])
+        assert store.journal_count() == 40
+        assert [r[0] for r in store.iter_journal()] == [r[0] for r in everything]
+        assert sorted(store.iter_journal()) == sorted(everything)
+        assert list(store.journal_since(30)) == second
+        page, cursor = store.journal_page(limit=15)
+        assert [r[0] for r in page] == [r[0] for r in reversed(everything[-15:])]
+        assert cursor is not None
+    finally:
+        store.close()
+
+# ---------------------------
+# WriteQueue
+# ---------------------------
+class Recorder:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def _write_batch(self, ops):
+        self.batches.append(list(ops))
+        if self.fail:
+            raise OSError("disk full")
+
+def test_write_queue_batches_ops_per_store(app):
+    queue = app.WriteQueue(30)
+    a, b = Recorder(), Recorder()
+    for i in range(5):
+        queue.submit(a, ("journal", i))
+        queue.submit(b, ("streak", i))
+    assert queue.stats()["queue_depth"] == 10
+    # sync() does not wait out the interval
+    queue.sync(a)
+    assert a.batches == [[("journal", i) for i in range(5)]]
+    assert b.batches == [[("streak", i) for i in range(5)]]
+    stats = queue.stats()
+    assert stats["flushes"] == 1 and stats["ops_written"] == 10 and stats["queue_depth"] == 0
+
+def test_write_queue_coalesces_concurrent_submits(app):
+    queue = app.WriteQueue(0.2)
+    store = Recorder()
+    def submit(t):
+        for i in range(50):
+            queue.submit(store, (t, i))
+    threads = [threading.Thread(target=submit, args=(t,)) for t in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    queue.sync()
+    ops = [op for batch in store.batches for op in batch]
+    assert len(ops) == 200 and len(store.batches) < 200
+    for t in range(4):
+        assert [i for tag, i in ops if tag == t] == list(range(50))
+
+def test_write_queue_counts_errors_and_keeps_going(app):
+    queue = app.WriteQueue(0)
+    bad, good = Recorder(fail=True), Recorder()
+    queue.submit(bad, ("journal", 1))
+    queue.submit(good, ("journal", 2))
+    queue.sync()
+    assert good.batches == [[("journal", 2)]]
+    assert queue.stats()["errors"] == 1
+    queue.submit(good, ("journal", 3))
+    queue.sync()
+    assert good.batches[-1] == [("journal", 3)]
@@ -0,0 +1,81 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+def reference(rows, today):
+    """The streak summary as streaks_status computed it before StreakIndex: one pass over every row."""
+    by_task = {}
+    for task, day in rows:
+        by_task.setdefault(task, set()).add(day)
+    out = []
+    for task, days in by_task.items():
+        cur = 0
+        d = today
+        while d.isoformat() in days:
+            cur += 1
+            d -= timedelta(days=1)
+        longest = consec = 0
+        prev = None
+        for day in sorted(days):
+            o = date.fromisoformat(day)
+            consec = consec + 1 if prev is not None and (o - prev).days == 1 else 1
+            longest = max(longest, consec)
+            prev = o
+        out.append((task, cur, longest))
+    return out
+
+def marks(n, seed, today):
+    """(task, day) rows with gaps, repeats, back-filled days and a few days after today."""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        task = rng.choice(["walk", "read", "water", "stretch"])
+        day = today - timedelta(days=rng.choice([0, 0, 1, 1, 2, 3, 5, 8, 13, rng.randrange(60), -1]))
+        rows.append((task, day.isoformat()))
+    return rows
+
+@pytest.mark.parametrize("seed", range(8))
+def test_streak_index_matches_reference(app, seed):
+    today = date(2024, 3, 15)
+    rows = marks(200, seed, today)
+    assert app.StreakIndex(rows).summary(today) == reference(rows, today)
+    # Marked one at a time, as mark_streak does
+    index = app.StreakIndex()
+    for i, (task, day) in enumerate(rows):
+        fresh = not index.has(task, day)
+        assert index.add(task, day) == fresh
+        if i % 25 == 0:
+            assert index.summary(today) == reference(rows[:i + 1], today)
+    assert index.summary(today) == reference(rows, today)
+
+def test_streak_rolls_over_at_midnight(app):
+    index = app.StreakIndex([("walk", "2024-03-13"), ("walk", "2024-03-14")])
+    assert index.summary(date(2024, 3, 14)) == [("walk", 2, 2)]
+    assert index.summary(date(2024, 3, 15)) == [("walk", 0, 2)]
+    index.add("walk", "2024-03-15")
+    assert index.summary(date(2024, 3, 15)) == [("walk", 3, 3)]
+
+def test_streak_index_skips_bad_dates(app):
+    index = app.StreakIndex([("walk", "not a date"), ("walk", "2024-03-14"), ("walk", None)])
+    assert index.summary(date(2024, 3, 14)) == [("walk", 1, 1)]
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_marked_streaks_survive_reopen(app, tmp_path, backend):
+    today = date.today()
+    rows = marks(60, 1, today)
+    store = app.open_storage(str(tmp_path), backend)
+    try:
+        for task, day in rows:
+            store.mark_streak(task, day)
+        assert store.streak_index().summary(today) == reference(rows, today)
+    finally:
+        store.close()
+    store = app.open_storage(str(tmp_path), backend)
+    try:
+        assert sorted(store.iter_streaks()) == sorted(set(rows))
+        # SQLite gives tasks back in key order rather than first-marked order
+        assert sorted(store.streak_index().summary(today)) == sorted(reference(rows, today))
+        assert not store.mark_streak(*rows[0])
+    finally:
+        store.close()